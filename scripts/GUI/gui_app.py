@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
+import queue
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import sys
@@ -10,9 +11,77 @@ import os
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 sys.path.append(project_root)
 from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+from scripts.optimalization.nsga2 import TrafficLightsNSGA2
 from scripts.simulation.graphics import App, SimulationGraphic
 import pygame
 
+# Jak często (ms) główny wątek Tk odczytuje postęp z kolejki
+PROGRESS_POLL_MS = 100
+
+
+class LiveFitnessPlot:
+    def __init__(self, master) -> None:
+        """
+        Wykres fitness aktualizowany na bieżąco. Przerysowuje tylko linię
+        (blitting), całe osie tylko gdy dane wyjdą poza zakres.
+
+        Args:
+            master: widget Tk, w którym umieszczany jest wykres
+        """
+        self.fig, self.ax = plt.subplots(figsize=(5, 3))
+        self.ax.set_title("Postęp optymalizacji")
+        self.ax.set_xlabel("Liczba ocenionych planów")
+        self.ax.set_ylabel("Fitness")
+        self.ax.grid(True)
+        self.line, = self.ax.plot([], [], marker='o', markersize=3,
+                                  linestyle='-', color='b', animated=True)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+        self.canvas.get_tk_widget().grid(row=0, column=0)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.reset()
+
+    def reset(self) -> None:
+        self.x_values = []
+        self.y_values = []
+        self.line.set_data([], [])
+        self.ax.set_xlim(0, 1)
+        self.ax.set_ylim(0, 1)
+        self.canvas.draw()
+
+    def on_draw(self, event) -> None:
+        # Po pełnym przerysowaniu zapamiętaj tło bez linii
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+
+    def extend(self, points) -> None:
+        """
+        Dopisuje punkty (x, fitness) do wykresu.
+
+        Args:
+            points (list): nowe punkty
+        """
+        if not points:
+            return
+        for x, y in points:
+            self.x_values.append(x)
+            self.y_values.append(y)
+        self.line.set_data(self.x_values, self.y_values)
+        x_max = self.x_values[-1]
+        y_min, y_max = min(self.y_values), max(self.y_values)
+        x_low, x_high = self.ax.get_xlim()
+        y_low, y_high = self.ax.get_ylim()
+        if x_max > x_high or y_max > y_high or y_min < y_low:
+            # Zakres rośnie skokowo, żeby pełne przerysowania były rzadkie
+            margin = max((y_max - y_min) * 0.25, abs(y_max) * 0.05, 1e-9)
+            self.ax.set_xlim(0, max(x_high, x_max * 2))
+            self.ax.set_ylim(y_min - margin, y_max + margin)
+            self.canvas.draw()
+        elif self.background is not None:
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+
 
 class GUI:
     def __init__(self) -> None:
@@ -59,7 +128,7 @@ class GUI:
         ttk.Label(frame, text="Wybór rodziców:").grid(
             row=5, column=0, sticky=tk.W)
         self.parent_selection_combo = ttk.Combobox(
-            frame, values=["ranking", "wagowo"], state="readonly")
+            frame, values=["ranking", "wagowo", "turniej"], state="readonly")
         self.parent_selection_combo.set("wagowo")
         self.parent_selection_combo.grid(row=5, column=1)
 
@@ -75,16 +144,32 @@ class GUI:
         self.cycles_entry.insert(0, "5")
         self.cycles_entry.grid(row=7, column=1)
 
+        # NSGA-II szuka frontu Pareto zamiast jednego najlepszego planu
+        ttk.Label(frame, text="Tryb optymalizacji:").grid(
+            row=8, column=0, sticky=tk.W)
+        self.mode_combo = ttk.Combobox(
+            frame, values=["jednokryterialny", "NSGA-II"], state="readonly")
+        self.mode_combo.set("jednokryterialny")
+        self.mode_combo.grid(row=8, column=1)
+
         # Pasek postępu
         self.progress_bar = ttk.Progressbar(
             frame, orient="horizontal", length=200, mode="determinate")
-        self.progress_bar.grid(row=8, column=0, columnspan=2, pady=10)
+        self.progress_bar.grid(row=9, column=0, columnspan=2, pady=10)
 
         # Przycisk uruchamiający algorytm
         self.run_button = ttk.Button(
             frame, text="Uruchom algorytm", command=self.start_algorithm)
         self.run_button.grid(
-            row=9, column=0, columnspan=2, pady=10)
+            row=10, column=0, columnspan=2, pady=10)
+
+        # Wykres fitness na żywo
+        plot_frame = ttk.Frame(self.root, padding="10")
+        plot_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.live_plot = LiveFitnessPlot(plot_frame)
+
+        # Wątek algorytmu tylko wrzuca postęp do kolejki, GUI zmienia tylko wątek Tk
+        self.progress_queue = queue.Queue()
         self.control = Control()
         # Obsługa zamykania okna
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
@@ -106,24 +191,160 @@ class GUI:
         )
 
         def update_progress(gen, best_fitness):
-            # Aktualizacja paska postępu w głównym wątku
-            progress_bar["value"] = (gen / generations) * 100
-            self.root.update_idletasks()
-            print(f"Generacja {gen}: najlepsze fitness = {best_fitness}")
-
+            # Wywoływane w wątku algorytmu, nie dotyka widgetów
+            self.progress_queue.put(("progress", gen,
+                                     traffic_opt.genetic_algorthm.evaluations, best_fitness))
+
+        def on_done(best_solution, fitness_history):
+            self.finalize_results(best_solution, fitness_history, traffic_opt)
+
+        self.start_worker(
+            lambda: traffic_opt.genetic_algorthm.run_evolution_gui(
+                generations, elitism_perc, update_progress),
+            generations, progress_bar, on_done)
+
+    def start_worker(self, run, generations, progress_bar, on_done):
+        """
+        Uruchamia algorytm w nowym wątku i odczyt postępu w wątku Tk.
+        Wątek zawsze kończy wiadomością "done" albo "error", więc
+        odczyt kolejki nie trwa w nieskończoność.
+
+        Args:
+            run (Callable): algorytm, zwraca krotkę argumentów on_done
+            generations (int): liczba generacji, do paska postępu
+            progress_bar: pasek postępu
+            on_done (Callable): wywoływane z wynikiem run
+        """
         def run_algorithm_inner():
-            # Uruchamiamy algorytm i zbieramy wyniki
-            best_solution, fitness_history = traffic_opt.genetic_algorthm.run_evolution_gui(
-                generations, elitism_perc, update_progress
-            )
-            # Po zakończeniu uruchamiania algorytmu wyświetlamy wyniki
-            self.root.after(0, lambda: self.finalize_results(
-                best_solution, fitness_history, traffic_opt, population_size))
+            try:
+                result = run()
+            except Exception as e:
+                self.progress_queue.put(("error", e))
+            else:
+                self.progress_queue.put(("done",) + tuple(result))
 
-        # Uruchamiamy algorytm w nowym wątku
+        self.live_plot.reset()
         threading.Thread(target=run_algorithm_inner, daemon=True).start()
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress, generations, progress_bar, on_done)
+
+    def poll_progress(self, generations, progress_bar, on_done):
+        """
+        Odczyt całej kolejki w wątku Tk, co najwyżej co PROGRESS_POLL_MS,
+        wspólny dla wszystkich trybów.
+
+        Args:
+            generations (int): liczba generacji, do paska postępu
+            progress_bar: pasek postępu
+            on_done (Callable): wywoływane z resztą wiadomości "done",
+                po wiadomości "error" pokazywany jest błąd
+        """
+        points = []
+        gen = None
+        finished = None
+        while True:
+            try:
+                message = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "progress":
+                # generacja, liczba ocenionych planów, najlepsze fitness
+                _, gen, evaluations, best_fitness = message
+                points.append((evaluations, best_fitness))
+            else:
+                finished = message
+        if points:
+            progress_bar["value"] = (gen / generations) * 100
+            self.live_plot.extend(points)
+            print(f"Generacja {gen}: najlepsze fitness = {points[-1][1]}")
+        if finished is not None and finished[0] == "error":
+            progress_bar["value"] = 0
+            self.stop_algorithm()
+            messagebox.showerror(
+                "Błąd algorytmu", f"Algorytm zakończył się błędem.\n\nSzczegóły: {finished[1]}")
+        elif finished is not None:
+            on_done(*finished[1:])
+        else:
+            self.root.after(PROGRESS_POLL_MS, self.poll_progress,
+                            generations, progress_bar, on_done)
+
+    def run_nsga2(self, population_size, generations, mutation_prob, crossover_type, alpha, cycles, progress_bar):
+        """ Uruchamia NSGA-II, na wykresie na żywo fitness planu z najmniejszym czasem oczekiwania. """
+        self.control.stop = False
+        traffic_opt = TrafficLightsNSGA2(
+            control=self.control,
+            population_size=population_size,
+            mutation_prob=mutation_prob,
+            crossover_type=crossover_type,
+            crossover_alpha=alpha,
+            cycles=cycles
+        )
+
+        def update_progress(gen, front_objectives):
+            # Wywoływane w wątku algorytmu, nie dotyka widgetów
+            self.progress_queue.put(("progress", gen, traffic_opt.nsga2.evaluations,
+                                     1000000 / front_objectives[:, 0].min()))
+
+        self.start_worker(lambda: (traffic_opt.run(generations, update_progress),),
+                          generations, progress_bar, self.finalize_pareto)
+
+    def finalize_pareto(self, front):
+        """ Wyświetla front Pareto: listę planów, wykres i symulację wybranego planu. """
+        result_window = tk.Toplevel()
+        result_window.title("Front Pareto")
+
+        frame_left = tk.Frame(result_window, padx=10, pady=10)
+        frame_left.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        frame_right = tk.Frame(result_window, padx=10, pady=10)
+        frame_right.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+
+        # Plany posortowane po czasie oczekiwania
+        plans_list = tk.Listbox(frame_left, width=60, height=25)
+        plans_list.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        for i, point in enumerate(front):
+            objectives = point["objectives"]
+            plans_list.insert(
+                tk.END,
+                f"{i + 1}. oczekiwanie {objectives['waiting_time']:.0f}, "
+                f"przejazdy {objectives['throughput']:.0f}, "
+                f"kolejka {objectives['max_queue']:.0f}, "
+                f"najgorszy pas {objectives['worst_lane_delay']:.1f}")
+        plans_list.selection_set(0)
+
+        def start_simulation():
+            selection = plans_list.curselection()
+            if not selection:
+                return
+            try:
+                theApp = App()
+                theApp.simulation_graphics = SimulationGraphic(front[selection[0]]["plan"])
+                threading.Thread(target=theApp.on_execute, daemon=True).start()
+            except Exception as e:
+                messagebox.showerror(
+                    "Błąd symulacji", f"Nie udało się uruchomić symulacji.\n\nSzczegóły: {e}")
+
+        tk.Button(frame_left, text="Start symulacji wybranego planu",
+                  command=start_simulation).pack(side=tk.BOTTOM, pady=10)
+
+        # Czas oczekiwania i przepustowość, kolor to najdłuższa kolejka
+        fig, ax = plt.subplots(figsize=(8, 6))
+        points = ax.scatter([point["objectives"]["waiting_time"] for point in front],
+                            [point["objectives"]["throughput"] for point in front],
+                            c=[point["objectives"]["max_queue"] for point in front],
+                            cmap="viridis")
+        for i, point in enumerate(front):
+            ax.annotate(str(i + 1), (point["objectives"]["waiting_time"],
+                                     point["objectives"]["throughput"]))
+        fig.colorbar(points, ax=ax, label="Najdłuższa kolejka")
+        ax.set_title("Front Pareto")
+        ax.set_xlabel("Czas oczekiwania")
+        ax.set_ylabel("Liczba przejazdów")
+        ax.grid(True)
 
-    def finalize_results(self, best_solution, fitness_history, traffic_opt, population_size):
+        canvas = FigureCanvasTkAgg(fig, master=frame_right)
+        canvas.draw()
+        canvas.get_tk_widget().pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+
+    def finalize_results(self, best_solution, fitness_history, traffic_opt):
         """ Wyświetla szczegóły najlepszego rozwiązania, wykres fitness i przycisk do uruchomienia symulacji. """
         # Tworzenie nowego okna
         result_window = tk.Toplevel()
@@ -150,6 +371,10 @@ class GUI:
             for i, (lights_times, _) in enumerate(best_solution)
         )
         result_text.insert(tk.END, f"Najlepsze rozwiązanie:\n\n{lights_info}")
+        genetic_algorithm = traffic_opt.genetic_algorthm
+        result_text.insert(
+            tk.END, f"\n\nPowód zakończenia: {genetic_algorithm.stop_reason}"
+                    f"\nLiczba symulacji: {genetic_algorithm.evaluations}")
         # Ustawienie trybu tylko do odczytu
         result_text.config(state=tk.DISABLED)
 
@@ -172,12 +397,14 @@ class GUI:
         start_button.pack(side=tk.BOTTOM, pady=10)
 
         # Dodanie wykresu do panelu
-        x_values = [i*population_size for i in range(len(fitness_history))]
+        # oś x jak na wykresie na żywo: liczba ocenionych planów po generacji
+        x_values = [evaluations for evaluations, _
+                    in traffic_opt.genetic_algorthm.evaluation_history]
         fig, ax = plt.subplots(figsize=(8, 6))
         ax.plot(x_values, fitness_history,
                 marker='o', linestyle='-', color='b')
         ax.set_title("Postęp optymalizacji")
-        ax.set_xlabel("Generacja * Rozmiar populacji")
+        ax.set_xlabel("Liczba ocenionych planów")
         ax.set_ylabel("Fitness")
         ax.grid(True)
 
@@ -213,10 +440,14 @@ class GUI:
             # Resetowanie paska postępu
             self.progress_bar["value"] = 0
 
-            self.run_genetic_algorithm(
-                population_size, generations, elitism_perc,
-                mutation_prob, crossover_type, selection_type, alpha, cycles, self.progress_bar
-            )
+            if self.mode_combo.get() == "NSGA-II":
+                self.run_nsga2(population_size, generations, mutation_prob,
+                               crossover_type, alpha, cycles, self.progress_bar)
+            else:
+                self.run_genetic_algorithm(
+                    population_size, generations, elitism_perc,
+                    mutation_prob, crossover_type, selection_type, alpha, cycles, self.progress_bar
+                )
 
             # Comment line below if you want to run multiple algorithms
             self.run_button.config(text="Anuluj", command=self.stop_algorithm)
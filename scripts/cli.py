@@ -0,0 +1,394 @@
+"""
+Headless optimization entry point for batch servers.
+
+Usage:
+    python -m scripts.cli config.json --workers 8 --output result.json --progress
+
+Config file (all sections optional):
+    {
+        "network": {"cycles": 5},
+        "demand": {"seed": 1} or {"arrivals": [[[0, "WEST"], [3, "SOUTH"]], ...]},
+        "optimizer": {"type": "genetic", "population_size": 100, "generations": 50,
+                      "elitism_perc": 0.1, "mutation_prob": 0.5,
+                      "crossover_type": "blx", "selection_type": "ranking",
+                      "crossover_alpha": 1.5, "seed": 0}
+    }
+"selection_type" is "ranking", "wagowo" or "turniej" (with "tournament_size").
+Genetic run ends early with optimizer "termination": {"stagnation_generations":
+10, "min_improvement": 0.001, "max_seconds": 600, "max_evaluations": 20000}
+(all optional), result has "stop_reason" and "evaluation_history".
+Annealer is selected with "type": "annealing" and accepts
+"temperature", "alfa" and "min_temperature". CMA-ES is selected with
+"type": "cmaes" and accepts "generations", "sigma", "population_size",
+"order_search_interval" and "seed". NSGA-II is selected with
+"type": "nsga2", accepts "generations", "population_size", "mutation_prob",
+"crossover_type", "crossover_alpha" and "seed" and adds "pareto_front"
+to result, best plan is the one with the lowest waiting time. Its
+--workers are processes evaluating objectives, --threads and "archive"
+don't apply to it.
+With --threads genetic algorithm and CMA-ES evaluate on threads instead
+of worker processes (see ThreadPoolEvaluator). With "archive":
+"evaluations.db" they look plans up in persistent archive shared by runs
+before simulating them.
+
+Result JSON has "optimizer", "best_plan", "history", "evaluations",
+"elapsed" and "workers". "metric" tells which value is reported:
+"fitness" (genetic, cmaes) is "best_fitness" = 1000000 / score, higher is
+better; "score" (annealing, nsga2) is "best_score", the simulation score
+(sum of waiting times), lower is better. History has the same metric: best
+of every generation for genetic (not the last one without elitism), best
+so far after every generation (step) for cmaes and annealing.
+With --progress every generation (annealing step) is one JSON line with
+"event" before the result. Bad config exits with status 2 and message on
+stderr.
+"""
+import argparse
+import json
+import random
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts.simulation.simulation import Simulation
+from scripts.simulation.plan_io import plan_to_json, plan_from_json, arrivals_from_json
+from scripts.simulation.recording import SimulationRecorder
+from scripts.simulation.telemetry import TelemetryCollector
+from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control, Termination
+from scripts.optimalization.simulated_annealing import SimulatedAnnealing
+from scripts.optimalization.cma_es import CMAES
+from scripts.optimalization.nsga2 import TrafficLightsNSGA2, ObjectivesPoolEvaluator
+from scripts.optimalization.shared_data import SharedMemoryEvaluator
+from scripts.optimalization.archive import EvaluationArchive, ArchivedEvaluator
+from scripts.optimalization.parallel import ThreadPoolEvaluator
+
+GENETIC_OPTIONS = ("population_size", "mutation_prob", "crossover_type",
+                   "selection_type", "crossover_alpha", "tournament_size")
+ANNEALING_OPTIONS = ("temperature", "alfa", "min_temperature")
+CMAES_OPTIONS = ("sigma", "population_size", "order_search_interval", "seed")
+NSGA2_OPTIONS = ("population_size", "mutation_prob", "crossover_type",
+                 "crossover_alpha", "seed")
+# Termination arguments and their JSON types, bool is not taken for a number
+TERMINATION_TYPES = {"stagnation_generations": int, "min_improvement": (int, float),
+                     "max_seconds": (int, float), "max_evaluations": int}
+
+
+def emit(event: dict) -> None:
+    """
+    Writes one progress event as JSON line to stdout.
+    """
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def build_arrivals(config: dict, turn_time: int = 120) -> list:
+    """
+    Builds arrivals list from demand section of config, so every worker
+    simulates the same cars.
+
+    Args:
+        config (dict): demand config, "arrivals" list or "seed"
+
+    Returns:
+        list: (origin, destination) pairs
+    """
+    if "arrivals" in config:
+        return arrivals_from_json(config["arrivals"])
+    return Simulation(turn_time=turn_time, seed=config.get("seed")).car_adder
+
+
+def make_evaluator(config: dict, workers: int, cycles: int, car_adder: list):
+    """
+    Evaluator of worker processes or threads ("threads" in config), with
+    persistent archive when config has "archive" path.
+
+    Returns:
+        evaluator to pass to optimizer, None for its own simulation
+    """
+    evaluator = None
+    if workers > 1:
+        evaluator_type = ThreadPoolEvaluator if config.get("threads") else SharedMemoryEvaluator
+        evaluator = evaluator_type(workers, cycles, car_adder)
+    if "archive" not in config:
+        return evaluator
+    return ArchivedEvaluator(EvaluationArchive(config["archive"]),
+                             Simulation(cycles=cycles, car_adder=car_adder), evaluator)
+
+
+def run_genetic(config: dict, car_adder: list, workers: int, progress: bool) -> dict:
+    network = config.get("network", {})
+    opt_config = config.get("optimizer", {})
+    generations = opt_config.get("generations", 50)
+    elitism_perc = opt_config.get("elitism_perc", 0.1)
+    options = {key: opt_config[key] for key in GENETIC_OPTIONS if key in opt_config}
+    options["cycles"] = network.get("cycles", 5)
+    options["car_adder"] = car_adder
+
+    control = Control()
+
+    def request_stop(signum, frame):
+        # finish current generation and still write results
+        control.stop = True
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    evaluator = make_evaluator(config, workers, options["cycles"], car_adder)
+    termination = Termination(**opt_config["termination"]) \
+        if "termination" in opt_config else None
+    optimizer = TrafficLightsOptGentetic(control, evaluate=evaluator,
+                                         termination=termination, **options)
+    genetic_algorithm = optimizer.genetic_algorthm
+    start = time.perf_counter()
+
+    def update_progress(generation, best_fitness):
+        if progress:
+            emit({"event": "generation",
+                  "generation": generation,
+                  "generations": generations,
+                  "best_fitness": best_fitness,
+                  "evaluations": genetic_algorithm.evaluations,
+                  "elapsed": time.perf_counter() - start})
+
+    try:
+        best_solution, fitness_history = genetic_algorithm.run_evolution_gui(
+            generations, elitism_perc, update_progress)
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+    result = {"optimizer": "genetic",
+              "best_plan": plan_to_json(best_solution),
+              # without elitism the best generation doesn't have to be the last
+              "best_fitness": max(fitness_history),
+              "metric": "fitness",
+              "history": fitness_history,
+              "evaluations": genetic_algorithm.evaluations,
+              "evaluation_history": genetic_algorithm.evaluation_history,
+              "stop_reason": genetic_algorithm.stop_reason,
+              "stopped": control.stop,
+              "elapsed": time.perf_counter() - start}
+    if isinstance(evaluator, ArchivedEvaluator):
+        result["archive_hits"] = evaluator.hits
+    return result
+
+
+def run_annealing_chain(chain: int, seed, options: dict, cycles: int,
+                        car_adder: list, progress: bool):
+    """
+    Runs one simulated annealing chain. Used directly or in worker process.
+    """
+    random.seed(seed)
+    annealing = SimulatedAnnealing(
+        Simulation(cycles=cycles, car_adder=car_adder), **options)
+
+    def update_progress(step, score):
+        if progress:
+            emit({"event": "step", "chain": chain, "step": step,
+                  "best_score": score, "evaluations": annealing.evaluations})
+
+    best_solution, score_history = annealing.run(update_progress)
+    return best_solution, score_history, annealing.evaluations
+
+
+def run_annealing(config: dict, car_adder: list, workers: int, progress: bool) -> dict:
+    opt_config = config.get("optimizer", {})
+    options = {key: opt_config[key] for key in ANNEALING_OPTIONS if key in opt_config}
+    cycles = config.get("network", {}).get("cycles", 5)
+    seed = opt_config.get("seed")
+    # annealing is sequential, extra workers run independent chains
+    chains = max(1, workers)
+    seeds = [None if seed is None else seed + chain for chain in range(chains)]
+    start = time.perf_counter()
+    args = [(chain, seeds[chain], options, cycles, car_adder, progress)
+            for chain in range(chains)]
+    if chains == 1:
+        results = [run_annealing_chain(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=chains) as executor:
+            results = list(executor.map(run_annealing_chain, *zip(*args)))
+    # history of chain is best score so far after every step
+    best_chain = min(range(chains), key=lambda chain: min(results[chain][1]))
+    best_solution, score_history, _ = results[best_chain]
+    return {"optimizer": "annealing",
+            "best_plan": plan_to_json(best_solution),
+            "best_score": min(score_history),
+            "metric": "score",
+            "history": score_history,
+            "chain": best_chain,
+            "evaluations": sum(result[2] for result in results),
+            "elapsed": time.perf_counter() - start}
+
+
+def run_cmaes(config: dict, car_adder: list, workers: int, progress: bool) -> dict:
+    cycles = config.get("network", {}).get("cycles", 5)
+    opt_config = config.get("optimizer", {})
+    generations = opt_config.get("generations", 50)
+    options = {key: opt_config[key] for key in CMAES_OPTIONS if key in opt_config}
+
+    control = Control()
+
+    def request_stop(signum, frame):
+        control.stop = True
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    evaluator = make_evaluator(config, workers, cycles, car_adder)
+    cma = CMAES(Simulation(cycles=cycles, car_adder=car_adder), evaluate=evaluator, **options)
+    start = time.perf_counter()
+
+    def update_progress(generation, best_fitness):
+        if progress:
+            emit({"event": "generation",
+                  "generation": generation,
+                  "generations": generations,
+                  "best_fitness": best_fitness,
+                  "evaluations": cma.evaluations,
+                  "elapsed": time.perf_counter() - start})
+
+    try:
+        best_solution, fitness_history = cma.run(generations, update_progress, control)
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+    result = {"optimizer": "cmaes",
+              "best_plan": plan_to_json(best_solution),
+              "best_fitness": fitness_history[-1],
+              "metric": "fitness",
+              "history": fitness_history,
+              "evaluations": cma.evaluations,
+              "stopped": control.stop,
+              "elapsed": time.perf_counter() - start}
+    if isinstance(evaluator, ArchivedEvaluator):
+        result["archive_hits"] = evaluator.hits
+    return result
+
+
+def run_nsga2(config: dict, car_adder: list, workers: int, progress: bool) -> dict:
+    opt_config = config.get("optimizer", {})
+    generations = opt_config.get("generations", 50)
+    options = {key: opt_config[key] for key in NSGA2_OPTIONS if key in opt_config}
+
+    control = Control()
+
+    def request_stop(signum, frame):
+        control.stop = True
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    cycles = config.get("network", {}).get("cycles", 5)
+    # objectives are read from crossroad objects, so workers are processes
+    # with own simulations, threads and archive (fitness only) are not used
+    evaluator = ObjectivesPoolEvaluator(workers, cycles, car_adder) if workers > 1 else None
+    optimizer = TrafficLightsNSGA2(control, cycles=cycles, car_adder=car_adder,
+                                   evaluate=evaluator, **options)
+    start = time.perf_counter()
+
+    def update_progress(generation, front_objectives):
+        if progress:
+            emit({"event": "generation",
+                  "generation": generation,
+                  "generations": generations,
+                  "front_size": len(front_objectives),
+                  "best_score": float(front_objectives[:, 0].min()),
+                  "evaluations": optimizer.nsga2.evaluations,
+                  "elapsed": time.perf_counter() - start})
+
+    try:
+        front = optimizer.run(generations, update_progress)
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+    return {"optimizer": "nsga2",
+            "best_plan": plan_to_json(front[0]["plan"]),
+            "best_score": front[0]["objectives"]["waiting_time"],
+            "metric": "score",
+            "pareto_front": [{"plan": plan_to_json(point["plan"]),
+                              "objectives": point["objectives"]} for point in front],
+            "evaluations": optimizer.nsga2.evaluations,
+            "stopped": control.stop,
+            "elapsed": time.perf_counter() - start}
+
+
+OPTIMIZERS = {"genetic": run_genetic,
+              "annealing": run_annealing,
+              "cmaes": run_cmaes,
+              "nsga2": run_nsga2}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Optimize traffic lights without GUI.")
+    parser.add_argument("config", help="JSON file with network, demand and optimizer")
+    parser.add_argument("--optimizer", choices=OPTIMIZERS.keys(),
+                        help="overrides optimizer type from config")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--threads", action="store_true",
+                        help="evaluate on worker threads instead of processes")
+    parser.add_argument("--output", help="result JSON file, stdout if not given")
+    parser.add_argument("--progress", action="store_true",
+                        help="write progress events as JSON lines to stdout")
+    parser.add_argument("--record",
+                        help="record best plan to directory (or .npz file) for replay")
+    parser.add_argument("--telemetry", action="store_true",
+                        help="add per lane statistics of best plan to result")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.config) as file:
+            config = json.load(file)
+    except (OSError, ValueError) as error:
+        parser.error(f"cannot read config: {error}")
+    if not isinstance(config, dict) or not all(
+            isinstance(config.get(section, {}), dict)
+            for section in ("network", "demand", "optimizer")):
+        parser.error("config and its network, demand and optimizer sections must be objects")
+    opt_config = config.setdefault("optimizer", {})
+    if args.threads:
+        config["threads"] = True
+    optimizer_type = args.optimizer or opt_config.get("type", "genetic")
+    if optimizer_type not in OPTIMIZERS:
+        parser.error(f"unknown optimizer type {optimizer_type!r}, "
+                     f"expected one of {', '.join(OPTIMIZERS)}")
+    termination = opt_config.get("termination", {})
+    if not isinstance(termination, dict):
+        parser.error("optimizer termination must be an object")
+    for key, value in termination.items():
+        if key not in TERMINATION_TYPES:
+            parser.error(f"unknown termination key {key!r}, "
+                         f"expected one of {', '.join(TERMINATION_TYPES)}")
+        if value is not None and (isinstance(value, bool) or
+                                  not isinstance(value, TERMINATION_TYPES[key])):
+            kind = "an integer" if TERMINATION_TYPES[key] is int else "a number"
+            parser.error(f"termination {key} must be {kind}, got {value!r}")
+    if opt_config.get("seed") is not None:
+        random.seed(opt_config["seed"])
+    car_adder = build_arrivals(config.get("demand", {}))
+
+    result = OPTIMIZERS[optimizer_type](config, car_adder, args.workers, args.progress)
+    result["workers"] = args.workers
+
+    if args.record or args.telemetry:
+        simulation = Simulation(cycles=config.get("network", {}).get("cycles", 5),
+                                car_adder=car_adder)
+        recorder = SimulationRecorder()
+        telemetry = TelemetryCollector()
+        simulation.run(plan_from_json(result["best_plan"]),
+                       observers=(recorder, telemetry))
+        if args.record:
+            recorder.save(args.record, compressed=args.record.endswith(".npz"))
+        if args.telemetry:
+            result["telemetry"] = {"crossroads": telemetry.crossroad_summary(),
+                                   "lanes": telemetry.lane_summary()}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+        if args.progress:
+            emit({"event": "done", "output": args.output})
+    else:
+        emit(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Allocation profiling with tracemalloc:
+
+    python -m scripts.memory_profile --population 100 --generations 5
+
+Reports allocations of every generation of genetic algorithm and of one
+Simulation.run, by subsystem: module of scripts package that allocated,
+e.g. "simulation.simulation" (standard library and numpy calls are charged
+to the module calling them).
+tracemalloc sees only live blocks, so for every interval profile has peak
+(highest traced memory above its start) and retained (blocks allocated
+and not freed). Objects allocated and freed between measurements are not
+seen, cars (allocated for every arrival without pool) are counted by
+CarPool. BUDGETS are checked by tests.
+"""
+import argparse
+import os
+import random
+import tracemalloc
+from typing import Callable, Dict, List
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# recorded budgets in bytes (about twice measured values), tests fail
+# when they are exceeded
+BUDGETS = {
+    # Simulation.run on crossroad objects, 5 cycles, after warm up run
+    "run_peak": 2 * 1024,
+    "run_retained": 1024,
+    "run_cars_created": 0,
+    # per genome of generation after the second one (selection, crossover,
+    # mutation, simulation and cached fitness)
+    "evaluation_peak": 2 * 1024,
+    "evaluation_retained": 2 * 1024,
+}
+
+
+def subsystem(traceback: tracemalloc.Traceback) -> str:
+    """
+    Returns:
+        str: the most recent module of scripts package in traceback, e.g.
+            "simulation.kernel", "other" when there is none
+    """
+    # only str methods, allocations in frames of this file are not traced
+    for frame in reversed(traceback):
+        filename = frame.filename
+        if filename.startswith(SCRIPTS_DIR) and filename != __file__:
+            return filename[len(SCRIPTS_DIR) + 1:-3].replace(os.sep, ".")
+    return "other"
+
+
+class MemoryProfiler:
+    def __init__(self, frames: int = 25) -> None:
+        """
+        Profiles intervals between calls of measure, used as context manager.
+
+        Args:
+            frames (int): frames stored per allocation, deeper stacks are
+                cut and may be charged to "other"
+        """
+        self.frames = frames
+        self.records: List[dict] = []
+        self.filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, __file__)]
+        self.started = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started = True
+        # filters compile and cache patterns on first use, not in profiled interval
+        tracemalloc.take_snapshot().filter_traces(self.filters)
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        tracemalloc.reset_peak()
+        self.level = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.snapshot = None
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def measure(self, label: str) -> dict:
+        """
+        Closes interval started by previous measure (or by entering).
+
+        Returns:
+            dict: label, peak, retained and subsystems (name: size and
+                blocks retained), sizes in bytes
+        """
+        peak = tracemalloc.get_traced_memory()[1] - self.level
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        subsystems: Dict[str, dict] = {}
+        for statistic in snapshot.compare_to(self.snapshot, "traceback"):
+            if statistic.size_diff or statistic.count_diff:
+                name = subsystem(statistic.traceback)
+                entry = subsystems.setdefault(name, {"size": 0, "blocks": 0})
+                entry["size"] += statistic.size_diff
+                entry["blocks"] += statistic.count_diff
+        record = {"label": label,
+                  "peak": peak,
+                  "retained": sum(entry["size"] for entry in subsystems.values()),
+                  "subsystems": dict(sorted(subsystems.items(),
+                                            key=lambda item: -abs(item[1]["size"])))}
+        self.records.append(record)
+        # previous snapshot is freed before the next interval starts
+        self.snapshot = snapshot
+        del snapshot
+        tracemalloc.reset_peak()
+        self.level = tracemalloc.get_traced_memory()[0]
+        return record
+
+    def generation_callback(self, update_progress: Callable[[int, float], None] = None
+                            ) -> Callable[[int, float], None]:
+        """
+        update_progress for run_evolution_gui measuring every generation.
+        """
+        def measure_generation(generation, best_fitness):
+            self.measure(f"generation {generation}")
+            if update_progress is not None:
+                update_progress(generation, best_fitness)
+        return measure_generation
+
+
+def profile_run(simulation, plan, runs: int = 1) -> dict:
+    """
+    Profiles runs of plan after one warm up run (caches, pool of cars).
+
+    Returns:
+        dict: record of MemoryProfiler.measure for all runs with
+            cars_created, cars allocated by pool (objects freed within
+            interval are not seen by tracemalloc)
+    """
+    with MemoryProfiler() as profiler:
+        # state of warm up run is traced too, so its release is seen
+        simulation.run(plan)
+        profiler.measure("warm up")
+        created = simulation.car_pool.created
+        for _ in range(runs):
+            simulation.run(plan)
+        record = profiler.measure("run")
+    record["cars_created"] = simulation.car_pool.created - created
+    return record
+
+
+def profile_generations(optimizer, generations: int, elitism_perc: float = 0.1) -> List[dict]:
+    """
+    Profiles every generation of run_evolution_gui of TrafficLightsOptGentetic.
+
+    Returns:
+        List[dict]: records of MemoryProfiler.measure, one per generation
+    """
+    with MemoryProfiler() as profiler:
+        optimizer.genetic_algorthm.run_evolution_gui(
+            generations, elitism_perc, profiler.generation_callback())
+        return profiler.records
+
+
+def format_record(record: dict) -> str:
+    parts = ", ".join(f"{name} {entry['size'] / 1024:.1f} KiB/{entry['blocks']}"
+                      for name, entry in record["subsystems"].items())
+    cars = f", cars created {record['cars_created']}" if "cars_created" in record else ""
+    return (f"{record['label']}: peak {record['peak'] / 1024:.1f} KiB, "
+            f"retained {record['retained'] / 1024:.1f} KiB{cars} ({parts})")
+
+
+if __name__ == "__main__":
+    from scripts.simulation.simulation import Simulation
+    from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+
+    parser = argparse.ArgumentParser(description="Allocations of generations and runs.")
+    parser.add_argument("--population", type=int, default=100)
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--backend", default="python", help="simulation backend")
+    args = parser.parse_args()
+
+    random.seed(0)
+    optimizer = TrafficLightsOptGentetic(Control(), population_size=args.population,
+                                         cycles=args.cycles, seed=0)
+    optimizer.simulation = Simulation(cycles=args.cycles, seed=0, backend=args.backend)
+    print(format_record(profile_run(optimizer.simulation, optimizer.generate_genome())))
+    for record in profile_generations(optimizer, args.generations):
+        print(format_record(record))
@@ -0,0 +1,200 @@
+"""
+Persistent archive of evaluated plans shared by runs, sweeps and processes.
+Plans are keyed by hash of their phase tables (genomes giving the same
+lights simulate the same), network fingerprint (lanes, processing and
+capacity, cycles, rejection penalty) and demand fingerprint (arrivals).
+"""
+import hashlib
+import os
+import sqlite3
+from typing import Callable, Dict, List
+import numpy as np
+from scripts.simulation.simulation import Simulation
+from scripts.simulation.kernel import FlatKernel, phase_array
+from scripts.optimalization.shared_data import demand_array
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    network TEXT NOT NULL,
+    demand TEXT NOT NULL,
+    plan BLOB NOT NULL,
+    fitness REAL NOT NULL,
+    PRIMARY KEY (network, demand, plan)
+) WITHOUT ROWID
+"""
+# limit of host parameters in one SQLite statement is 999 in old versions
+LOOKUP_CHUNK = 900
+
+
+def plan_hash(phases: np.ndarray) -> bytes:
+    """
+    Canonical hash of plan, from phase tables (see kernel.phase_array).
+    """
+    return hashlib.blake2b(np.ascontiguousarray(phases, dtype=np.int8).tobytes(),
+                           digest_size=16).digest()
+
+
+def network_fingerprint(simulation: Simulation) -> str:
+    tables = FlatKernel(simulation, compiled=False)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((simulation.turn_time, simulation.cycles,
+                        simulation.rejection_penalty)).encode())
+    for array in (tables.out_target, tables.processing_time, tables.capacity):
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def demand_fingerprint(car_adder: list) -> str:
+    return hashlib.blake2b(demand_array(car_adder).tobytes(), digest_size=16).hexdigest()
+
+
+class EvaluationArchive:
+    def __init__(self, path: str, batch_size: int = 256, timeout: float = 30) -> None:
+        """
+        SQLite archive of fitness. Database is in WAL mode, so many
+        processes read while one writes. Every process opens its own
+        connection on first use, archive can be passed to worker processes.
+        Results are written in batches of batch_size, flush writes the rest.
+
+        Args:
+            path (str): database file, created when missing
+            batch_size (int): pending results written in one transaction
+            timeout (float): seconds to wait for lock held by other process
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.pending: List[tuple] = []
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # connections must not be shared with forked processes
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(SCHEMA)
+            self._connection.commit()
+            self._pid = os.getpid()
+            self.pending = []
+        return self._connection
+
+    def lookup(self, network: str, demand: str, plans: List[bytes]) -> Dict[bytes, float]:
+        """
+        Returns:
+            Dict[bytes, float]: fitness of archived plans among plans,
+                pending ones included
+        """
+        found = {plan: fitness for n, d, plan, fitness in self.pending
+                 if n == network and d == demand}
+        plans = list(set(plans) - found.keys())
+        for start in range(0, len(plans), LOOKUP_CHUNK):
+            chunk = plans[start:start + LOOKUP_CHUNK]
+            found.update(self.connection.execute(
+                "SELECT plan, fitness FROM evaluations WHERE network = ? AND demand = ? "
+                f"AND plan IN ({','.join('?' * len(chunk))})",
+                (network, demand, *chunk)))
+        return found
+
+    def add(self, network: str, demand: str, plan: bytes, fitness: float) -> None:
+        self.pending.append((network, demand, plan, fitness))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes pending results in one transaction, plans written meanwhile
+        by other process are kept.
+        """
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO evaluations VALUES (?, ?, ?, ?)", self.pending)
+        self.pending = []
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+    def close(self) -> None:
+        if self._pid == os.getpid():
+            self.flush()
+            self._connection.close()
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, _connection=None, _pid=None, pending=[])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ArchivedEvaluator:
+    def __init__(self, archive: EvaluationArchive, simulation: Simulation,
+                 evaluate: Callable[[list], List[float]] = None) -> None:
+        """
+        Evaluate callable for TrafficLightsOptGentetic and CMAES, looks plans
+        up in archive before simulating. Only plans not found go to evaluate.
+
+        Args:
+            archive (EvaluationArchive): archive to use
+            simulation (Simulation): simulation defining network and demand,
+                scores plans when evaluate is not given
+            evaluate (Callable, optional): fitness of list of genomes, e.g.
+                SharedMemoryEvaluator on the same network and demand
+        """
+        self.archive = archive
+        self.simulation = simulation
+        self.evaluate = evaluate
+        self.network = network_fingerprint(simulation)
+        self.demand = demand_fingerprint(simulation.car_adder)
+        self.hits = 0
+        self.evaluations = 0
+
+    def set_demand(self, car_adder: list) -> None:
+        """
+        Changes arrivals of simulation and inner evaluate when it supports it.
+        """
+        self.simulation.car_adder = car_adder
+        self.demand = demand_fingerprint(car_adder)
+        if hasattr(self.evaluate, "set_demand"):
+            self.evaluate.set_demand(car_adder)
+
+    def __call__(self, genomes) -> List[float]:
+        """
+        Args:
+            genomes (Population): genomes to evaluate
+
+        Returns:
+            List[float]: fitness of each genome in the same order
+        """
+        phases = [phase_array(genome, self.simulation.turn_time) for genome in genomes]
+        keys = [plan_hash(table) for table in phases]
+        found = self.archive.lookup(self.network, self.demand, keys)
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in found and key not in missing:
+                missing[key] = i
+        self.hits += len(genomes) - len(missing)
+        self.evaluations += len(missing)
+        if missing:
+            if self.evaluate is not None:
+                fitness = self.evaluate([genomes[i] for i in missing.values()])
+            else:
+                fitness = [1000000 / self.simulation.run_phases(phases[i])
+                           for i in missing.values()]
+            for key, value in zip(missing, fitness):
+                found[key] = value
+                self.archive.add(self.network, self.demand, key, value)
+        return [found[key] for key in keys]
+
+    def close(self) -> None:
+        self.archive.flush()
+        if hasattr(self.evaluate, "close"):
+            self.evaluate.close()
@@ -0,0 +1,196 @@
+from typing import Callable, List
+import numpy as np
+from scripts.simulation.simulation import *
+
+DIRECTIONS = list(Direction)
+
+
+class CMAES:
+    def __init__(self,
+                 simulation: Simulation = None,
+                 sigma: float = 0.5,
+                 population_size: int = None,
+                 evaluate: Callable[[list], List[float]] = None,
+                 order_search_interval: int = 5,
+                 seed: int = None) -> None:
+        """
+        CMA-ES over lights times of all crossroads (4 x 4 = 16 dimensions).
+        Vector x is mapped to lights times with softmax per crossroad
+        (minimal time 5, sum 100 like in genetic algorithm).
+        Lights order is discrete, every order_search_interval generations
+        it is improved by swapping pairs of lights around current mean.
+
+        Args:
+            simulation (Simulation, optional): simulation scoring plans
+            sigma (float): initial step size
+            population_size (int, optional): samples per generation,
+                4 + 3 ln(n) when not given
+            evaluate (Callable, optional): fitness of list of plans at once,
+                e.g. SharedMemoryEvaluator, simulation fitness by default
+            order_search_interval (int): generations between order searches
+            seed (int, optional): seed of sampling
+        """
+        self.simulation = simulation if simulation is not None else Simulation(120, 5)
+        self.crossroads = len(self.simulation.crossroad_network.crossroad_network)
+        self.evaluate = evaluate if evaluate is not None else \
+            lambda plans: [1000000 / self.simulation.run(plan) for plan in plans]
+        self.order_search_interval = order_search_interval
+        self.rng = np.random.default_rng(seed)
+        self.evaluations = 0
+
+        n = self.dimension = 4 * self.crossroads
+        self.population_size = population_size or 4 + int(3 * np.log(n))
+        mu = self.population_size // 2
+        weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / (self.weights ** 2).sum()
+        # adaptation constants from Hansen's tutorial
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) /
+                       ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+
+        self.mean = np.zeros(n)
+        self.sigma = sigma
+        self.covariance = np.eye(n)
+        self.path_c = np.zeros(n)
+        self.path_s = np.zeros(n)
+        self.lights_orders = [list(DIRECTIONS) for _ in range(self.crossroads)]
+        self.best_plan = None
+        self.best_fitness = -np.inf
+
+    def lights_times(self, x: np.ndarray) -> List[Crossroad.LightsTimes]:
+        """
+        Maps vector to lights times of every crossroad.
+        """
+        x = x.reshape(self.crossroads, 4)
+        shares = np.exp(x - x.max(axis=1, keepdims=True))
+        # every light gets minimal 5, softmax splits the rest
+        times = 5 + shares / shares.sum(axis=1, keepdims=True) * 80
+        return [dict(zip(DIRECTIONS, row)) for row in times.tolist()]
+
+    def plan(self, x: np.ndarray, lights_orders=None) -> list:
+        lights_orders = lights_orders if lights_orders is not None else self.lights_orders
+        return [[times, list(order)]
+                for times, order in zip(self.lights_times(x), lights_orders)]
+
+    def score_plans(self, plans: list) -> np.ndarray:
+        fitness = np.array(self.evaluate(plans), dtype=float)
+        self.evaluations += len(plans)
+        best = int(fitness.argmax())
+        if fitness[best] > self.best_fitness:
+            self.best_fitness = float(fitness[best])
+            self.best_plan = plans[best]
+        return fitness
+
+    def sample(self) -> np.ndarray:
+        """
+        Samples whole generation at once.
+
+        Returns:
+            np.ndarray: array (population_size, dimension)
+        """
+        eigenvalues, self.basis = np.linalg.eigh(self.covariance)
+        self.scales = np.sqrt(np.maximum(eigenvalues, 1e-20))
+        self.z = self.rng.standard_normal((self.population_size, self.dimension))
+        return self.mean + self.sigma * (self.z * self.scales) @ self.basis.T
+
+    def update(self, samples: np.ndarray, fitness: np.ndarray) -> None:
+        """
+        Moves mean, step size and covariance towards best samples.
+        """
+        n = self.dimension
+        best = np.argsort(-fitness)[:len(self.weights)]
+        old_mean = self.mean
+        self.mean = self.weights @ samples[best]
+        step = (self.mean - old_mean) / self.sigma
+        inverse_sqrt = self.basis @ np.diag(1 / self.scales) @ self.basis.T
+        self.path_s = (1 - self.cs) * self.path_s + \
+            np.sqrt(self.cs * (2 - self.cs) * self.mueff) * inverse_sqrt @ step
+        generation = self.generation + 1
+        h_sigma = np.linalg.norm(self.path_s) / \
+            np.sqrt(1 - (1 - self.cs) ** (2 * generation)) / self.chi_n < 1.4 + 2 / (n + 1)
+        self.path_c = (1 - self.cc) * self.path_c + \
+            h_sigma * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+        steps = (samples[best] - old_mean) / self.sigma
+        self.covariance = ((1 - self.c1 - self.cmu) * self.covariance +
+                           self.c1 * (np.outer(self.path_c, self.path_c) +
+                                      (not h_sigma) * self.cc * (2 - self.cc) * self.covariance) +
+                           self.cmu * (steps.T * self.weights) @ steps)
+        self.covariance = (self.covariance + self.covariance.T) / 2
+        self.sigma *= np.exp(self.cs / self.damps *
+                             (np.linalg.norm(self.path_s) / self.chi_n - 1))
+
+    def search_orders(self) -> None:
+        """
+        Discrete sub-search: swaps of two lights in order of every crossroad
+        around current mean, all candidates of one sweep evaluated in one batch,
+        best improvement per crossroad is kept.
+        """
+        base_fitness = self.score_plans([self.plan(self.mean)])[0]
+        candidates = []
+        for c in range(self.crossroads):
+            for i, j in ((i, j) for i in range(4) for j in range(i + 1, 4)):
+                orders = [list(order) for order in self.lights_orders]
+                orders[c][i], orders[c][j] = orders[c][j], orders[c][i]
+                candidates.append((c, orders[c]))
+        fitness = self.score_plans([
+            self.plan(self.mean, self.lights_orders[:c] + [order] + self.lights_orders[c + 1:])
+            for c, order in candidates])
+        for c in range(self.crossroads):
+            indices = [k for k, (crossroad, _) in enumerate(candidates) if crossroad == c]
+            best = max(indices, key=lambda k: fitness[k])
+            if fitness[best] > base_fitness:
+                self.lights_orders[c] = candidates[best][1]
+
+    def run(self, generations: int,
+            update_progress: Callable[[int, float], None] = None,
+            control=None) -> Tuple[list, List[float]]:
+        """
+        Args:
+            generations (int): number of generations
+            update_progress (Callable, optional): called with generation and best fitness
+            control (Control, optional): stops when control.stop is set
+
+        Returns:
+            Tuple[list, List[float]]: best plan and best fitness after every generation
+        """
+        history = []
+        for self.generation in range(generations):
+            if self.order_search_interval and \
+                    self.generation % self.order_search_interval == 0:
+                self.search_orders()
+            samples = self.sample()
+            fitness = self.score_plans([self.plan(x) for x in samples])
+            self.update(samples, fitness)
+            history.append(self.best_fitness)
+            if update_progress is not None:
+                update_progress(self.generation + 1, self.best_fitness)
+            if control is not None and control.stop:
+                break
+        return self.best_plan, history
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+
+    for seed in range(3):
+        start = time.perf_counter()
+        cma = CMAES(Simulation(120, 5, seed=seed), seed=seed)
+        _, history = cma.run(60)
+        cma_time = time.perf_counter() - start
+        random.seed(seed)
+        start = time.perf_counter()
+        genetic = TrafficLightsOptGentetic(Control(), population_size=100, seed=seed,
+                                           crossover_type="blx", selection_type="ranking")
+        _, ga_history = genetic.genetic_algorthm.run_evolution_gui(
+            50, 0.1, lambda generation, fitness: None)
+        print(f"seed {seed}: CMA-ES {history[-1]:.2f} after {cma.evaluations} "
+              f"simulations ({cma_time:.1f} s), GA {max(ga_history):.2f} after "
+              f"{genetic.genetic_algorthm.evaluations} simulations "
+              f"({time.perf_counter() - start:.1f} s)")
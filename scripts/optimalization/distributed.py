@@ -0,0 +1,367 @@
+"""
+Fitness evaluation on several machines. Broker runs next to optimizer
+(BrokerEvaluator), workers on other nodes connect to it:
+
+    python -m scripts.optimalization.distributed HOST:PORT --authkey KEY
+
+KEY is hex of BrokerEvaluator.authkey (random unless given). Broker
+unpickles requests, so the key must be known only to trusted workers.
+Workers pull chunks of genomes, so faster workers take more of them. Idle
+worker steals chunk taken but not finished by other worker, first result
+is used. Workers renew their lease while evaluating, chunks of worker that
+didn't contact broker for lease_timeout seconds are submitted again.
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+from collections import deque
+from math import ceil
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager
+from typing import Callable, List
+from scripts.simulation.simulation import Simulation
+
+
+class Broker:
+    def __init__(self, lease_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Queue of genome chunks shared by optimizer and workers, lives in
+        manager server process, every method is called from its own thread.
+
+        Args:
+            lease_timeout (float): seconds without contact after which worker
+                is considered lost
+            clock (Callable): seconds of leases, time.monotonic
+        """
+        self.lease_timeout = lease_timeout
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.setup = None
+        self.version = 0
+        self.pending = deque()
+        # task id: (batch id, index of first genome, genomes)
+        self.tasks = {}
+        self.holders = {}
+        self.leased_at = {}
+        self.workers = {}
+        self.batches = {}
+        self.next_id = 0
+        self.closed = False
+        self.counters = {"lost_workers": 0, "resubmitted": 0, "stolen": 0, "duplicates": 0}
+
+    def configure(self, setup: dict) -> None:
+        """
+        Sets simulation options of workers (turn_time, cycles, car_adder).
+        """
+        with self.condition:
+            self.setup = setup
+            self.version += 1
+
+    def get_setup(self) -> tuple:
+        with self.condition:
+            return self.version, self.setup
+
+    def register(self, name: str) -> int:
+        with self.condition:
+            self.next_id += 1
+            self.workers[self.next_id] = self.clock()
+            return self.next_id
+
+    def renew(self, worker_id: int) -> bool:
+        """
+        Extends lease of worker busy with its chunks.
+
+        Returns:
+            bool: worker is still known, False after it was found lost
+        """
+        with self.condition:
+            if worker_id not in self.workers:
+                return False
+            self.workers[worker_id] = self.clock()
+            return True
+
+    def submit(self, genomes: list, chunk_size: int) -> int:
+        """
+        Splits genomes to chunks for workers.
+
+        Returns:
+            int: batch id for collect
+        """
+        with self.condition:
+            self.next_id += 1
+            batch_id = self.next_id
+            starts = range(0, len(genomes), chunk_size)
+            self.batches[batch_id] = {"results": [None] * len(genomes),
+                                      "remaining": len(starts)}
+            for start in starts:
+                self.next_id += 1
+                self.tasks[self.next_id] = (batch_id, start, genomes[start:start + chunk_size])
+                self.holders[self.next_id] = set()
+                self.pending.append(self.next_id)
+            self.condition.notify_all()
+            return batch_id
+
+    def expire(self) -> None:
+        """
+        Removes workers silent for lease_timeout, their unfinished chunks
+        go back to the front of the queue.
+        """
+        deadline = self.clock() - self.lease_timeout
+        for worker_id in [w for w, seen in self.workers.items() if seen < deadline]:
+            del self.workers[worker_id]
+            self.counters["lost_workers"] += 1
+            for task_id, holders in self.holders.items():
+                if worker_id in holders:
+                    holders.discard(worker_id)
+                    if not holders and task_id not in self.pending:
+                        self.pending.appendleft(task_id)
+                        self.counters["resubmitted"] += 1
+                        self.condition.notify_all()
+
+    def take(self, worker_id: int, max_tasks: int = 2, wait: float = 1.0):
+        """
+        Leases up to max_tasks chunks to worker, waits at most wait seconds
+        for work.
+
+        Returns:
+            list: (task id, setup version, genomes) of chunks, None when
+                broker is closed
+        """
+        with self.condition:
+            self.workers[worker_id] = self.clock()
+            self.expire()
+            if not self.pending and not self.closed:
+                self.condition.wait_for(lambda: self.pending or self.closed, wait)
+            if self.closed:
+                return None
+            now = self.clock()
+            self.workers[worker_id] = now
+            leased = []
+            while self.pending and len(leased) < max_tasks:
+                leased.append(self.pending.popleft())
+            if not leased:
+                # steal chunk waiting longest in other worker
+                candidates = [task_id for task_id, holders in self.holders.items()
+                              if len(holders) == 1 and worker_id not in holders]
+                if candidates:
+                    leased.append(min(candidates, key=self.leased_at.__getitem__))
+                    self.counters["stolen"] += 1
+            for task_id in leased:
+                self.holders[task_id].add(worker_id)
+                self.leased_at.setdefault(task_id, now)
+            return [(task_id, self.version, self.tasks[task_id][2]) for task_id in leased]
+
+    def complete(self, worker_id: int, task_id: int, fitness: List[float]) -> None:
+        with self.condition:
+            self.workers[worker_id] = self.clock()
+            if task_id not in self.tasks:
+                # the other copy of stolen chunk finished first
+                self.counters["duplicates"] += 1
+                return
+            batch_id, start, _ = self.tasks.pop(task_id)
+            del self.holders[task_id]
+            self.leased_at.pop(task_id, None)
+            if task_id in self.pending:
+                self.pending.remove(task_id)
+            batch = self.batches[batch_id]
+            batch["results"][start:start + len(fitness)] = fitness
+            batch["remaining"] -= 1
+            if not batch["remaining"]:
+                self.condition.notify_all()
+
+    def collect(self, batch_id: int, timeout: float = None) -> List[float]:
+        """
+        Waits for fitness of all genomes of batch.
+
+        Raises:
+            TimeoutError: batch wasn't finished in timeout seconds
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.condition:
+            batch = self.batches[batch_id]
+            while batch["remaining"]:
+                if deadline is not None and self.clock() > deadline:
+                    raise TimeoutError(f"batch {batch_id} not finished")
+                # wake up regularly to find lost workers
+                self.condition.wait(self.lease_timeout / 4)
+                self.expire()
+            del self.batches[batch_id]
+            return batch["results"]
+
+    def renew_interval(self) -> float:
+        return self.lease_timeout / 3
+
+    def stats(self) -> dict:
+        with self.condition:
+            self.expire()
+            return dict(self.counters, workers=len(self.workers), pending=len(self.pending))
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class BrokerManager(BaseManager):
+    pass
+
+
+# Broker of manager server process, created by _create_broker
+_broker: Broker = None
+
+
+def _create_broker(lease_timeout: float) -> None:
+    global _broker
+    _broker = Broker(lease_timeout)
+
+
+def _get_broker() -> Broker:
+    return _broker
+
+
+BrokerManager.register("get_broker", callable=_get_broker)
+
+
+def renew_lease(broker, worker_id: int, interval: float, stop: threading.Event) -> None:
+    """
+    Renews lease of worker every interval seconds until stop is set, so
+    long chunks are not taken for lost and evaluated twice.
+    """
+    try:
+        while not stop.wait(interval):
+            broker.renew(worker_id)
+    except (EOFError, ConnectionError):
+        return
+
+
+def run_worker(address: tuple, authkey: bytes, prefetch: int = 2) -> None:
+    """
+    Evaluates chunks from broker until it is closed or unreachable, lease
+    is renewed by thread with its own connection meanwhile.
+
+    Args:
+        address (tuple): host and port of broker
+        authkey (bytes): authentication key of broker
+        prefetch (int): chunks taken at once
+    """
+    manager = BrokerManager(address, authkey)
+    manager.connect()
+    broker = manager.get_broker()
+    worker_id = broker.register(f"{socket.gethostname()}:{os.getpid()}")
+    stop = threading.Event()
+    threading.Thread(target=renew_lease, daemon=True,
+                     args=(broker, worker_id, broker.renew_interval(), stop)).start()
+    version = None
+    try:
+        while True:
+            tasks = broker.take(worker_id, prefetch)
+            if tasks is None:
+                return
+            for task_id, task_version, genomes in tasks:
+                if task_version != version:
+                    version, setup = broker.get_setup()
+                    simulation = Simulation(**setup)
+                broker.complete(worker_id, task_id,
+                                [1000000 / simulation.run(genome) for genome in genomes])
+    except (EOFError, ConnectionError):
+        # broker was shut down
+        return
+    finally:
+        stop.set()
+
+
+class BrokerEvaluator:
+    def __init__(self, address: tuple = ("127.0.0.1", 0), authkey: bytes = None,
+                 local_workers: int = 0, chunk_size: int = None, lease_timeout: float = 30,
+                 cycles: int = 5, car_adder: list = None, seed: int = None,
+                 turn_time: int = 120, **options) -> None:
+        """
+        Evaluates populations on workers connected to broker, used as
+        evaluate of TrafficLightsOptGentetic. Broker is started in its own
+        process listening on address.
+
+        Args:
+            address (tuple): host and port to listen on, free port when 0
+            authkey (bytes, optional): key workers must know, random when
+                not given (self.authkey, hex for --authkey of workers)
+            local_workers (int): worker processes started on this machine
+            chunk_size (int, optional): genomes per chunk, about four chunks
+                per connected worker when not given
+            lease_timeout (float): seconds after which silent worker is lost
+            cycles (int): repetitions of lights cycle
+            car_adder (list, optional): arrivals, generated from seed when not given
+            seed (int, optional): seed of arrivals
+            turn_time (int): length of lights cycle
+            options: other TrafficLightsOptGentetic options, ignored
+        """
+        if car_adder is None:
+            car_adder = Simulation(turn_time, cycles, seed=seed).car_adder
+        self.authkey = os.urandom(16) if authkey is None else authkey
+        self.chunk_size = chunk_size
+        self.manager = BrokerManager(address, self.authkey)
+        self.manager.start(_create_broker, (lease_timeout,))
+        self.address = self.manager.address
+        self.broker = self.manager.get_broker()
+        self.broker.configure({"turn_time": turn_time, "cycles": cycles,
+                               "car_adder": car_adder})
+        self.processes: List[Process] = []
+        self.start_local_workers(local_workers)
+
+    def start_local_workers(self, count: int) -> None:
+        for _ in range(count):
+            process = Process(target=run_worker, args=(self.address, self.authkey), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def set_demand(self, car_adder: list) -> None:
+        """
+        Changes arrivals, workers rebuild simulation with next chunk.
+        """
+        _, setup = self.broker.get_setup()
+        self.broker.configure(dict(setup, car_adder=car_adder))
+
+    def __call__(self, genomes) -> List[float]:
+        """
+        Evaluates genomes on workers.
+
+        Args:
+            genomes (Population): genomes to evaluate
+
+        Returns:
+            List[float]: fitness of each genome in the same order
+        """
+        chunk_size = self.chunk_size or \
+            max(1, ceil(len(genomes) / (max(1, self.broker.stats()["workers"]) * 4)))
+        return self.broker.collect(self.broker.submit(list(genomes), chunk_size))
+
+    def close(self) -> None:
+        self.broker.close()
+        for process in self.processes:
+            process.join(5)
+        self.manager.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluation worker for BrokerEvaluator.")
+    parser.add_argument("address", help="HOST:PORT of broker")
+    parser.add_argument("--authkey", required=True,
+                        help="key of broker, hex of BrokerEvaluator.authkey")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes on this node")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(":", 1)
+    workers = [Process(target=run_worker, args=((host, int(port)), bytes.fromhex(args.authkey)))
+               for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -1,8 +1,12 @@
 import random
+import time
 from typing import List, Tuple, Callable
 from math import floor
+import numpy as np
 from scripts.simulation.simulation import *
 from copy import deepcopy
+from collections import OrderedDict
+from scripts.optimalization.archive import demand_fingerprint
 
 
 class Control:
@@ -10,13 +14,69 @@ class Control:
         self.stop = False
 
 
+class Termination:
+    def __init__(self,
+                 stagnation_generations: int = None,
+                 min_improvement: float = 0.0,
+                 max_seconds: float = None,
+                 max_evaluations: int = None) -> None:
+        """
+        Conditions ending evolution before all generations, checked after
+        every generation.
+
+        Args:
+            stagnation_generations (int, optional): stops when best fitness
+                improved relatively by at most min_improvement during that
+                many generations
+            min_improvement (float): relative improvement, 0 means any
+            max_seconds (float, optional): wall clock budget of run
+            max_evaluations (int, optional): budget of simulated genomes,
+                generation in progress is finished
+        """
+        self.stagnation_generations = stagnation_generations
+        self.min_improvement = min_improvement
+        self.max_seconds = max_seconds
+        self.max_evaluations = max_evaluations
+        self.start()
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        self.best: List[float] = []
+
+    def check(self, best_fitness: float, evaluations: int) -> str:
+        """
+        Args:
+            best_fitness (float): best fitness found so far
+            evaluations (int): genomes simulated so far
+
+        Returns:
+            str: "evaluations", "time" or "stagnation" when run should stop,
+                None otherwise
+        """
+        self.best.append(best_fitness)
+        if self.max_evaluations is not None and evaluations >= self.max_evaluations:
+            return "evaluations"
+        if self.max_seconds is not None and \
+                time.monotonic() - self.started >= self.max_seconds:
+            return "time"
+        window = self.stagnation_generations
+        if window and len(self.best) > window:
+            before = self.best[-1 - window]
+            if self.best[-1] - before <= self.min_improvement * abs(before):
+                return "stagnation"
+        return None
+
+
 class GeneticAlgorithm:
     Genome = List[List[Crossroad.LightsTimes]]
     Population = List[Genome]
     FitnessFunc = Callable[[Genome], float]
+    PopulationFitnessFunc = Callable[[Population], List[float]]
     GenomeFunc = Callable[[], Genome]
     MutationFunc = Callable[[Genome], Genome]
     CrossoverFunc = Callable[[Genome, Genome], Tuple[Genome]]
+    # sorted population and number of pairs, returns all parent pairs of generation
+    SelectionFunc = Callable[[list, int], List[Tuple[Genome, Genome]]]
 
     def __init__(self,
                  population_size: int,
@@ -24,8 +84,13 @@ class GeneticAlgorithm:
                  fitness: FitnessFunc,
                  mutation: MutationFunc,
                  crossover: CrossoverFunc,
-                 selection,
-                 control: Control) -> None:
+                 selection: SelectionFunc,
+                 control: Control,
+                 evaluate: PopulationFitnessFunc = None,
+                 genome_key: Callable[[Genome], tuple] = None,
+                 termination: Termination = None,
+                 cache_size: int = None,
+                 cache_count: int = 8) -> None:
         self.size = population_size
         self.generate_genome = generate_genome
         self.fitness = fitness
@@ -33,6 +98,49 @@ class GeneticAlgorithm:
         self.crossover = crossover
         self.selection = selection
         self.control = control
+        # evaluate scores whole population at once, e.g. in worker processes
+        self.evaluate = evaluate if evaluate is not None else \
+            lambda solutions: [self.fitness(solution) for solution in solutions]
+        self.evaluations = 0
+        # with genome_key fitness of genomes is cached, elites and duplicates
+        # are not simulated again, cache has to be cleared when fitness changes;
+        # least recently used genomes are dropped above cache_size (ten
+        # populations by default), so long runs don't grow it without limit
+        self.genome_key = genome_key
+        self.cache: Dict[tuple, float] = OrderedDict()
+        self.cache_size = cache_size if cache_size is not None else 10 * population_size
+        self.cache_hits = 0
+        # caches of other fitness (e.g. demand) kept by select_cache, together
+        # with current one at most cache_count
+        self.cache_key = None
+        self.caches: Dict[object, OrderedDict] = OrderedDict()
+        self.cache_count = cache_count
+        # last evaluated population sorted by fitness, used for warm start
+        self.final_population: GeneticAlgorithm.Population = []
+        self.termination = termination
+        # why last run ended: "generations", "control" or Termination.check reason
+        self.stop_reason: str = None
+        # (evaluations, best fitness so far) after every generation of last run
+        self.evaluation_history: List[Tuple[int, float]] = []
+
+    def select_cache(self, key) -> None:
+        """
+        Switches fitness cache when fitness changes, e.g. with demand.
+        Cache of key used before is taken back, so genomes evaluated on
+        recurring demand are not simulated again.
+
+        Args:
+            key: hashable description of what fitness depends on
+        """
+        if key == self.cache_key:
+            return
+        self.caches[self.cache_key] = self.cache
+        self.cache = self.caches.pop(key, None)
+        if self.cache is None:
+            self.cache = OrderedDict()
+        self.cache_key = key
+        while len(self.caches) >= self.cache_count:
+            self.caches.popitem(last=False)
 
     def generate_solutions(self) -> Population:
         return [self.generate_genome() for _ in range(self.size)]
@@ -40,8 +148,26 @@ class GeneticAlgorithm:
     def sort_solutions(self,
                        solutions: Population
                        ) -> Population:
-        sorted_solutions = [(solution, self.fitness(solution))
-                            for solution in solutions]
+        if self.genome_key is None:
+            self.evaluations += len(solutions)
+            fitnesses = self.evaluate(solutions)
+        else:
+            keys = [self.genome_key(solution) for solution in solutions]
+            missing = {}
+            for key, solution in zip(keys, solutions):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                elif key not in missing:
+                    missing[key] = solution
+            self.evaluations += len(missing)
+            self.cache_hits += len(solutions) - len(missing)
+            fitnesses = dict(zip(missing, self.evaluate(list(missing.values()))))
+            fitnesses = [fitnesses[key] if key in fitnesses else self.cache[key]
+                         for key in keys]
+            self.cache.update(zip(keys, fitnesses))
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        sorted_solutions = list(zip(solutions, fitnesses))
         return sorted(sorted_solutions,
                       key=lambda x: x[1],
                       reverse=True)
@@ -61,25 +187,59 @@ class GeneticAlgorithm:
 
         return list(elite_solutions)
 
+    def breed(self, sorted_solutions, next_generation: Population) -> Population:
+        """
+        Fills next generation with mutated children, parents of all pairs
+        are selected at once.
+        """
+        while len(next_generation) < self.size:
+            missing = self.size - len(next_generation)
+            for parent1, parent2 in self.selection(sorted_solutions, -(-missing // 2)):
+                for child in self.crossover(parent1, parent2):
+                    self.mutation(child)
+                    next_generation.append(child)
+        return next_generation
+
+    def start_run(self) -> None:
+        self.stop_reason = None
+        self.evaluation_history = []
+        if self.termination is not None:
+            self.termination.start()
+
+    def should_stop(self, best_fitness: float) -> bool:
+        """
+        Records generation in evaluation_history and sets stop_reason.
+
+        Returns:
+            bool: run should end after this generation
+        """
+        if self.evaluation_history:
+            best_fitness = max(best_fitness, self.evaluation_history[-1][1])
+        self.evaluation_history.append((self.evaluations, best_fitness))
+        if self.control.stop:
+            self.stop_reason = "control"
+        elif self.termination is not None:
+            self.stop_reason = self.termination.check(best_fitness, self.evaluations)
+        return self.stop_reason is not None
+
     def run_evolution(self, generations: int, elitism_perc: float = 0.0) -> Genome:
+        self.start_run()
         newGeneration = self.generate_solutions()
         for i in range(generations):
             sorted_solutions = self.sort_solutions(newGeneration[:self.size])
-            newGeneration = self.elite_solutions(
-                sorted_solutions, elitism_perc)
-            while (len(newGeneration) < self.size):
-                parent1, parent2 = self.selection(sorted_solutions)
-                children = self.crossover(parent1, parent2)
-                for child in children:
-                    self.mutation(child)
-                    newGeneration += [child]
+            newGeneration = self.breed(
+                sorted_solutions, self.elite_solutions(sorted_solutions, elitism_perc))
             print(f"generation {i} best solution: {sorted_solutions[0][1]}")
+            if self.should_stop(sorted_solutions[0][1]):
+                break
+        self.stop_reason = self.stop_reason or "generations"
         return self.sort_solutions(newGeneration)[0]
 
     def run_evolution_gui(self,
                           generations: int,
                           elitism_perc: float,
-                          update_progress: Callable[[int, float], None]
+                          update_progress: Callable[[int, float], None],
+                          initial_population: Population = None
                           ) -> Tuple[List[Tuple[Dict[Direction, float], List[Direction]]], List[float]]:
         """
         Przystosowana funkcja run_evolution do GUI.
@@ -88,40 +248,144 @@ class GeneticAlgorithm:
             generations (int): Liczba generacji.
             elitism_perc (float): Procent elityzmu.
             update_progress (Callable): Funkcja aktualizująca pasek postępu.
+            initial_population (Population, optional): Populacja startowa
+                (np. z poprzedniego okna), uzupełniana losowymi genomami.
 
         Returns:
-            Tuple: Najlepszy genom (z czasami i kolejnością świateł) i lista wartości fitness z każdej generacji.
+            Tuple: Najlepszy genom ze wszystkich generacji (z czasami i kolejnością świateł)
+                i lista najlepszych wartości fitness z każdej generacji, bez elityzmu
+                najlepsza nie musi być ostatnia.
+            Powód zakończenia jest w stop_reason, najlepsze fitness względem
+            liczby symulacji w evaluation_history.
         """
-        population = self.generate_solutions()
+        if initial_population is None:
+            population = self.generate_solutions()
+        else:
+            population = list(initial_population[:self.size])
+            population += [self.generate_genome()
+                           for _ in range(self.size - len(population))]
+        self.start_run()
         best_fitness_per_gen = []
+        best_overall = None
         for generation in range(generations):
             sorted_population = self.sort_solutions(population)
+            self.final_population = [solution for solution, _ in sorted_population]
             # Dodaj najlepszą wartość fitness do listy
             best_fitness_per_gen.append(sorted_population[0][1])
+            # przy remisie późniejszy, z elityzmem to zawsze najlepszy z ostatniej generacji
+            if best_overall is None or sorted_population[0][1] >= best_overall[1]:
+                best_overall = sorted_population[0]
             elite = self.elite_solutions(sorted_population, elitism_perc)
-            next_generation = list(elite)
-            while len(next_generation) < self.size:
-                parent1, parent2 = self.selection(sorted_population)
-                children = self.crossover(parent1, parent2)
-                for child in children:
-                    self.mutation(child)
-                    next_generation.append(child)
+            next_generation = self.breed(sorted_population, list(elite))
             population = next_generation[:self.size]
             # Aktualizacja paska postępu w GUI
             update_progress(generation + 1, best_fitness_per_gen[-1])
-            if self.control.stop == True:
-                best_solution_raw = sorted_population[0][0]  # Najlepszy genom
-                best_solution = [(crossroad[0], crossroad[1])
-                                 for crossroad in best_solution_raw]
-                return best_solution, best_fitness_per_gen
+            # Zatrzymanie przez użytkownika albo kryterium stopu
+            if self.should_stop(best_fitness_per_gen[-1]):
+                break
+        self.stop_reason = self.stop_reason or "generations"
 
         # Przekształcenie najlepszego rozwiązania w odpowiedni format
-        best_solution_raw = sorted_population[0][0]  # Najlepszy genom
+        best_solution_raw = best_overall[0]  # Najlepszy genom
         best_solution = [(crossroad[0], crossroad[1])
                          for crossroad in best_solution_raw]
         return best_solution, best_fitness_per_gen
 
 
+def generate_genome() -> GeneticAlgorithm.Genome:
+    """
+    Random genome, shared by TrafficLightsOptGentetic and NSGA-II.
+    Genome operators below use global random only.
+    """
+    genome = []
+    for _ in range(4):
+        lights_times = {Direction.SOUTH: random.random(),
+                        Direction.WEST: random.random(),
+                        Direction.NORTH: random.random(),
+                        Direction.EAST: random.random()}
+        normalize(lights_times)
+        lights_order = [Direction.SOUTH,
+                        Direction.WEST,
+                        Direction.NORTH,
+                        Direction.EAST]
+        random.shuffle(lights_order)
+        genome.append([lights_times, lights_order])
+    return genome
+
+
+def normalize(lights_times: Crossroad.LightsTimes) -> None:
+    """Normalizes lights times inplace so they sum to 100
+
+    Args:
+        lights_times (Crossroad.LightsTimes): _description_
+
+    Returns:
+        None
+    """
+    for direction in lights_times.keys():
+        lights_times[direction] = max(5, lights_times[direction])
+    sum_times = sum(lights_times.values())
+
+    for direction in lights_times.keys():
+        lights_times[direction] = lights_times[direction] / \
+            sum_times * 100
+
+
+def mutation(genome, mutation_prob) -> None:
+    """
+    mutate genome inplace
+
+    Returns:
+        None
+    """
+    # Swap permuation
+    if random.random() < mutation_prob:
+        # mutate direction order
+        i = random.randint(0, 3)
+        s1, s2 = random.randint(0, 3), random.randint(0, 3)
+        genome[i][1][s1], genome[i][1][s2] = genome[i][1][s2], genome[i][1][s1]
+
+        # mutate lights times
+        i = random.randint(0, 3)
+        for dir in genome[i][0].keys():
+            genome[i][0][dir] += random.gauss()*4
+            normalize(genome[i][0])
+
+
+def blx_alpha_crossover(parent1, parent2, alpha) -> Tuple:
+    """ BLX """
+    child1 = deepcopy(parent1)
+    child2 = deepcopy(parent2)
+    for i in range(len(child1)):
+        for direction in child1[i][0]:
+            norm = abs(parent1[i][0][direction] - parent2[i][0][direction])
+            child1[i][0][direction] = min(
+                parent1[i][0][direction], parent2[i][0][direction]) - alpha*norm
+            child2[i][0][direction] = max(
+                parent1[i][0][direction], parent2[i][0][direction]) + alpha*norm
+        normalize(child1[i][0])
+        normalize(child2[i][0])
+
+    return child1, child2
+
+
+def linear_crossover(parent1, parent2, alpha) -> Tuple:
+    child1 = deepcopy(parent1)
+    child2 = deepcopy(parent2)
+    for i in range(len(child1)):
+        for direction in child1[i][0]:
+            child1[i][0][direction] = alpha * parent1[i][0][direction] + \
+                (1 - alpha) * parent2[i][0][direction]
+            child2[i][0][direction] = alpha * parent2[i][0][direction] + \
+                (1 - alpha) * parent1[i][0][direction]
+        normalize(child1[i][0])
+        normalize(child2[i][0])
+    return child1, child2
+
+
+CROSSOVERS = {"blx": blx_alpha_crossover, "linear": linear_crossover}
+
+
 class TrafficLightsOptGentetic:
     type LightsTimes = List[Dict[Direction, int]]
     type LightsPermutation = List[List[Direction]]
@@ -133,14 +397,22 @@ class TrafficLightsOptGentetic:
                  crossover_type="linear",
                  selection_type="wagowo",
                  crossover_alpha=1.0,
-                 cycles=5) -> None:
+                 cycles=5,
+                 car_adder=None,
+                 seed=None,
+                 evaluate=None,
+                 tournament_size=2,
+                 termination: Termination = None) -> None:
         # To find neighbour easly light cycle can be represented as
         # list of times for each direction and
         # list of permutations specifying order of lights
         # this can be converted to lights_cycle (List[Direction])
         self.simulation = Simulation(
-            turn_time=120, cycles=cycles)
+            turn_time=120, cycles=cycles, car_adder=car_adder, seed=seed)
         self.cycles = cycles
+        # state genomes are scored from, see set_warm_start
+        self.warm_start: tuple = None
+        self.warm_state: SimulationState = None
         self.crossover_type = crossover_type
         self.selection_type = selection_type
         # Mapowanie nazw na odpowiednie funkcje
@@ -149,8 +421,10 @@ class TrafficLightsOptGentetic:
             "linear": lambda p1, p2: self.linear_crossover(p1, p2, crossover_alpha)
         }
         selection_funcs = {
-            "ranking": lambda sorted_solutions: self.selection_ranking(sorted_solutions),
-            "wagowo": lambda sorted_solutions: self.selection_weights(sorted_solutions),
+            "ranking": self.selection_ranking,
+            "wagowo": self.selection_weights,
+            "turniej": lambda sorted_solutions, pairs: self.selection_tournament(
+                sorted_solutions, pairs, tournament_size),
         }
         self.genetic_algorthm = GeneticAlgorithm(
             control=control,
@@ -159,42 +433,66 @@ class TrafficLightsOptGentetic:
             fitness=self.fitness,
             mutation=lambda genome: self.mutation(genome, mutation_prob),
             crossover=crossover_funcs[self.crossover_type],
-            selection=selection_funcs[self.selection_type]
+            selection=selection_funcs[self.selection_type],
+            evaluate=evaluate,
+            genome_key=self.genome_key,
+            termination=termination
         )
+        self.genetic_algorthm.cache_key = self.fitness_key()
 
-    def generate_genome(self) -> GeneticAlgorithm.Genome:
+    def genome_key(self, genome) -> tuple:
+        """
+        Hashable form of genome, used to cache its fitness.
+        """
+        return tuple((tuple(lights_times[direction] for direction in Direction),
+                      tuple(lights_order))
+                     for lights_times, lights_order in genome)
 
-        genome = []
-        for _ in range(4):
-            lights_times = {Direction.SOUTH: random.random(),
-                            Direction.WEST: random.random(),
-                            Direction.NORTH: random.random(),
-                            Direction.EAST: random.random()}
-            self.normalize(lights_times)
-            lights_order = [Direction.SOUTH,
-                            Direction.WEST,
-                            Direction.NORTH,
-                            Direction.EAST]
-            random.shuffle(lights_order)
-            genome.append([lights_times, lights_order])
-        return genome
+    def fitness_key(self) -> tuple:
+        """
+        What fitness depends on besides genome: demand fingerprint and
+        warm start, key of fitness cache.
+        """
+        warm_start = None if self.warm_start is None else \
+            (self.genome_key(self.warm_start[0]), self.warm_start[1])
+        return demand_fingerprint(self.simulation.car_adder), warm_start
 
-    def normalize(self, lights_times: Crossroad.LightsTimes) -> None:
-        """Normalizes lights times inplace so they sum to 100
+    def set_demand(self, car_adder) -> None:
+        """
+        Changes arrivals simulated by fitness. Fitness cached for other
+        demand is not valid for new one, cache of this demand is used
+        instead (empty unless the same arrivals were set before, see
+        GeneticAlgorithm.select_cache).
+        Evaluate passed to constructor (e.g. worker processes) is not updated.
 
         Args:
-            lights_times (Crossroad.LightsTimes): _description_
+            car_adder (list): (origin, destination) pairs
+        """
+        self.simulation.car_adder = car_adder
+        if self.warm_start is not None:
+            self.warm_state = self.simulation.warm_up(*self.warm_start)
+        self.genetic_algorthm.select_cache(self.fitness_key())
 
-        Returns:
-            None
+    def set_warm_start(self, plan, cycles: int = 1) -> None:
         """
-        for direction in lights_times.keys():
-            lights_times[direction] = max(5, lights_times[direction])
-        sum_times = sum(lights_times.values())
+        Scores genomes from state after cycles of plan instead of empty
+        network, warm up is simulated once here, not for every genome.
+        Switches fitness cache like set_demand. Evaluate passed to
+        constructor is not updated.
+
+        Args:
+            plan (List): plan simulated during warm up, None turns warm start off
+            cycles (int): cycles of warm up
+        """
+        self.warm_start = None if plan is None else (plan, cycles)
+        self.warm_state = None if plan is None else self.simulation.warm_up(plan, cycles)
+        self.genetic_algorthm.select_cache(self.fitness_key())
+
+    def generate_genome(self) -> GeneticAlgorithm.Genome:
+        return generate_genome()
 
-        for direction in lights_times.keys():
-            lights_times[direction] = lights_times[direction] / \
-                sum_times * 100
+    def normalize(self, lights_times: Crossroad.LightsTimes) -> None:
+        normalize(lights_times)
 
     def fitness(self, genome) -> int:
         """
@@ -206,74 +504,72 @@ class TrafficLightsOptGentetic:
         Returns:
             int: score
         """
+        if self.warm_state is not None:
+            return 1000000 / self.simulation.run_from(self.warm_state, genome)
         return (1000000)/self.simulation.run(genome)
 
     def mutation(self, genome, mutation_prob) -> None:
-        """
-        mutate genome inplace
-
-        Returns:
-            None
-        """
-        # Swap permuation
-        if random.random() < mutation_prob:
-            # mutate direction order
-            i = random.randint(0, 3)
-            s1, s2 = random.randint(0, 3), random.randint(0, 3)
-            genome[i][1][s1], genome[i][1][s2] = genome[i][1][s2], genome[i][1][s1]
-
-            # mutate lights times
-            i = random.randint(0, 3)
-            for dir in genome[i][0].keys():
-                genome[i][0][dir] += random.gauss()*4
-                self.normalize(genome[i][0])
-        pass
+        mutation(genome, mutation_prob)
 
     def blx_alpha_crossover(self, parent1, parent2, alpha) -> Tuple:
-        """ BLX """
-        child1 = deepcopy(parent1)
-        child2 = deepcopy(parent2)
-        for i in range(len(child1)):
-            for direction in child1[i][0]:
-                norm = abs(parent1[i][0][direction] - parent2[i][0][direction])
-                child1[i][0][direction] = min(
-                    parent1[i][0][direction], parent2[i][0][direction]) - alpha*norm
-                child2[i][0][direction] = max(
-                    parent1[i][0][direction], parent2[i][0][direction]) + alpha*norm
-            self.normalize(child1[i][0])
-            self.normalize(child2[i][0])
-
-        return child1, child2
+        return blx_alpha_crossover(parent1, parent2, alpha)
 
     def linear_crossover(self, parent1, parent2, alpha) -> Tuple:
-        child1 = deepcopy(parent1)
-        child2 = deepcopy(parent2)
-        for i in range(len(child1)):
-            for direction in child1[i][0]:
-                child1[i][0][direction] = alpha * parent1[i][0][direction] + \
-                    (1 - alpha) * parent2[i][0][direction]
-                child2[i][0][direction] = alpha * parent2[i][0][direction] + \
-                    (1 - alpha) * parent1[i][0][direction]
-            self.normalize(child1[i][0])
-            self.normalize(child2[i][0])
-        return child1, child2
+        return linear_crossover(parent1, parent2, alpha)
+
+    def parent_pairs(self, sorted_solutions, indices: np.ndarray) -> List[Tuple]:
+        return [(sorted_solutions[first][0], sorted_solutions[second][0])
+                for first, second in indices.reshape(-1, 2).tolist()]
+
+    def sample_parents(self, sorted_solutions, weights: np.ndarray, pairs: int) -> List[Tuple]:
+        """
+        Draws parents of all pairs of generation with a single cumsum and
+        searchsorted call on numpy generator seeded from random. Parents
+        differ from the former per pair random.choices loop for the same
+        random.seed, runs are repeatable but not equal to older ones.
+
+        Args:
+            sorted_solutions: (genome, fitness) pairs sorted by fitness
+            weights (np.ndarray): selection weight of every solution
+            pairs (int): number of parent pairs
+
+        Returns:
+            List[Tuple]: parent pairs
+        """
+        cumulative = np.cumsum(weights)
+        # generator seeded from random, so random.seed still makes runs repeatable
+        draws = np.random.default_rng(random.getrandbits(64)).random(2 * pairs)
+        indices = np.searchsorted(cumulative, draws * cumulative[-1], side="right")
+        return self.parent_pairs(sorted_solutions,
+                                 np.minimum(indices, len(sorted_solutions) - 1))
 
     def selection_weights(self,
-                          sorted_solutions
+                          sorted_solutions,
+                          pairs=1
                           ):
-        solutions, weights = zip(*sorted_solutions)
-        return tuple(random.choices(solutions,
-                                    weights=weights,
-                                    k=2))
+        weights = np.fromiter((fitness for _, fitness in sorted_solutions),
+                              dtype=float, count=len(sorted_solutions))
+        return self.sample_parents(sorted_solutions, weights, pairs)
 
     def selection_ranking(self,
-                          sorted_solutions
+                          sorted_solutions,
+                          pairs=1
                           ):
-        solutions, weights = zip(*sorted_solutions)
-        weights = [i for i in range(len(solutions), 0, -1)]
-        return tuple(random.choices(solutions,
-                                    weights=weights,
-                                    k=2))
+        weights = np.arange(len(sorted_solutions), 0, -1, dtype=float)
+        return self.sample_parents(sorted_solutions, weights, pairs)
+
+    def selection_tournament(self,
+                             sorted_solutions,
+                             pairs=1,
+                             size=2
+                             ):
+        """
+        Tournaments of size random solutions, solutions are sorted by
+        fitness, so the winner is the one with the lowest index.
+        """
+        rng = np.random.default_rng(random.getrandbits(64))
+        indices = rng.integers(len(sorted_solutions), size=(2 * pairs, size)).min(axis=1)
+        return self.parent_pairs(sorted_solutions, indices)
 
 
 if __name__ == "__main__":
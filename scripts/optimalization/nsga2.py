@@ -0,0 +1,321 @@
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from typing import Callable, List
+import numpy as np
+from scripts.simulation.simulation import *
+from scripts.optimalization.genetic_algorithm import (
+    Control, CROSSOVERS, generate_genome, mutation)
+
+# objectives of plan, all minimized (throughput is negated)
+OBJECTIVES = ("waiting_time", "throughput", "max_queue", "worst_lane_delay")
+
+
+def plan_objectives(simulation: Simulation, plan) -> np.ndarray:
+    """
+    All objectives from one run, read from lane and sink counters.
+
+    Args:
+        simulation (Simulation): simulation on crossroad objects (backend
+            "python"), kernel runs don't update counters
+        plan (List): solution in genome format
+
+    Returns:
+        np.ndarray: score, negated number of finished trips, longest queue
+            and mean delay per car of the worst lane (cars still waiting
+            count with their waiting time)
+    """
+    score = simulation.run(plan)
+    network = simulation.crossroad_network
+    lanes = [lane for crossroad in network.crossroad_network
+             for lane in crossroad.in_lanes.values()]
+    worst_delay = max((lane.total_delay + sum(car.waiting_time for car in lane.queue)) /
+                      max(lane.processed_cars + len(lane.queue), 1) for lane in lanes)
+    return np.array([score, -network.trip_summary()["trips"],
+                     max(lane.max_queue for lane in lanes), worst_delay], dtype=float)
+
+
+# Simulation living in each worker process, created once by _init_worker
+_worker_simulation: Simulation = None
+
+
+def _init_worker(cycles: int, car_adder: list) -> None:
+    global _worker_simulation
+    _worker_simulation = Simulation(turn_time=120, cycles=cycles, car_adder=car_adder,
+                                    backend="python")
+
+
+def _evaluate_objectives(genome) -> np.ndarray:
+    return plan_objectives(_worker_simulation, genome)
+
+
+class ObjectivesPoolEvaluator:
+    def __init__(self, workers: int, cycles: int = 5, car_adder: list = None,
+                 seed: int = None) -> None:
+        """
+        Evaluates objectives of populations in worker processes, evaluate
+        of TrafficLightsNSGA2. Objectives are read from crossroad objects,
+        so every worker runs its own simulation on crossroad objects.
+
+        Args:
+            workers (int): number of worker processes
+            cycles (int): repetitions of lights cycle
+            car_adder (list, optional): arrivals, generated from seed when not given
+            seed (int, optional): seed of arrivals
+        """
+        if car_adder is None:
+            car_adder = Simulation(seed=seed).car_adder
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            initializer=_init_worker,
+                                            initargs=(cycles, car_adder))
+
+    def __call__(self, genomes) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: objectives of every genome in the same order,
+                the same as plan_objectives
+        """
+        chunksize = max(1, ceil(len(genomes) / (self.workers * 4)))
+        return np.array(list(self.executor.map(_evaluate_objectives, genomes,
+                                               chunksize=chunksize)))
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def non_dominated_sort(objectives: np.ndarray) -> np.ndarray:
+    """
+    Fast non-dominated sort on dominance matrix.
+
+    Args:
+        objectives (np.ndarray): array (points, objectives), minimized
+
+    Returns:
+        np.ndarray: front of every point, 0 is Pareto front
+    """
+    left = objectives[:, None, :]
+    right = objectives[None, :, :]
+    # dominates[i, j]: i is not worse in any objective and better in one
+    dominates = (left <= right).all(axis=2) & (left < right).any(axis=2)
+    dominated_by = dominates.sum(axis=0)
+    fronts = np.full(len(objectives), -1)
+    front = 0
+    current = dominated_by == 0
+    while current.any():
+        fronts[current] = front
+        dominated_by -= dominates[current].sum(axis=0)
+        current = (dominated_by == 0) & (fronts < 0)
+        front += 1
+    return fronts
+
+
+def crowding_distance(objectives: np.ndarray, fronts: np.ndarray) -> np.ndarray:
+    """
+    Crowding distance of every point within its front, boundary points get inf.
+
+    Args:
+        objectives (np.ndarray): array (points, objectives)
+        fronts (np.ndarray): result of non_dominated_sort
+
+    Returns:
+        np.ndarray: crowding distance
+    """
+    points = len(objectives)
+    distance = np.zeros(points)
+    fronts_count = fronts.max() + 1
+    for values in objectives.T:
+        # points of every front next to each other, sorted by objective
+        order = np.lexsort((values, fronts))
+        sorted_values = values[order]
+        sorted_fronts = fronts[order]
+        low = np.full(fronts_count, np.inf)
+        high = np.full(fronts_count, -np.inf)
+        np.minimum.at(low, fronts, values)
+        np.maximum.at(high, fronts, values)
+        span = (high - low)[sorted_fronts]
+        first = np.r_[True, sorted_fronts[1:] != sorted_fronts[:-1]]
+        last = np.r_[sorted_fronts[1:] != sorted_fronts[:-1], True]
+        gap = np.zeros(points)
+        inner = ~(first | last)
+        gap[inner] = (sorted_values[2:] - sorted_values[:-2])[inner[1:-1]]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            gap = np.where(span > 0, gap / span, 0.0)
+        gap[first | last] = np.inf
+        distance[order] += gap
+    return distance
+
+
+class NSGA2:
+    Genome = List[List[Crossroad.LightsTimes]]
+
+    def __init__(self,
+                 population_size: int,
+                 generate_genome: Callable[[], Genome],
+                 evaluate: Callable[[list], np.ndarray],
+                 mutation: Callable[[Genome], None],
+                 crossover: Callable[[Genome, Genome], tuple],
+                 control: Control,
+                 seed: int = None) -> None:
+        """
+        NSGA-II next to GeneticAlgorithm, with the same genome operators.
+
+        Args:
+            population_size (int): size of population
+            generate_genome (Callable): random genome
+            evaluate (Callable): objectives of list of genomes as array
+                (genomes, objectives), minimized
+            mutation (Callable): mutates genome in place
+            crossover (Callable): two children of two parents
+            control (Control): stops when control.stop is set
+            seed (int, optional): seed of tournaments
+        """
+        self.size = population_size
+        self.generate_genome = generate_genome
+        self.evaluate = evaluate
+        self.mutation = mutation
+        self.crossover = crossover
+        self.control = control
+        self.rng = np.random.default_rng(seed)
+        self.evaluations = 0
+
+    def tournament(self, fronts: np.ndarray, distance: np.ndarray, count: int) -> np.ndarray:
+        """
+        Binary tournaments on front, then crowding distance, drawn at once.
+
+        Returns:
+            np.ndarray: indices of count winners
+        """
+        first = self.rng.integers(len(fronts), size=count)
+        second = self.rng.integers(len(fronts), size=count)
+        first_wins = (fronts[first] < fronts[second]) | \
+            ((fronts[first] == fronts[second]) & (distance[first] > distance[second]))
+        return np.where(first_wins, first, second)
+
+    def run(self, generations: int,
+            update_progress: Callable[[int, np.ndarray], None] = None
+            ) -> Tuple[list, np.ndarray]:
+        """
+        Args:
+            generations (int): number of generations
+            update_progress (Callable, optional): called with generation and
+                objectives of Pareto front
+
+        Returns:
+            Tuple[list, np.ndarray]: genomes of Pareto front of last
+                population and their objectives
+        """
+        population = [self.generate_genome() for _ in range(self.size)]
+        objectives = np.asarray(self.evaluate(population), dtype=float)
+        self.evaluations += len(population)
+        fronts = non_dominated_sort(objectives)
+        distance = crowding_distance(objectives, fronts)
+        for generation in range(generations):
+            parents = self.tournament(fronts, distance, self.size + self.size % 2)
+            offspring = []
+            for first, second in parents.reshape(-1, 2):
+                for child in self.crossover(population[first], population[second]):
+                    self.mutation(child)
+                    offspring.append(child)
+            offspring = offspring[:self.size]
+            union = population + offspring
+            union_objectives = np.vstack(
+                (objectives, np.asarray(self.evaluate(offspring), dtype=float)))
+            self.evaluations += len(offspring)
+            union_fronts = non_dominated_sort(union_objectives)
+            union_distance = crowding_distance(union_objectives, union_fronts)
+            survivors = np.lexsort((-union_distance, union_fronts))[:self.size]
+            population = [union[i] for i in survivors]
+            objectives = union_objectives[survivors]
+            fronts = union_fronts[survivors]
+            distance = union_distance[survivors]
+            if update_progress is not None:
+                update_progress(generation + 1, objectives[fronts == 0])
+            if self.control.stop:
+                break
+        front = np.flatnonzero(fronts == 0)
+        return [population[i] for i in front], objectives[front]
+
+
+class TrafficLightsNSGA2:
+    def __init__(self,
+                 control: Control,
+                 population_size=100,
+                 mutation_prob=0.5,
+                 crossover_type="blx",
+                 crossover_alpha=1.0,
+                 cycles=5,
+                 car_adder=None,
+                 seed=None,
+                 evaluate=None) -> None:
+        """
+        Multi-objective optimization of lights, genomes and operators are
+        the same as in TrafficLightsOptGentetic (module functions of
+        genetic_algorithm, only own simulation is built).
+
+        Args:
+            evaluate (Callable, optional): objectives of list of genomes,
+                plan_objectives on own simulation by default
+            other arguments: the same as in TrafficLightsOptGentetic
+        """
+        self.simulation = Simulation(turn_time=120, cycles=cycles, car_adder=car_adder,
+                                     seed=seed, backend="python")
+        crossover = CROSSOVERS[crossover_type]
+        self.nsga2 = NSGA2(
+            population_size=population_size,
+            generate_genome=generate_genome,
+            evaluate=evaluate if evaluate is not None else self.objectives,
+            mutation=lambda genome: mutation(genome, mutation_prob),
+            crossover=lambda parent1, parent2: crossover(parent1, parent2, crossover_alpha),
+            control=control,
+            seed=seed)
+
+    def objectives(self, genomes) -> np.ndarray:
+        return np.array([plan_objectives(self.simulation, genome) for genome in genomes])
+
+    def run(self, generations: int,
+            update_progress: Callable[[int, np.ndarray], None] = None) -> List[dict]:
+        """
+        Returns:
+            List[dict]: Pareto front sorted by waiting time, every point has
+                "plan" and "objectives" (name: value, throughput positive)
+        """
+        front, objectives = self.nsga2.run(generations, update_progress)
+        return pareto_points(front, objectives)
+
+
+def pareto_points(front: list, objectives: np.ndarray) -> List[dict]:
+    """
+    Pareto front as list of dictionaries, e.g. for GUI or JSON.
+    """
+    points = []
+    for plan, values in zip(front, objectives):
+        named = dict(zip(OBJECTIVES, values.tolist()))
+        named["throughput"] = -named["throughput"]
+        points.append({"plan": plan, "objectives": named})
+    points.sort(key=lambda point: point["objectives"]["waiting_time"])
+    return points
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(0)
+    optimizer = TrafficLightsNSGA2(Control(), population_size=60, seed=0)
+    start = time.perf_counter()
+    front = optimizer.run(15)
+    print(f"{len(front)} plans on Pareto front, {optimizer.nsga2.evaluations} simulations, "
+          f"{time.perf_counter() - start:.1f} s")
+    for point in front:
+        print({name: round(value, 1) for name, value in point["objectives"].items()})
+    objectives = np.random.default_rng(0).random((400, 4))
+    start = time.perf_counter()
+    for _ in range(20):
+        crowding_distance(objectives, non_dominated_sort(objectives))
+    print(f"sort and crowding of 400 points: {(time.perf_counter() - start) / 20 * 1e3:.1f} ms")
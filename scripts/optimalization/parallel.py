@@ -0,0 +1,165 @@
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from math import ceil
+from typing import List
+from scripts.simulation.simulation import Simulation
+from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+
+# Optimizer living in each worker process, created once by _init_worker
+_worker_optimizer: TrafficLightsOptGentetic = None
+
+
+def _init_worker(options: dict) -> None:
+    global _worker_optimizer
+    _worker_optimizer = TrafficLightsOptGentetic(Control(), **options)
+
+
+def _evaluate_genome(genome) -> float:
+    return _worker_optimizer.fitness(genome)
+
+
+class ProcessPoolEvaluator:
+    def __init__(self, workers: int, **options) -> None:
+        """
+        Evaluates populations in worker processes. Every worker builds its own
+        simulation once, so arrivals must be passed in options (car_adder or seed)
+        for all workers to score genomes on the same demand.
+
+        Args:
+            workers (int): number of worker processes
+            options: keyword arguments passed to TrafficLightsOptGentetic in workers
+        """
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            initializer=_init_worker,
+                                            initargs=(options,))
+
+    def __call__(self, genomes) -> List[float]:
+        """
+        Evaluates genomes in parallel.
+
+        Args:
+            genomes (Population): genomes to evaluate
+
+        Returns:
+            List[float]: fitness of each genome in the same order
+        """
+        # few big chunks per worker keep pickling overhead low
+        chunksize = max(1, ceil(len(genomes) / (self.workers * 4)))
+        return list(self.executor.map(_evaluate_genome, genomes,
+                                      chunksize=chunksize))
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def gil_enabled() -> bool:
+    """
+    Returns:
+        bool: False on free-threaded interpreter with GIL turned off
+    """
+    return getattr(sys, "_is_gil_enabled", lambda: True)()
+
+
+class ThreadPoolEvaluator:
+    def __init__(self, workers: int, cycles: int = 5, car_adder: list = None,
+                 seed: int = None, turn_time: int = 120, **options) -> None:
+        """
+        Evaluates populations on threads, nothing is pickled and no process
+        is started. Simulation mutates its lanes and queues, so every thread
+        has its own one, arrivals are shared. Threads run in parallel on
+        free-threaded interpreter or when simulation runs on compiled
+        kernel, which releases GIL. Otherwise they would only take turns
+        on GIL, so genomes are evaluated sequentially in calling thread.
+
+        Args:
+            workers (int): number of threads
+            cycles (int): repetitions of lights cycle
+            car_adder (list, optional): arrivals, generated from seed when not given
+            seed (int, optional): seed of arrivals
+            turn_time (int): length of lights cycle
+            options: other TrafficLightsOptGentetic options, ignored
+        """
+        simulation = Simulation(turn_time, cycles, car_adder=car_adder, seed=seed)
+        self.turn_time = turn_time
+        self.cycles = cycles
+        self.car_adder = simulation.car_adder
+        self.local = threading.local()
+        self.local.simulation = simulation
+        self.threaded = workers > 1 and (not gil_enabled() or simulation.kernel is not None)
+        self.workers = workers if self.threaded else 1
+        self.executor = ThreadPoolExecutor(max_workers=workers) if self.threaded else None
+
+    def simulation(self) -> Simulation:
+        """
+        Simulation of current thread, created on first use.
+        """
+        simulation = getattr(self.local, "simulation", None)
+        if simulation is None:
+            simulation = self.local.simulation = Simulation(
+                self.turn_time, self.cycles, car_adder=self.car_adder)
+        elif simulation.car_adder is not self.car_adder:
+            simulation.car_adder = self.car_adder
+        return simulation
+
+    def set_demand(self, car_adder: list) -> None:
+        """
+        Changes arrivals, threads switch with next chunk.
+        """
+        self.car_adder = car_adder
+
+    def evaluate_chunk(self, genomes) -> List[float]:
+        simulation = self.simulation()
+        return [1000000 / simulation.run(genome) for genome in genomes]
+
+    def __call__(self, genomes) -> List[float]:
+        """
+        Evaluates genomes on threads.
+
+        Args:
+            genomes (Population): genomes to evaluate
+
+        Returns:
+            List[float]: fitness of each genome in the same order
+        """
+        if self.executor is None:
+            return self.evaluate_chunk(genomes)
+        chunk = max(1, ceil(len(genomes) / (self.workers * 4)))
+        results = self.executor.map(self.evaluate_chunk,
+                                    [genomes[i:i + chunk] for i in range(0, len(genomes), chunk)])
+        return [fitness for result in results for fitness in result]
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(0)
+    optimizer = TrafficLightsOptGentetic(Control(), seed=0)
+    genomes = [optimizer.generate_genome() for _ in range(2000)]
+    print(f"GIL enabled: {gil_enabled()}")
+    for workers in (1, 2, 4):
+        with ThreadPoolEvaluator(workers, seed=0) as evaluator:
+            evaluator(genomes[:50])
+            start = time.perf_counter()
+            fitness = evaluator(genomes)
+            print(f"threads {workers} ({'parallel' if evaluator.threaded else 'sequential'}): "
+                  f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    assert fitness == [optimizer.fitness(genome) for genome in genomes]
@@ -0,0 +1,270 @@
+from itertools import permutations
+from typing import Dict, List, Tuple
+import numpy as np
+from scripts.simulation.simulation import *
+from scripts.simulation.kernel import FlatKernel, DIRECTION_INDEX
+
+# all lights orders of one crossroad
+ORDERS = [list(order) for order in permutations(Direction)]
+
+
+def lane_scores(simulation: Simulation) -> np.ndarray:
+    """
+    Score of last run on crossroad objects split by in lanes, sums to score.
+
+    Returns:
+        np.ndarray: score of lane crossroad * 4 + direction index
+    """
+    return np.array([lane.waiting_score +
+                     sum(car.waiting_time * (car.waiting_time - 1) // 2 for car in lane.queue)
+                     for crossroad in simulation.crossroad_network.crossroad_network
+                     for lane in map(crossroad.in_lanes.get, Direction)], dtype=np.int64)
+
+
+class PhaseOrderSearch:
+    def __init__(self, simulation: Simulation, prefill_scope: int = None) -> None:
+        """
+        Exact search of lights orders for fixed lights times. Score is sum
+        of lane parts and part of lane depends only on order of its
+        crossroad and orders of crossroads its cars passed before (scope of
+        lane). Lanes with the same scope form factor with table over orders
+        of its scope, one run of network gives one entry of every table.
+        Tables of small scopes are filled first by runs covering all their
+        entries at once (about 24 x 24 runs for pairs), entries of
+        bigger scopes are run only for branches not pruned, unknown entries
+        are bounded by 0. Tables are cached by lights times of scope, so
+        searches after change of other crossroads reuse them.
+
+        Args:
+            simulation (Simulation): simulation to optimize, runs on its
+                network on crossroad objects whatever its backend
+            prefill_scope (int, optional): the most searched crossroads in
+                scope of factors filled first, pairs when more than two
+                crossroads are searched by default
+
+        Raises:
+            ValueError: lanes have capacity, spillback couples lanes
+        """
+        network = simulation.crossroad_network
+        crossroads = network.crossroad_network
+        if any(lane.capacity is not None for crossroad in crossroads
+               for lane in crossroad.in_lanes.values()):
+            raise ValueError("Phase order search needs lanes without capacity")
+        self.simulation = Simulation(simulation.turn_time, simulation.cycles,
+                                     car_adder=simulation.car_adder,
+                                     crossroad_network=network, backend="python")
+        self.crossroads = len(crossroads)
+        self.prefill_scope = prefill_scope
+        self.factors = self.build_factors()
+        # (scope, lights times of scope): table of factor, nan for entries not run yet
+        self.tables: Dict[tuple, np.ndarray] = {}
+        self.runs = 0
+        self.nodes = 0
+
+    def build_factors(self) -> List[Tuple[tuple, list]]:
+        """
+        Returns:
+            List[Tuple[tuple, list]]: scope (crossroads) and lanes of every factor
+        """
+        simulation = self.simulation
+        network = simulation.crossroad_network
+        out_target = FlatKernel(simulation, compiled=False).out_target
+        lanes = self.crossroads * 4
+        feeds = [set() for _ in range(lanes)]
+        for origin, destination in simulation.car_adder:
+            path = Car(origin, destination, network.route(origin[0], destination[0])).path
+            lane = origin[0] * 4 + DIRECTION_INDEX[origin[1]]
+            for direction in path:
+                target = out_target[lane // 4 * 4 + DIRECTION_INDEX[direction]]
+                if target < 0:
+                    break
+                feeds[target].add(lane)
+                lane = target
+        # arrivals to lane depend on everything its feeding lanes depend on
+        scopes = [{lane // 4} for lane in range(lanes)]
+        changed = True
+        while changed:
+            changed = False
+            for lane in range(lanes):
+                for source in feeds[lane]:
+                    if not scopes[source] <= scopes[lane]:
+                        scopes[lane] |= scopes[source]
+                        changed = True
+        factors: Dict[tuple, list] = {}
+        for lane, scope in enumerate(scopes):
+            factors.setdefault(tuple(sorted(scope)), []).append(lane)
+        return list(factors.items())
+
+    def tables_for(self, lights_times: list) -> List[np.ndarray]:
+        tables = []
+        for scope, _ in self.factors:
+            key = (scope, tuple(tuple(lights_times[c][direction] for direction in Direction)
+                                for c in scope))
+            if key not in self.tables:
+                self.tables[key] = np.full((len(ORDERS),) * len(scope), np.nan)
+            tables.append(self.tables[key])
+        return tables
+
+    def evaluate(self, tables: List[np.ndarray], lights_times: list, orders: List[int]) -> None:
+        """
+        Runs orders (indices of ORDERS) and stores entries missing in tables.
+        """
+        self.runs += 1
+        self.simulation.run([[times, ORDERS[order]]
+                             for times, order in zip(lights_times, orders)])
+        scores = lane_scores(self.simulation)
+        for (scope, lanes), table in zip(self.factors, tables):
+            entry = tuple(orders[c] for c in scope)
+            if np.isnan(table[entry]):
+                table[entry] = scores[lanes].sum()
+
+    def prefill(self, tables: List[np.ndarray], lights_times: list, domains: List[list]) -> None:
+        """
+        Fills entries within domains of factors with up to prefill_scope
+        searched crossroads, every run takes missing entry of as many
+        factors as possible.
+        """
+        searched = sum(len(domain) > 1 for domain in domains)
+        prefill_scope = self.prefill_scope
+        if prefill_scope is None:
+            prefill_scope = min(2, searched - 1)
+        factors = [k for k, (scope, _) in enumerate(self.factors)
+                   if sum(len(domains[c]) > 1 for c in scope) <= prefill_scope]
+        missing = {}
+        for k in factors:
+            scope = self.factors[k][0]
+            grid = np.ix_(*(domains[c] for c in scope))
+            missing[k] = {tuple(domains[c][i] for c, i in zip(scope, entry))
+                          for entry in np.argwhere(np.isnan(tables[k][grid])).tolist()}
+        while any(missing.values()):
+            orders = [None] * self.crossroads
+            for k in sorted(missing, key=lambda k: -len(missing[k])):
+                scope = self.factors[k][0]
+                for entry in missing[k]:
+                    if all(orders[c] is None or orders[c] == order
+                           for c, order in zip(scope, entry)):
+                        for c, order in zip(scope, entry):
+                            orders[c] = order
+                        break
+            orders = [domains[c][0] if order is None else order
+                      for c, order in enumerate(orders)]
+            self.evaluate(tables, lights_times, orders)
+            for k in missing:
+                missing[k].discard(tuple(orders[c] for c in self.factors[k][0]))
+
+    def bound(self, tables: List[np.ndarray], orders: list) -> float:
+        """
+        Lower bound of score, factors with crossroads not set yet (None)
+        give the lowest entry consistent with orders, or 0 when some of
+        these entries are not known. Exact score when all are set and known.
+        """
+        total = 0.0
+        for (scope, _), table in zip(self.factors, tables):
+            values = table[tuple(slice(None) if orders[c] is None else orders[c]
+                                 for c in scope)]
+            if not np.isnan(values).any():
+                total += values.min()
+        return total
+
+    def unknown(self, tables: List[np.ndarray], orders: list) -> bool:
+        """
+        Returns:
+            bool: some factor with all crossroads set has entry not known
+        """
+        return any(all(orders[c] is not None for c in scope) and
+                   np.isnan(table[tuple(orders[c] for c in scope)])
+                   for (scope, _), table in zip(self.factors, tables))
+
+    def optimize(self, plan, crossroads: List[int] = None) -> Tuple[list, int]:
+        """
+        Best lights orders for lights times of plan.
+
+        Args:
+            plan (List): solution in genome format, its orders are kept for
+                crossroads not optimized and are initial best solution
+            crossroads (List[int], optional): crossroads whose order is
+                searched, all by default
+
+        Returns:
+            Tuple[list, int]: plan with best orders and its score
+        """
+        lights_times = [times for times, _ in plan]
+        current = [ORDERS.index(list(order)) for _, order in plan]
+        free = list(range(self.crossroads)) if crossroads is None else list(crossroads)
+        domains = [list(range(len(ORDERS))) if c in free else [current[c]]
+                   for c in range(self.crossroads)]
+        tables = self.tables_for(lights_times)
+        self.prefill(tables, lights_times, domains)
+        if self.unknown(tables, current):
+            self.evaluate(tables, lights_times, current)
+        best = [list(current), self.bound(tables, current)]
+
+        # crossroads closing most factors first, exact entries tighten bound
+        orders = [None if c in free else current[c] for c in range(self.crossroads)]
+        search_order = []
+        while len(search_order) < len(free):
+            def closed(c):
+                assigned = {i for i, order in enumerate(orders) if order is not None}
+                assigned.update(search_order + [c])
+                return (sum(set(scope) <= assigned for scope, _ in self.factors),
+                        sum(c in scope for scope, _ in self.factors))
+            search_order.append(max((c for c in free if c not in search_order), key=closed))
+
+        def search(depth: int) -> None:
+            self.nodes += 1
+            if depth == len(search_order):
+                value = self.bound(tables, orders)
+                if value < best[1]:
+                    best[0], best[1] = list(orders), value
+                return
+            c = search_order[depth]
+            candidates = []
+            for order in range(len(ORDERS)):
+                orders[c] = order
+                candidates.append((self.bound(tables, orders), order))
+            for value, order in sorted(candidates):
+                if value >= best[1]:
+                    break
+                orders[c] = order
+                if self.unknown(tables, orders):
+                    # crossroads not set yet take orders of the best solution
+                    self.evaluate(tables, lights_times,
+                                  [b if o is None else o for o, b in zip(orders, best[0])])
+                    if self.bound(tables, orders) >= best[1]:
+                        continue
+                search(depth + 1)
+            orders[c] = None
+
+        search(0)
+        return ([[times, list(ORDERS[order])] for times, order in zip(lights_times, best[0])],
+                int(best[1]))
+
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+
+    rng = random.Random(0)
+    simulation = Simulation(seed=0)
+    plan = [[{direction: rng.uniform(10, 40) for direction in Direction}, list(Direction)]
+            for _ in range(4)]
+    search = PhaseOrderSearch(simulation)
+    start = time.perf_counter()
+    best_plan, score = search.optimize(plan)
+    print(f"initial {simulation.run(plan)}, best {score} (run {simulation.run(best_plan)}), "
+          f"{search.runs} simulations instead of {len(ORDERS) ** 4}, {search.nodes} nodes, "
+          f"{time.perf_counter() - start:.1f} s")
+    plan[3][0] = {direction: rng.uniform(10, 40) for direction in Direction}
+    runs = search.runs
+    start = time.perf_counter()
+    best_plan, score = search.optimize(plan)
+    print(f"after change of crossroad 3 times: best {score}, {search.runs - runs} simulations, "
+          f"{time.perf_counter() - start:.1f} s")
+    if "--brute-force" in sys.argv:
+        from itertools import product
+        start = time.perf_counter()
+        brute = min(simulation.run([[times, ORDERS[order]] for times, order
+                                    in zip([times for times, _ in plan], orders)])
+                    for orders in product(range(len(ORDERS)), repeat=4))
+        print(f"brute force {brute}, {time.perf_counter() - start:.0f} s")
@@ -0,0 +1,151 @@
+import random
+import time
+from typing import List
+from scripts.simulation.simulation import *
+from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+
+
+def drifting_windows(windows: int, drift: float = 0.2, turn_time: int = 120,
+                     seed: int = None) -> List[list]:
+    """
+    Demand of consecutive windows, every window replaces drift share
+    of arrivals of previous one with new random arrivals.
+
+    Args:
+        windows (int): number of windows
+        drift (float): share of arrivals changed between windows
+        turn_time (int): length of window
+        seed (int, optional): seed of arrivals
+
+    Returns:
+        List[list]: arrivals ((origin, destination) pairs) of every window
+    """
+    rng = random.Random(seed)
+    origins = CrossroadNetwork().entry_points()
+    car_adder = Simulation(turn_time=turn_time, seed=rng.random()).car_adder
+    demand = [car_adder]
+    for _ in range(windows - 1):
+        car_adder = list(car_adder)
+        for i in rng.sample(range(turn_time), int(drift * turn_time)):
+            car_adder[i] = (rng.choice(origins), rng.choice(origins))
+        demand.append(car_adder)
+    return demand
+
+
+class RollingHorizonOptimizer:
+    def __init__(self, generations: int = 10, elitism_perc: float = 0.1,
+                 warm_start: bool = True, immigrants: float = 0.5,
+                 control: Control = None, **options) -> None:
+        """
+        Re-optimizes plan for every new demand window. With warm start
+        evolution continues from final population of previous window.
+        Fitness cached in previous window is not valid for changed demand,
+        so only population carries over, cached fitness is reused only
+        when demand of some earlier window comes back.
+
+        Args:
+            generations (int): generations run for every window
+            elitism_perc (float): elitism percentage
+            warm_start (bool): start from previous population, random when False
+            immigrants (float): share of worst genomes of previous population
+                replaced by random ones, keeps diversity after demand change
+            control (Control, optional): stops optimization of current window
+            options: passed to TrafficLightsOptGentetic, without evaluate
+                as worker processes would keep old demand
+        """
+        self.generations = generations
+        self.elitism_perc = elitism_perc
+        self.warm_start = warm_start
+        self.immigrants = immigrants
+        self.optimizer = TrafficLightsOptGentetic(
+            control if control is not None else Control(), **options)
+        self.genetic_algorithm = self.optimizer.genetic_algorthm
+        self.windows = 0
+
+    def optimize_window(self, car_adder: list) -> dict:
+        """
+        Optimizes plan for demand of next window.
+
+        Args:
+            car_adder (list): arrivals of window
+
+        Returns:
+            dict: best plan, fitness, fitness history with time of every
+                generation, simulated evaluations, cache hits and elapsed time
+        """
+        self.optimizer.set_demand(car_adder)
+        genetic_algorithm = self.genetic_algorithm
+        initial_population = None
+        if self.warm_start and self.windows:
+            kept = int(genetic_algorithm.size * (1 - self.immigrants))
+            initial_population = genetic_algorithm.final_population[:kept]
+        evaluations = genetic_algorithm.evaluations
+        cache_hits = genetic_algorithm.cache_hits
+        times = []
+        start = time.perf_counter()
+        best_solution, history = genetic_algorithm.run_evolution_gui(
+            self.generations, self.elitism_perc,
+            lambda generation, fitness: times.append(time.perf_counter() - start),
+            initial_population)
+        self.windows += 1
+        return {"best_plan": best_solution,
+                "best_fitness": history[-1],
+                "history": history,
+                "times": times,
+                "evaluations": genetic_algorithm.evaluations - evaluations,
+                "cache_hits": genetic_algorithm.cache_hits - cache_hits,
+                "elapsed": time.perf_counter() - start}
+
+
+def time_to_reach(result: dict, fitness: float) -> float:
+    """
+    Time after which window optimization reached fitness, None if it didn't.
+    """
+    for best, elapsed in zip(result["history"], result["times"]):
+        if best >= fitness:
+            return elapsed
+    return None
+
+
+def compare_with_cold_start(demand: List[list], cycle_seconds: float = 120,
+                            **options) -> List[dict]:
+    """
+    Optimizes every window with warm start and from scratch. Time to solution
+    is time until run reaches final fitness of cold start.
+
+    Args:
+        demand (List[list]): arrivals of every window, e.g. drifting_windows
+        cycle_seconds (float): real length of signal cycle, new plan should
+            be ready before it ends
+        options: passed to RollingHorizonOptimizer
+
+    Returns:
+        List[dict]: per window best fitness, time to solution and evaluations
+            of warm and cold runs
+    """
+    warm = RollingHorizonOptimizer(warm_start=True, **options)
+    report = []
+    for window, car_adder in enumerate(demand):
+        warm_result = warm.optimize_window(car_adder)
+        cold_result = RollingHorizonOptimizer(warm_start=False, **options)\
+            .optimize_window(car_adder)
+        target = cold_result["best_fitness"]
+        warm_time = time_to_reach(warm_result, target)
+        report.append({"window": window,
+                       "warm_fitness": warm_result["best_fitness"],
+                       "cold_fitness": target,
+                       "warm_time_to_solution": warm_time,
+                       "cold_time_to_solution": time_to_reach(cold_result, target),
+                       "warm_evaluations": warm_result["evaluations"],
+                       "warm_cache_hits": warm_result["cache_hits"],
+                       "cold_evaluations": cold_result["evaluations"],
+                       "within_cycle": warm_time is not None and warm_time <= cycle_seconds})
+    return report
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    for row in compare_with_cold_start(drifting_windows(5, seed=0),
+                                       generations=15, population_size=60,
+                                       crossover_type="blx", selection_type="ranking"):
+        print(row)
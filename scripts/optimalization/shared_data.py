@@ -0,0 +1,252 @@
+import sys
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from multiprocessing import shared_memory
+from typing import Dict, List
+import numpy as np
+from scripts.simulation.simulation import Simulation, Direction
+from scripts.simulation.kernel import FlatKernel, phase_array, DIRECTION_INDEX
+
+DIRECTIONS = list(Direction)
+
+
+def _release(memory: shared_memory.SharedMemory) -> None:
+    memory.close()
+    memory.unlink()
+
+
+def array_views(buffer, layout: dict) -> Dict[str, np.ndarray]:
+    return {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+            for name, (offset, shape, dtype) in layout.items()}
+
+
+class SharedArrays:
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Copies arrays once to one shared memory block. Other processes map
+        them without copying with attach_arrays(descriptor). Block is removed
+        by close, at the latest when this object is garbage collected.
+
+        Args:
+            arrays (Dict[str, np.ndarray]): arrays to publish
+        """
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            # every array starts at cache line
+            offset = -(-offset // 64) * 64
+            layout[name] = (offset, array.shape, array.dtype.str)
+            offset += array.nbytes
+        self.memory = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.descriptor = (self.memory.name, layout)
+        self.arrays = array_views(self.memory.buf, layout)
+        for name, array in arrays.items():
+            self.arrays[name][...] = array
+        self._finalizer = weakref.finalize(self, _release, self.memory)
+
+    def close(self) -> None:
+        """
+        Unmaps and removes block. Views returned in arrays must not be used after.
+        """
+        self.arrays = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def attach_arrays(descriptor: tuple) -> tuple:
+    """
+    Maps arrays published by SharedArrays in this process, read only.
+
+    Args:
+        descriptor (tuple): SharedArrays.descriptor
+
+    Returns:
+        tuple: shared memory (keep reference while arrays are used) and
+            dictionary of arrays
+    """
+    name, layout = descriptor
+    if sys.version_info >= (3, 13):
+        memory = shared_memory.SharedMemory(name, track=False)
+    else:
+        # workers share resource tracker of process that created block,
+        # so it is still removed only once
+        memory = shared_memory.SharedMemory(name)
+    arrays = array_views(memory.buf, layout)
+    for array in arrays.values():
+        array.flags.writeable = False
+    return memory, arrays
+
+
+def demand_array(car_adder: list) -> np.ndarray:
+    return np.array([(origin[0], DIRECTION_INDEX[origin[1]],
+                      destination[0], DIRECTION_INDEX[destination[1]])
+                     for origin, destination in car_adder], dtype=np.int64)
+
+
+def demand_from_array(demand: np.ndarray) -> list:
+    return [((int(row[0]), DIRECTIONS[row[1]]), (int(row[2]), DIRECTIONS[row[3]]))
+            for row in demand.tolist()]
+
+
+# State of worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(descriptor: tuple, turn_time: int, cycles: int,
+                 rejection_penalty: int) -> None:
+    memory, arrays = attach_arrays(descriptor)
+    simulation = Simulation(turn_time, cycles,
+                            car_adder=demand_from_array(arrays["demand"]),
+                            rejection_penalty=rejection_penalty)
+    # capacity of every in lane as in parent, kernel copies it on first run
+    unbounded = np.iinfo(np.int64).max
+    lanes = [crossroad.in_lanes[direction]
+             for crossroad in simulation.crossroad_network.crossroad_network
+             for direction in DIRECTIONS]
+    for lane, capacity in zip(lanes, arrays["capacity"].tolist(), strict=True):
+        lane.capacity = None if capacity == unbounded else capacity
+    if simulation.kernel is not None:
+        # kernel reads network and arrivals directly from shared memory
+        kernel = simulation.kernel
+        kernel.out_target = arrays["out_target"]
+        kernel.processing_time = arrays["processing_time"]
+        kernel.arrival_lane = arrays["arrival_lane"]
+        kernel.arrival_path = arrays["arrival_path"]
+        kernel.car_adder = simulation.car_adder
+    _worker.update(static=(memory, arrays), simulation=simulation,
+                   phases_name=None, phases=None)
+
+
+def _evaluate_range(descriptor: tuple, start: int, stop: int) -> List[float]:
+    if _worker["phases_name"] != descriptor[0]:
+        # population block was replaced by bigger one
+        _worker["phases"] = attach_arrays(descriptor)
+        _worker["phases_name"] = descriptor[0]
+    phases = _worker["phases"][1]["phases"]
+    simulation = _worker["simulation"]
+    return [1000000 / simulation.run_phases(phases[i]) for i in range(start, stop)]
+
+
+class SharedMemoryEvaluator:
+    def __init__(self, workers: int, cycles: int = 5, car_adder: list = None,
+                 seed: int = None, turn_time: int = 120, lane_capacity: int = None,
+                 rejection_penalty: int = None, **options) -> None:
+        """
+        Evaluates populations in worker processes like ProcessPoolEvaluator,
+        but demand, network tables and phase tables of genomes are published
+        in shared memory. Workers get only index ranges, nothing is pickled
+        per genome and static data exists once whatever number of workers.
+
+        Args:
+            workers (int): number of worker processes
+            cycles (int): repetitions of lights cycle
+            car_adder (list, optional): arrivals, generated from seed when not given
+            seed (int, optional): seed of arrivals
+            turn_time (int): length of lights cycle
+            lane_capacity (int, optional): same as in Simulation
+            rejection_penalty (int, optional): same as in Simulation
+            options: other TrafficLightsOptGentetic options, ignored
+        """
+        self.workers = workers
+        self.turn_time = turn_time
+        simulation = Simulation(turn_time, cycles, car_adder=car_adder, seed=seed,
+                                backend="python", lane_capacity=lane_capacity,
+                                rejection_penalty=rejection_penalty)
+        self.crossroads = len(simulation.crossroad_network.crossroad_network)
+        tables = FlatKernel(simulation, compiled=False)
+        tables.build_arrivals()
+        self.static = SharedArrays({"demand": demand_array(simulation.car_adder),
+                                    "out_target": tables.out_target,
+                                    "processing_time": tables.processing_time,
+                                    "capacity": tables.capacity,
+                                    "arrival_lane": tables.arrival_lane,
+                                    "arrival_path": tables.arrival_path})
+        self.population: SharedArrays = None
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(self.static.descriptor, turn_time, cycles,
+                      simulation.rejection_penalty))
+
+    def publish(self, genomes) -> tuple:
+        """
+        Writes phase tables of genomes to shared block, replaced by bigger
+        one when population doesn't fit.
+
+        Returns:
+            tuple: descriptor of block
+        """
+        if self.population is None or \
+                len(self.population.arrays["phases"]) < len(genomes):
+            if self.population is not None:
+                self.population.close()
+            self.population = SharedArrays({"phases": np.zeros(
+                (len(genomes), self.crossroads, self.turn_time), dtype=np.int8)})
+        phases = self.population.arrays["phases"]
+        for i, genome in enumerate(genomes):
+            phases[i] = phase_array(genome, self.turn_time)
+        return self.population.descriptor
+
+    def __call__(self, genomes) -> List[float]:
+        """
+        Evaluates genomes in parallel.
+
+        Args:
+            genomes (Population): genomes to evaluate
+
+        Returns:
+            List[float]: fitness of each genome in the same order
+        """
+        descriptor = self.publish(genomes)
+        chunk = max(1, ceil(len(genomes) / (self.workers * 4)))
+        starts = range(0, len(genomes), chunk)
+        results = self.executor.map(_evaluate_range, [descriptor] * len(starts), starts,
+                                    [min(start + chunk, len(genomes)) for start in starts])
+        return [fitness for result in results for fitness in result]
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        if self.population is not None:
+            self.population.close()
+        self.static.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import time
+    from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+    from scripts.optimalization.parallel import ProcessPoolEvaluator
+
+    def private_memory(pid) -> int:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            return sum(int(line.split()[1]) for line in file
+                       if line.startswith(("Private_Clean", "Private_Dirty")))
+
+    random.seed(0)
+    optimizer = TrafficLightsOptGentetic(Control(), seed=0)
+    genomes = [optimizer.generate_genome() for _ in range(400)]
+    for evaluator_type in (ProcessPoolEvaluator, SharedMemoryEvaluator):
+        for workers in (2, 4):
+            with evaluator_type(workers, seed=0) as evaluator:
+                evaluator(genomes)
+                start = time.perf_counter()
+                for _ in range(5):
+                    fitness = evaluator(genomes)
+                elapsed = (time.perf_counter() - start) / 5
+                memory = [private_memory(pid) for pid in evaluator.executor._processes]
+                print(f"{evaluator_type.__name__} workers {workers}: "
+                      f"{elapsed * 1000:.1f} ms per population, "
+                      f"private memory per worker {sum(memory) / len(memory) / 1024:.1f} MB")
+    assert fitness == [optimizer.fitness(genome) for genome in genomes]
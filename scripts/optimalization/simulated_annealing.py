@@ -2,23 +2,27 @@ from scripts.simulation.simulation import *
 import random
 import numpy as np
 from copy import deepcopy
-import matplotlib.pyplot as plt
+from typing import Callable
 
 
 class SimulatedAnnealing:
     type LightsTimes = List[Dict[Direction, int]]
     type LightsPermutation = List[List[Direction]]
 
-    def __init__(self) -> None:
+    def __init__(self,
+                 simulation: Simulation = None,
+                 temperature: float = 1000000,
+                 alfa: float = 0.98,
+                 min_temperature: float = 0.0001) -> None:
         # To find neighbour easly light cycle can be represented as
         # list of times for each direction and
         # list of permutations specifying order of lights
-        # this can be converted to lights_cycle (List[Direction])
+        # this can be converted to lights_cycle with Crossroad.generate_cycle
         self.lights_times: \
-            SimulatedAnnealing.LightsTimes = [{Direction.SOUTH: 20,
-                                               Direction.WEST: 20,
-                                               Direction.NORTH: 20,
-                                               Direction.EAST: 20}
+            SimulatedAnnealing.LightsTimes = [{Direction.SOUTH: 25,
+                                               Direction.WEST: 25,
+                                               Direction.NORTH: 25,
+                                               Direction.EAST: 25}
                                               for _ in range(4)]
         self.lights_permutation: \
             SimulatedAnnealing.LightsPermutation = [[Direction.SOUTH,
@@ -26,24 +30,39 @@ class SimulatedAnnealing:
                                                      Direction.NORTH,
                                                      Direction.EAST]
                                                     for _ in range(4)]
-        self.lights_cycle: \
-            List[Crossroad.LightsCycle] = self.generate_cycle(self.lights_times,
-                                                              self.lights_permutation)
-        self.simulation = Simulation(100, 10)
-
-    def fitness(self, lights_cycle: List[Crossroad.LightsCycle]) -> int:
+        self.simulation = simulation if simulation is not None \
+            else Simulation(120, 10)
+        self.temperature = temperature
+        self.alfa = alfa
+        self.min_temperature = min_temperature
+        self.evaluations = 0
+
+    def fitness(self, lights_times: LightsTimes) -> int:
         """
         Evaluates solution
 
         Args:
-            lights_cycle (List[Crossroad.LightsCycle]): Solution to evaluate
+            lights_times (LightsTimes): Solution to evaluate
 
         Returns:
-            int: score
+            int: simulation score (sum of waiting times), lower is better,
+                unlike fitness of genetic algorithm (1000000 / score)
+        """
+        self.evaluations += 1
+        return self.simulation.run(self.solution(lights_times))
+
+    def solution(self, lights_times: LightsTimes):
         """
-        for i, crossroad in enumerate(self.simulation.crossroad_network.crossroad_network):
-            crossroad.lights_cycle = lights_cycle[i]
-        return self.simulation.run()
+        Builds solution in the same format as genome in genetic algorithm.
+
+        Args:
+            lights_times (LightsTimes)
+
+        Returns:
+            List: lights times and lights order for every crossroad
+        """
+        return [[lights_times[i], self.lights_permutation[i]]
+                for i in range(len(lights_times))]
 
     def neigbour(self) -> LightsTimes:
         """
@@ -64,64 +83,49 @@ class SimulatedAnnealing:
         new_light_times[crossroad_id][remove_from] -= 1
         return new_light_times
 
-    def generate_cycle(self,
-                       lights_times: LightsTimes,
-                       lights_permutation: LightsPermutation
-                       ) -> List[Crossroad.LightsCycle]:
+    def run(self, update_progress: Callable[[int, float], None] = None):
         """
-        Generates light cycle based on light times and lights permutation.
+        Runs simulated Annealing and returns best solution. Current
+        solution can move to worse neighbour, so the best one found is
+        kept separately.
 
         Args:
-            lights_times (LightsTimes)
-            lights_permutation (LightsPermutation)
+            update_progress (Callable, optional): called with step number and
+                best score so far after every step
 
         Returns:
-            List[Crossroad.LightsCycle]
+            Tuple: best solution found and list of best scores so far
+                after every step
         """
-        lights_cycle_lst = []
-        for crossraod_id in range(4):
-            lights_cycle = []
-            for direction in lights_permutation[crossraod_id]:
-                lights_cycle += [direction] * \
-                    lights_times[crossraod_id][direction] + [None]*5
-            lights_cycle_lst.append(lights_cycle)
-        return lights_cycle_lst
-
-    def run(self) -> List[Crossroad.LightsCycle]:
-        """
-        Runs simulated Annealing and returns best solution
 
-        Returns:
-            List[Crossroad.LightsCycle]: _description_
-        """
-
-        lowest_score = self.fitness(self.lights_cycle)
-        temperature = 1000000
-        score_lst = [lowest_score]
-        temperature_lst = [temperature]
-        alfa = 0.98
-        while temperature > 0.0001:
+        current_score = self.fitness(self.lights_times)
+        best_score, best_lights_times = current_score, self.lights_times
+        temperature = self.temperature
+        score_lst = [best_score]
+        step = 0
+        while temperature > self.min_temperature:
             new_lights_times = self.neigbour()
-            new_lights_cycle = self.generate_cycle(
-                new_lights_times, self.lights_permutation)
-            new_score = self.fitness(new_lights_cycle)
-            difference = new_score - lowest_score
-            r = random.random()
-            p = np.exp((-difference)/temperature)
-            if difference < 0 or r < p:
-                lowest_score = new_score
-                self.lights_cycle = new_lights_cycle
+            new_score = self.fitness(new_lights_times)
+            difference = new_score - current_score
+            if difference < 0 or \
+                    random.random() < np.exp((-difference)/temperature):
+                current_score = new_score
+                # neighbours are copies, accepted times are never changed later
                 self.lights_times = new_lights_times
-            score_lst.append(lowest_score)
-            temperature_lst.append(temperature)
-            temperature *= alfa
-        print(self.lights_times)
-        plt.plot(temperature_lst, score_lst)
-        plt.show()
-        return self.lights_cycle
-
+                if current_score < best_score:
+                    best_score, best_lights_times = current_score, new_lights_times
+            score_lst.append(best_score)
+            temperature *= self.alfa
+            step += 1
+            if update_progress is not None:
+                update_progress(step, best_score)
+        return self.solution(best_lights_times), score_lst
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
 
     optimaliztion = SimulatedAnnealing()
-    optimaliztion.run()
+    best_solution, score_lst = optimaliztion.run()
+    print(best_solution)
+    plt.plot(score_lst)
+    plt.show()
@@ -0,0 +1,235 @@
+from abc import ABC, abstractmethod
+from scripts.simulation.simulation import *
+
+
+class QueueView:
+    __slots__ = ("_crossroad", "_in_queues", "_out_queues", "directions")
+
+    def __init__(self, crossroad: Crossroad, internal_lanes: set) -> None:
+        """
+        Read only view of crossroad passed to controllers. Controller sees
+        queue lengths, not cars, so it can't change simulation state.
+
+        Args:
+            crossroad (Crossroad): viewed crossroad
+            internal_lanes (set): ids of lanes that are in lanes of some crossroad,
+                other out lanes leave network and are seen as empty
+        """
+        self._crossroad = crossroad
+        self._in_queues = {direction: lane.queue
+                           for direction, lane in crossroad.in_lanes.items()}
+        self._out_queues = {direction: lane.queue if id(lane) in internal_lanes else ()
+                            for direction, lane in crossroad.out_lanes.items()}
+        self.directions = tuple(crossroad.in_lanes)
+
+    @property
+    def current_phase(self) -> Direction:
+        """
+        Lane with green light, None before first decision.
+        """
+        return self._crossroad.current_phase
+
+    @property
+    def phase_time(self) -> int:
+        """
+        Turns of green light in current phase.
+        """
+        return self._crossroad.phase_time
+
+    def queue_length(self, direction: Direction) -> int:
+        return len(self._in_queues[direction])
+
+    def queue_lengths(self) -> Dict[Direction, int]:
+        return {direction: len(queue) for direction, queue in self._in_queues.items()}
+
+    def head_waiting_time(self, direction: Direction) -> int:
+        """
+        Turns waited by first car in lane, 0 when lane is empty.
+        """
+        queue = self._in_queues[direction]
+        return queue[0].waiting_time if queue else 0
+
+    def downstream_queue_length(self, direction: Direction) -> int:
+        """
+        Queue length of next crossroad's lane reached by leaving in direction.
+        """
+        return len(self._out_queues[direction])
+
+
+class SignalController(ABC):
+    """
+    Base class of adaptive controllers. Crossroad calls decide every turn
+    once current green light lasted min_green turns.
+    """
+    min_green = 5
+
+    def reset(self, view: QueueView) -> None:
+        """
+        Called before every run.
+        """
+        pass
+
+    @abstractmethod
+    def decide(self, view: QueueView) -> Direction:
+        """
+        Returns:
+            Direction: lane that should have green light, current phase
+                or None keeps current phase
+        """
+
+
+class ActuatedController(SignalController):
+    def __init__(self, min_green: int = 5, max_green: int = 40,
+                 order: List[Direction] = None) -> None:
+        """
+        Green light is extended while cars wait in lane (gap out when lane
+        is empty, max out after max_green), then it goes to next lane in order
+        with waiting cars. Empty lanes are skipped.
+
+        Args:
+            min_green (int): minimal green time
+            max_green (int): maximal green time when other lanes wait
+            order (List[Direction], optional): order of lanes, Direction order
+                when not given
+        """
+        self.min_green = min_green
+        self.max_green = max_green
+        self.order = list(order) if order is not None else list(Direction)
+
+    def decide(self, view: QueueView) -> Direction:
+        phase = view.current_phase
+        if phase is not None and view.queue_length(phase) \
+                and view.phase_time < self.max_green:
+            return phase
+        start = self.order.index(phase) + 1 if phase is not None else 0
+        for i in range(len(self.order)):
+            direction = self.order[(start + i) % len(self.order)]
+            if view.queue_length(direction):
+                return direction
+        return phase
+
+
+class MaxPressureController(SignalController):
+    def __init__(self, min_green: int = 5, threshold: float = 2) -> None:
+        """
+        Gives green light to lane with highest pressure: its queue minus
+        mean queue of lanes its cars can go to. Lanes leaving network
+        have no queue. Routes of cars are not known to controller.
+
+        Args:
+            min_green (int): minimal green time
+            threshold (float): how much higher pressure of other lane has
+                to be to switch, switching costs yellow light
+        """
+        self.min_green = min_green
+        self.threshold = threshold
+
+    def pressure(self, view: QueueView, direction: Direction) -> float:
+        downstream = 0
+        for out_direction in view.directions:
+            # cars don't turn back
+            if out_direction is not direction:
+                downstream += view.downstream_queue_length(out_direction)
+        return view.queue_length(direction) - downstream / (len(view.directions) - 1)
+
+    def decide(self, view: QueueView) -> Direction:
+        phase = view.current_phase
+        best = phase
+        if phase is None or not view.queue_length(phase):
+            # nothing to lose by switching from empty lane
+            best_pressure = float("-inf")
+        else:
+            best_pressure = self.pressure(view, phase) + self.threshold
+        for direction in view.directions:
+            pressure = self.pressure(view, direction)
+            if pressure > best_pressure and view.queue_length(direction):
+                best, best_pressure = direction, pressure
+        return best
+
+
+def run_controlled(simulation: Simulation, controllers: List[SignalController],
+                   observers=(), measure_latency: bool = False) -> int:
+    """
+    Runs simulation with adaptive controllers instead of lights cycles.
+    Score is the same as in Simulation.run, so it can be compared with plans.
+
+    Args:
+        simulation (Simulation): simulation to run
+        controllers (List[SignalController]): controller for every crossroad
+        observers (tuple): same as in Simulation.run
+        measure_latency (bool): store decision times of every crossroad
+            in crossroad.decision_times, see latency_summary
+
+    Returns:
+        int: score
+    """
+    crossroads = simulation.crossroad_network.crossroad_network
+    internal_lanes = {id(lane) for crossroad in crossroads
+                      for lane in crossroad.in_lanes.values()}
+    for crossroad, controller in zip(crossroads, controllers, strict=True):
+        crossroad.reset_queues()
+        crossroad.decision_times = [] if measure_latency else None
+        crossroad.set_controller(controller, QueueView(crossroad, internal_lanes))
+    return simulation.simulate(observers)
+
+
+def latency_summary(simulation: Simulation) -> dict:
+    """
+    Decision latency of last run_controlled with measure_latency.
+
+    Returns:
+        dict: number of decisions, median, 99th percentile and maximum in
+            microseconds, worst mean per crossroad
+    """
+    crossroads = simulation.crossroad_network.crossroad_network
+    times = sorted(time for crossroad in crossroads
+                   for time in crossroad.decision_times)
+    if not times:
+        return {"decisions": 0}
+    return {"decisions": len(times),
+            "p50_us": times[len(times) // 2] / 1000,
+            "p99_us": times[int(len(times) * 0.99)] / 1000,
+            "max_us": times[-1] / 1000,
+            "worst_crossroad_mean_us": max(
+                sum(crossroad.decision_times) / max(len(crossroad.decision_times), 1)
+                for crossroad in crossroads) / 1000}
+
+
+def measure_decision_latency(controller_type=MaxPressureController, rows: int = 20,
+                             columns: int = 20, cycles: int = 5, seed: int = 0,
+                             **options) -> dict:
+    """
+    Runs controllers on grid of crossroads and measures decision latency.
+
+    Args:
+        controller_type (type): controller class
+        rows (int): grid rows
+        columns (int): grid columns
+        cycles (int): simulated cycles of 120 turns
+        seed (int): seed of arrivals
+        options: passed to controller_type
+
+    Returns:
+        dict: latency_summary and score
+    """
+    simulation = Simulation(cycles=cycles, seed=seed,
+                            crossroad_network=GridNetwork(rows, columns))
+    controllers = [controller_type(**options)
+                   for _ in simulation.crossroad_network.crossroad_network]
+    score = run_controlled(simulation, controllers, measure_latency=True)
+    summary = latency_summary(simulation)
+    summary["crossroads"] = rows * columns
+    summary["score"] = score
+    return summary
+
+
+if __name__ == "__main__":
+    equal_plan = [[{direction: 25 for direction in Direction}, list(Direction)]
+                  for _ in range(4)]
+    simulation = Simulation(cycles=10, seed=1)
+    print("fixed plan", simulation.run(equal_plan))
+    for controller_type in (ActuatedController, MaxPressureController):
+        score = run_controlled(simulation, [controller_type() for _ in range(4)])
+        print(controller_type.__name__, score)
+    for controller_type in (ActuatedController, MaxPressureController):
+        print(controller_type.__name__, measure_decision_latency(controller_type))
@@ -0,0 +1,437 @@
+import random
+from typing import Iterator
+import numpy as np
+from scripts.simulation.simulation import *
+from scripts.simulation import kernel
+
+TICKS_PER_HOUR = 3600
+DAY_TICKS = 24 * TICKS_PER_HOUR
+
+
+class DemandProfile:
+    def __init__(self, periods: list, length: int = DAY_TICKS, seed: int = None) -> None:
+        """
+        Piecewise constant demand. Period lasts until start of next one.
+
+        Args:
+            periods (list): (start tick, cars per tick) or (start tick,
+                cars per tick, weights of entry points) sorted by start tick,
+                first period starts at 0
+            length (int): number of ticks
+            seed (int, optional): seed of arrivals, the same arrivals are
+                generated for every run
+        """
+        if not periods or periods[0][0] != 0:
+            raise ValueError("First demand period must start at tick 0")
+        self.periods = [(period[0], period[1], period[2] if len(period) > 2 else None)
+                        for period in periods]
+        self.length = length
+        self.seed = seed
+
+    @classmethod
+    def from_hours(cls, periods: list, length: int = DAY_TICKS, seed: int = None):
+        """
+        Same as constructor, but periods start at hour of day.
+        """
+        return cls([(int(period[0] * TICKS_PER_HOUR),) + tuple(period[1:])
+                    for period in periods], length, seed)
+
+    def chunks(self, entry_points: List[Location],
+               chunk_size: int = TICKS_PER_HOUR) -> Iterator[List[list]]:
+        """
+        Generates arrivals chunk by chunk, only one chunk is kept in memory.
+
+        Args:
+            entry_points (List[Location]): possible origins and destinations
+            chunk_size (int): ticks in chunk
+
+        Yields:
+            List[list]: (origin, destination) pairs arriving in every tick of chunk
+        """
+        rng = random.Random(self.seed)
+        period = -1
+        next_start = 0
+        for chunk_start in range(0, self.length, chunk_size):
+            chunk = []
+            for tick in range(chunk_start, min(chunk_start + chunk_size, self.length)):
+                if tick == next_start:
+                    period += 1
+                    _, rate, weights = self.periods[period]
+                    cars, fraction = int(rate), rate - int(rate)
+                    origin_weights = [1] * len(entry_points) if weights is None else \
+                        [weights.get(point, 0) for point in entry_points]
+                    next_start = self.periods[period + 1][0] \
+                        if period + 1 < len(self.periods) else self.length
+                count = cars + (rng.random() < fraction)
+                chunk.append([(rng.choices(entry_points, origin_weights)[0],
+                               rng.choice(entry_points)) for _ in range(count)]
+                             if count else ())
+            yield chunk
+
+
+def simulate_day_flat(phases, tick_plan, tick_turn, arrival_start, arrival_pair,
+                      pair_lane, pair_path, out_target, processing_time, capacity,
+                      queue, head, tail, counter, waiting, car_pair, car_step, free, stats):
+    """
+    The same loop as DaySimulation.run for one chunk, on arrays like
+    kernel.simulate_flat. State arrays are changed in place, so next chunk
+    goes on from them.
+
+    Args:
+        phases (np.ndarray): phase_array of every plan of schedule
+        tick_plan, tick_turn (np.ndarray): plan and its turn of cycle in
+            every tick of chunk
+        arrival_start (np.ndarray): first arrival of every tick of chunk,
+            one more entry ends last tick
+        arrival_pair (np.ndarray): (origin, destination) pair index of arrivals
+        pair_lane (np.ndarray): in lane of origin of every pair
+        pair_path (np.ndarray): direction indices of path of every pair,
+            -1 after last one
+        out_target, processing_time, capacity (np.ndarray): see simulate_flat
+        queue (np.ndarray): ring buffer of cars of every lane, indexed by
+            head and tail modulo its length
+        head, tail, counter (np.ndarray): queue ends and processing counter
+            of every lane
+        waiting, car_pair, car_step (np.ndarray): state of every car slot
+        free (np.ndarray): free car slots, stats[0] first entries are used
+        stats (np.ndarray): free car slots and cars that left network
+
+    Returns:
+        int: score of chunk
+    """
+    crossroads = out_target.shape[0] // 4
+    size = queue.shape[1]
+    score = 0
+    for i in range(tick_plan.shape[0]):
+        plan = tick_plan[i]
+        t = tick_turn[i]
+        for k in range(arrival_start[i], arrival_start[i + 1]):
+            stats[0] -= 1
+            car = free[stats[0]]
+            pair = arrival_pair[k]
+            car_pair[car] = pair
+            car_step[car] = 0
+            waiting[car] = 0
+            lane = pair_lane[pair]
+            queue[lane, tail[lane] % size] = car
+            tail[lane] += 1
+        for c in range(crossroads):
+            green = phases[plan, c, t]
+            if green < 0:
+                for lane in range(c * 4, c * 4 + 4):
+                    counter[lane] = 0
+            else:
+                lane = c * 4 + green
+                if head[lane] < tail[lane]:
+                    if counter[lane] >= processing_time[lane]:
+                        car = queue[lane, head[lane] % size]
+                        direction = pair_path[car_pair[car], car_step[car]]
+                        target = -1
+                        if direction >= 0:
+                            target = out_target[c * 4 + direction]
+                        if target < 0 or tail[target] - head[target] < capacity[target]:
+                            counter[lane] = 0
+                            head[lane] += 1
+                            if target >= 0:
+                                waiting[car] = 0
+                                car_step[car] += 1
+                                queue[target, tail[target] % size] = car
+                                tail[target] += 1
+                            else:
+                                # trip ended, slot is reused by next arrival
+                                free[stats[0]] = car
+                                stats[0] += 1
+                                if direction >= 0:
+                                    stats[1] += 1
+                    else:
+                        counter[lane] += 1
+            for lane in range(c * 4, c * 4 + 4):
+                for j in range(head[lane], tail[lane]):
+                    car = queue[lane, j % size]
+                    score += waiting[car]
+                    waiting[car] += 1
+    return score
+
+
+if kernel.numba is not None:
+    simulate_day_compiled = kernel.numba.njit(cache=True, nogil=True)(simulate_day_flat)
+else:
+    simulate_day_compiled = None
+
+
+class DayKernel(kernel.FlatKernel):
+    def __init__(self, simulation: 'DaySimulation', compiled: bool = True,
+                 cache_bytes: int = 16 * 2 ** 20) -> None:
+        """
+        Array form of day simulation network. Cars and queues are kept in
+        arrays growing only with number of cars in network at once.
+        Arrivals are converted chunk by chunk while running. Converted
+        arrivals (8 bytes per tick and per car, about 1 MB for a busy day)
+        are kept for following plans when the whole profile fits in
+        cache_bytes, longer profiles are streamed again on every run.
+
+        Args:
+            simulation (DaySimulation): simulation to run
+            compiled (bool): same as in FlatKernel
+            cache_bytes (int): the most memory taken by kept arrivals,
+                0 streams every run
+        """
+        super().__init__(simulation, compiled)
+        self.simulate = simulate_day_compiled if compiled else simulate_day_flat
+        self.cache_bytes = cache_bytes
+        network = simulation.crossroad_network
+        entry_points = network.entry_points()
+        self.entry_index = {point: i for i, point in enumerate(entry_points)}
+        paths = [Car(origin, destination, network.route(origin[0], destination[0])).path
+                 for origin in entry_points for destination in entry_points]
+        self.pair_lane = np.array([origin[0] * 4 + kernel.DIRECTION_INDEX[origin[1]]
+                                   for origin in entry_points for _ in entry_points],
+                                  dtype=np.int64)
+        self.pair_path = np.full((len(paths), max(map(len, paths)) + 1), -1, dtype=np.int64)
+        for i, path in enumerate(paths):
+            self.pair_path[i, :len(path)] = [kernel.DIRECTION_INDEX[d] for d in path]
+        self.left_network = 0
+        # (profile, chunk size) arrivals were converted for and their chunks,
+        # None when they didn't fit in cache
+        self.arrivals_key = None
+        self.arrivals: List[tuple] = None
+
+    def convert(self, chunk: List[list]) -> tuple:
+        """
+        Returns:
+            tuple: arrival_start and arrival_pair of chunk, see simulate_day_flat
+        """
+        entry_index = self.entry_index
+        points = len(entry_index)
+        arrival_start = np.zeros(len(chunk) + 1, dtype=np.int64)
+        np.cumsum([len(arrivals) for arrivals in chunk], out=arrival_start[1:])
+        arrival_pair = np.array([entry_index[origin] * points + entry_index[destination]
+                                 for arrivals in chunk
+                                 for origin, destination in arrivals], dtype=np.int64)
+        return arrival_start, arrival_pair
+
+    def chunks(self) -> Iterator[tuple]:
+        """
+        Converted arrivals of profile chunk by chunk, kept ones when the
+        same profile was run before and fitted in cache.
+        """
+        simulation = self.simulation
+        key = (simulation.profile, simulation.chunk_size)
+        if self.arrivals_key == key and self.arrivals is not None:
+            yield from self.arrivals
+            return
+        kept, size = [], 0
+        for chunk in simulation.profile.chunks(simulation.crossroad_network.entry_points(),
+                                               simulation.chunk_size):
+            arrivals = self.convert(chunk)
+            if kept is not None:
+                size += arrivals[0].nbytes + arrivals[1].nbytes
+                if size <= self.cache_bytes:
+                    kept.append(arrivals)
+                else:
+                    # profile too long to keep, memory stays bounded by chunk
+                    kept = None
+            yield arrivals
+        self.arrivals_key, self.arrivals = key, kept
+
+    def reset(self, size: int = 64) -> None:
+        """
+        Empty network with room for size cars.
+        """
+        lanes = len(self.out_target)
+        self.queue = np.zeros((lanes, size), dtype=np.int64)
+        self.head = np.zeros(lanes, dtype=np.int64)
+        self.tail = np.zeros(lanes, dtype=np.int64)
+        self.counter = np.zeros(lanes, dtype=np.int64)
+        self.waiting = np.zeros(size, dtype=np.int64)
+        self.car_pair = np.zeros(size, dtype=np.int64)
+        self.car_step = np.zeros(size, dtype=np.int64)
+        self.free = np.arange(size, dtype=np.int64)
+        self.stats = np.array([size, 0], dtype=np.int64)
+
+    def reserve(self, arrivals: int) -> None:
+        """
+        Grows arrays so cars in network and arrivals fit, one lane never
+        holds more cars than there are.
+        """
+        size = self.queue.shape[1]
+        needed = size - self.stats[0] + arrivals
+        if needed <= size:
+            return
+        new_size = max(2 * size, needed)
+        queue = np.zeros((len(self.queue), new_size), dtype=np.int64)
+        for lane in range(len(queue)):
+            cars = self.tail[lane] - self.head[lane]
+            queue[lane, :cars] = self.queue[lane, np.arange(self.head[lane],
+                                                            self.tail[lane]) % size]
+            self.head[lane], self.tail[lane] = 0, cars
+        self.queue = queue
+        grow = np.zeros(new_size - size, dtype=np.int64)
+        self.waiting = np.concatenate((self.waiting, grow))
+        self.car_pair = np.concatenate((self.car_pair, grow))
+        self.car_step = np.concatenate((self.car_step, grow))
+        self.free = np.concatenate((self.free[:self.stats[0]],
+                                    np.arange(size, new_size, dtype=np.int64),
+                                    self.free[self.stats[0]:]))
+        self.stats[0] += new_size - size
+
+    def run_day(self, schedule: list) -> int:
+        """
+        Runs whole profile like DaySimulation.run.
+
+        Returns:
+            int: score
+        """
+        simulation = self.simulation
+        turn_time = simulation.turn_time
+        starts = np.array([start for start, _ in schedule], dtype=np.int64)
+        phases = np.array([kernel.phase_array(plan, turn_time) for _, plan in schedule])
+        self.build_capacity()
+        self.reset()
+        tick = 0
+        score = 0
+        for arrival_start, arrival_pair in self.chunks():
+            ticks = np.arange(tick, tick + len(arrival_start) - 1, dtype=np.int64)
+            tick_plan = np.searchsorted(starts, ticks, side="right") - 1
+            tick_turn = (ticks - starts[tick_plan]) % turn_time
+            self.reserve(len(arrival_pair))
+            score += self.simulate(phases, tick_plan, tick_turn, arrival_start, arrival_pair,
+                                   self.pair_lane, self.pair_path, self.out_target,
+                                   self.processing_time, self.capacity, self.queue,
+                                   self.head, self.tail, self.counter, self.waiting,
+                                   self.car_pair, self.car_step, self.free, self.stats)
+            tick += len(ticks)
+        self.left_network = int(self.stats[1])
+        return int(score)
+
+
+class DaySimulation:
+    def __init__(self, profile: DemandProfile, turn_time: int = 120,
+                 chunk_size: int = TICKS_PER_HOUR,
+                 crossroad_network: CrossroadNetwork = None, backend="auto") -> None:
+        """
+        Long horizon simulation with time varying demand and schedule of plans.
+        Arrivals are streamed in chunks and cars ending trip are reused,
+        so memory doesn't grow with simulated time, except arrivals kept
+        by DayKernel up to its cache_bytes.
+
+        Args:
+            profile (DemandProfile): demand over simulated time
+            turn_time (int): length of lights cycle
+            chunk_size (int): ticks of demand generated at once
+            crossroad_network (CrossroadNetwork, optional): 2x2 network when not given
+            backend (str): same as in Simulation, numba runs schedules
+                without observers on DayKernel
+        """
+        self.profile = profile
+        self.turn_time = turn_time
+        self.chunk_size = chunk_size
+        self.crossroad_network = crossroad_network if crossroad_network is not None \
+            else CrossroadNetwork()
+        self.car_pool = CarPool()
+        self.crossroad_network.set_car_pool(self.car_pool)
+        self.left_network = 0
+        # observers used by run when none are passed, see Simulation.run
+        self.observers = ()
+        if backend == "auto":
+            backend = kernel.BACKEND
+        self.backend = backend
+        # crossroad objects are not updated by kernel runs
+        self.kernel = DayKernel(self) if backend == "numba" else None
+
+    def set_plan(self, plan) -> None:
+        for crossroad, (lights_times, lights_order) in zip(
+                self.crossroad_network.crossroad_network, plan):
+            crossroad.lights_times = lights_times
+            crossroad.lights_order = lights_order
+            crossroad.lights_cycle = crossroad.generate_cycle()
+
+    def run(self, schedule: list, observers=None) -> int:
+        """
+        Runs whole profile. Lights cycle starts from beginning when plan changes.
+
+        Args:
+            schedule (list): (start tick, plan) pairs sorted by start tick,
+                first plan starts at 0, plan in genome format
+            observers (tuple, optional): same as in Simulation.run, tick
+                counted from start of profile
+
+        Returns:
+            int: score, the same measure as in Simulation.run
+        """
+        if not schedule or schedule[0][0] != 0:
+            raise ValueError("First plan must start at tick 0")
+        if observers is None:
+            observers = self.observers
+        if self.kernel is not None and not observers:
+            score = self.kernel.run_day(schedule)
+            self.left_network = self.kernel.left_network
+            return score
+        network = self.crossroad_network
+        crossroads = network.crossroad_network
+        for crossroad in crossroads:
+            if crossroad.controller is not None:
+                crossroad.set_controller(None, None)
+            crossroad.reset_queues()
+        turn_time = self.turn_time
+        switches = iter(schedule[1:] + [(self.profile.length, None)])
+        next_switch, next_plan = 0, schedule[0][1]
+        for observer in observers:
+            observer.start(self)
+        tick = 0
+        score = 0
+        for chunk in self.profile.chunks(network.entry_points(), self.chunk_size):
+            for arrivals in chunk:
+                if tick == next_switch:
+                    self.set_plan(next_plan)
+                    plan_start = tick
+                    next_switch, next_plan = next(switches)
+                for origin, destination in arrivals:
+                    network.add_car(self.car_pool.acquire(
+                        origin, destination, network.route(origin[0], destination[0])))
+                turn = (tick - plan_start) % turn_time
+                step_score = 0
+                for crossroad in crossroads:
+                    step_score += crossroad.step(turn)
+                score += step_score
+                for observer in observers:
+                    observer.observe(self, tick, step_score)
+                tick += 1
+        for observer in observers:
+            observer.finish(self)
+        self.left_network = network.trip_summary()["left_network"]
+        return score
+
+    def fitness(self, plan) -> float:
+        """
+        Fitness of plan used for whole profile, the same measure as
+        fitness of genetic algorithm (1000000 / score, higher is better).
+        """
+        return 1000000 / self.run([(0, plan)])
+
+    def evaluate(self, plans: list) -> List[float]:
+        """
+        Fitness of list of plans, evaluate of TrafficLightsOptGentetic
+        or CMAES scoring plans on whole day.
+        """
+        return [self.fitness(plan) for plan in plans]
+
+
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+
+    equal_plan = [[{direction: 25 for direction in Direction}, list(Direction)]
+                  for _ in range(4)]
+    profile = DemandProfile.from_hours(
+        [(0, 0.05), (6, 0.2), (7, 0.45), (9, 0.25), (15, 0.35), (16, 0.45),
+         (19, 0.2), (22, 0.05)], seed=0)
+    simulation = DaySimulation(profile)
+    schedule = [(0, equal_plan)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    score = simulation.run(schedule)
+    elapsed = time.perf_counter() - start
+    print(f"score {score}, {elapsed:.2f} s per day, "
+          f"peak memory {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB, "
+          f"left network {simulation.left_network}, backend {simulation.backend}")
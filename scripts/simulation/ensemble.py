@@ -0,0 +1,226 @@
+from math import atan, cos, pi, sin, sqrt
+from statistics import fmean, stdev
+from typing import Sequence
+from scripts.simulation.simulation import *
+from scripts.simulation.kernel import phase_array
+
+
+def t_probability(t: float, df: int) -> float:
+    """
+    Probability that |T| < t for Student t with integer df, finite series
+    of Abramowitz and Stegun 26.7.3 (exact).
+    """
+    theta = atan(t / sqrt(df))
+    squared = cos(theta) ** 2
+    total = 0.0
+    if df % 2:
+        term = cos(theta)
+        for k in range(1, (df - 1) // 2 + 1):
+            total += term
+            term *= squared * 2 * k / (2 * k + 1)
+        return 2 / pi * (theta + sin(theta) * total)
+    term = 1.0
+    for k in range(1, df // 2 + 1):
+        total += term
+        term *= squared * (2 * k - 1) / (2 * k)
+    return sin(theta) * total
+
+
+def t_quantile(confidence: float, df: int) -> float:
+    """
+    Two sided Student t quantile, bisection of t_probability, so it is
+    exact also for the small df of first scenarios (12.71 for df 1).
+    """
+    low, high = 0.0, 1.0
+    while t_probability(high, df) < confidence:
+        low, high = high, 2 * high
+    for _ in range(100):
+        middle = (low + high) / 2
+        if t_probability(middle, df) < confidence:
+            low = middle
+        else:
+            high = middle
+        if high - low < 1e-12 * high:
+            break
+    return (low + high) / 2
+
+
+def confidence_interval(values: List[float], confidence: float = 0.95) -> Tuple[float, float]:
+    """
+    Returns:
+        Tuple[float, float]: mean and half width of confidence interval
+    """
+    mean = fmean(values)
+    if len(values) < 2:
+        return mean, float("inf")
+    return mean, t_quantile(confidence, len(values) - 1) * stdev(values) / len(values)**0.5
+
+
+class ScenarioEnsemble:
+    def __init__(self, seeds: Sequence[int] = range(10), turn_time: int = 120,
+                 cycles: int = 5, min_scenarios: int = 4, batch_size: int = 2,
+                 confidence: float = 0.95, backend: str = "auto") -> None:
+        """
+        Scores plans on several demand scenarios. Scenarios of one batch are
+        simulated together, phase table of plan is computed once for all.
+        Plans are compared with incumbent (best plan so far) on the same
+        scenarios and evaluation stops as soon as confidence interval of
+        score difference shows candidate is worse.
+
+        Args:
+            seeds (Sequence[int]): seed of arrivals of every scenario
+            turn_time (int): length of lights cycle
+            cycles (int): repetitions of lights cycle
+            min_scenarios (int): scenarios simulated before first test
+            batch_size (int): scenarios added at once after first test
+            confidence (float): confidence level of intervals
+            backend (str): simulation backend, scenarios run one by one
+                on compiled kernel when it is used
+        """
+        self.simulations = [Simulation(turn_time, cycles, seed=seed, backend=backend)
+                            for seed in seeds]
+        self.turn_time = turn_time
+        self.cycles = cycles
+        self.min_scenarios = min(min_scenarios, len(self.simulations))
+        self.batch_size = batch_size
+        self.confidence = confidence
+        self.incumbent = None
+        self.incumbent_scores: List[int] = None
+        self.runs = 0
+        self.evaluations = 0
+
+    def phase_tables(self, plan) -> List[List[Direction]]:
+        crossroad = Crossroad()
+        tables = []
+        for lights_times, lights_order in plan:
+            crossroad.lights_times = lights_times
+            crossroad.lights_order = lights_order
+            crossroad.lights_cycle = crossroad.generate_cycle()
+            tables.append(crossroad.generate_phase_table(self.turn_time))
+        return tables
+
+    def run_batch(self, plan, scenarios: List[int], phase_tables=None) -> List[int]:
+        """
+        Simulates plan on scenarios in lockstep. Scores are the same as
+        from Simulation.run of every scenario.
+
+        Args:
+            plan (List): solution in genome format
+            scenarios (List[int]): indices of scenarios
+            phase_tables (list, optional): result of phase_tables(plan)
+
+        Returns:
+            List[int]: score of every scenario
+        """
+        simulations = [self.simulations[i] for i in scenarios]
+        self.runs += len(scenarios)
+        if all(simulation.kernel is not None for simulation in simulations):
+            phases = phase_array(plan, self.turn_time)
+            return [simulation.kernel.run_phases(phases) for simulation in simulations]
+        if phase_tables is None:
+            phase_tables = self.phase_tables(plan)
+        batch = []
+        for simulation in simulations:
+            crossroads = simulation.crossroad_network.crossroad_network
+            for crossroad in crossroads:
+                if crossroad.controller is not None:
+                    crossroad.set_controller(None, None)
+                crossroad.reset_queues()
+            simulation.rejected_cars = 0
+            batch.append((simulation, list(zip(crossroads, phase_tables))))
+        scores = [0] * len(simulations)
+        offset = self.cycles % 5
+        for _ in range(self.cycles):
+            for t in range(self.turn_time):
+                for i, (simulation, lanes) in enumerate(batch):
+                    score = 0
+                    if not t % 5:
+                        score += simulation.add_car(*simulation.car_adder[t + offset])
+                    for crossroad, table in lanes:
+                        score += crossroad.advance(table[t])
+                    scores[i] += score
+        return scores
+
+    def set_incumbent(self, plan, scores: List[int] = None) -> None:
+        """
+        Sets plan other plans are compared with, simulated on all scenarios
+        when scores are not given.
+        """
+        self.incumbent = plan
+        self.incumbent_scores = scores if scores is not None else \
+            self.run_batch(plan, range(len(self.simulations)))
+
+    def evaluate(self, plan) -> dict:
+        """
+        Scores plan on scenarios until it can be ranked against incumbent.
+        Plan that is not worse than incumbent is simulated on all scenarios
+        and becomes incumbent if its mean score is lower. Mean of plan
+        stopped early is paired estimate of its mean on all scenarios,
+        mean of incumbent plus mean difference on simulated ones, so means
+        of all plans are on the same scale.
+
+        Args:
+            plan (List): solution in genome format
+
+        Returns:
+            dict: mean score and confidence interval half width, scores of
+                simulated scenarios, decision ("worse", "better", "tie" or
+                "first" when there was no incumbent)
+        """
+        self.evaluations += 1
+        # kernel runs build their own phase array
+        tables = self.phase_tables(plan) if self.simulations[0].kernel is None else None
+        total = len(self.simulations)
+        scores = self.run_batch(plan, range(self.min_scenarios), tables)
+        decision = "first" if self.incumbent_scores is None else None
+        while decision is None:
+            differences = [score - incumbent for score, incumbent
+                           in zip(scores, self.incumbent_scores)]
+            mean, half_width = confidence_interval(differences, self.confidence)
+            if mean - half_width > 0:
+                decision = "worse"
+            elif len(scores) == total:
+                decision = "better" if mean + half_width < 0 else "tie"
+            else:
+                scenarios = range(len(scores), min(len(scores) + self.batch_size, total))
+                scores += self.run_batch(plan, scenarios, tables)
+        if decision == "worse" and len(scores) < total:
+            mean += fmean(self.incumbent_scores)
+            return {"mean": mean, "half_width": half_width, "scores": scores,
+                    "scenarios": len(scores), "decision": decision}
+        if len(scores) < total:
+            scores += self.run_batch(plan, range(len(scores), total), tables)
+        mean, half_width = confidence_interval(scores, self.confidence)
+        if decision != "worse" and (self.incumbent_scores is None or
+                                    mean < fmean(self.incumbent_scores)):
+            self.set_incumbent(plan, scores)
+        return {"mean": mean, "half_width": half_width, "scores": scores,
+                "scenarios": len(scores), "decision": decision}
+
+    def fitness(self, genome) -> float:
+        """
+        Fitness on mean score, same scale as TrafficLightsOptGentetic.fitness.
+        Estimates of plans stopped early don't depend on incumbent, so
+        fitness cached by genetic algorithm stays comparable after it changes.
+        """
+        return 1000000 / self.evaluate(genome)["mean"]
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+
+    random.seed(0)
+    ensemble = ScenarioEnsemble(range(12))
+    optimizer = TrafficLightsOptGentetic(Control(), population_size=40,
+                                         crossover_type="blx", selection_type="ranking",
+                                         evaluate=lambda genomes: [
+                                             ensemble.fitness(genome) for genome in genomes])
+    start = time.perf_counter()
+    best, history = optimizer.genetic_algorthm.run_evolution_gui(
+        10, 0.1, lambda generation, fitness: None)
+    print(f"{ensemble.evaluations} plans, {ensemble.runs} scenario runs "
+          f"({ensemble.runs / ensemble.evaluations:.1f} per plan of "
+          f"{len(ensemble.simulations)}), {time.perf_counter() - start:.1f} s")
+    print("best mean score", fmean(ensemble.incumbent_scores))
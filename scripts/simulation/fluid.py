@@ -0,0 +1,244 @@
+from math import floor
+from scripts.simulation.simulation import *
+
+
+def lane_score(arrival_rate: float, green_start: int, green_end: int,
+               turn_time: int, cycles: int, service_rate: float) -> Tuple[float, float]:
+    """
+    Deterministic fluid queue of one lane: cars arrive at constant rate,
+    leave at service rate while light is green. Car n arrives at n / rate
+    and leaves at D^-1(n) (D - cumulative departures, piecewise linear),
+    its waiting time w(n) is linear between breakpoints of D, so score
+    (sum of w(w-1)/2 over cars, like in Simulation) is integrated exactly.
+
+    Args:
+        arrival_rate (float): cars per turn
+        green_start (int): first turn of green light in cycle
+        green_end (int): turn after last turn of green light
+        turn_time (int): length of cycle
+        cycles (int): number of cycles
+        service_rate (float): cars per turn of green light
+
+    Returns:
+        Tuple[float, float]: score and cars that left lane
+    """
+    if arrival_rate <= 0:
+        return 0.0, 0.0
+    # first turn of green only starts processing counter
+    green_start = min(green_start + 1, green_end)
+    green = green_end - green_start
+    score = 0.0
+    departed = 0.0
+    cleared = False
+    for cycle in range(cycles):
+        start = cycle * turn_time + green_start
+        queue = arrival_rate * start - departed
+        # waiting time of next car to leave at start of green
+        wait_from = start - departed / arrival_rate
+        if service_rate > arrival_rate and queue < (service_rate - arrival_rate) * green:
+            # queue clears, waiting time falls linearly to 0, then cars
+            # leave when they come and don't add to score
+            leaving = service_rate * queue / (service_rate - arrival_rate)
+            cycle_score = (wait_from * wait_from / 3 - wait_from / 2) / 2 * leaving
+            score += cycle_score
+            departed = arrival_rate * (start + green)
+            if cleared:
+                # queue cleared in previous cycle too, following cycles are the same
+                score += cycle_score * (cycles - cycle - 1)
+                departed += arrival_rate * turn_time * (cycles - cycle - 1)
+                break
+            cleared = True
+        else:
+            leaving = service_rate * green
+            wait_to = wait_from + green - leaving / arrival_rate
+            square = (wait_from * wait_from + wait_from * wait_to + wait_to * wait_to) / 3
+            score += (square - (wait_from + wait_to) / 2) / 2 * leaving
+            departed += leaving
+            cleared = False
+    # cars still waiting at the end wait until the last turn
+    horizon = cycles * turn_time
+    wait_from = horizon - departed / arrival_rate
+    waiting = arrival_rate * horizon - departed
+    score += (wait_from * wait_from / 3 - wait_from / 2) / 2 * waiting
+    return score, departed
+
+
+class FluidEstimator:
+    def __init__(self, simulation: Simulation) -> None:
+        """
+        Fast deterministic estimate of Simulation.run score. Arrival rate of
+        every lane comes from arrivals and routes of simulation, part of
+        cars that can't leave upstream lane in time doesn't reach next lane.
+        Platoons are not modelled, cars come uniformly.
+
+        Args:
+            simulation (Simulation): simulation to approximate
+        """
+        self.simulation = simulation
+        self.turn_time = simulation.turn_time
+        self.cycles = simulation.cycles
+        network = simulation.crossroad_network
+        crossroads = network.crossroad_network
+        lane_index = {id(lane): (c, direction)
+                      for c, crossroad in enumerate(crossroads)
+                      for direction, lane in crossroad.in_lanes.items()}
+        self.service_rate = {(c, direction): 1 / (lane.processing_time + 1)
+                             for c, crossroad in enumerate(crossroads)
+                             for direction, lane in crossroad.in_lanes.items()}
+        # lanes visited by every car added in one cycle
+        offset = simulation.cycles % 5
+        routes = []
+        for t in range(0, self.turn_time, 5):
+            origin, destination = simulation.car_adder[t + offset]
+            lanes = [origin]
+            for direction in Car(origin, destination,
+                                 network.route(origin[0], destination[0])).path:
+                next_lane = lane_index.get(id(crossroads[lanes[-1][0]].out_lanes[direction]))
+                if next_lane is None:
+                    # car leaves network
+                    break
+                lanes.append(next_lane)
+            routes.append(lanes)
+        # cars coming to lane grouped by lanes they passed before
+        upstream = {}
+        for lanes in routes:
+            for i, lane in enumerate(lanes):
+                prefixes = upstream.setdefault(lane, {})
+                prefixes[tuple(lanes[:i])] = prefixes.get(tuple(lanes[:i]), 0) + 1
+        self.upstream = {lane: list(prefixes.items()) for lane, prefixes in upstream.items()}
+        self.lane_order = self.topological_order()
+
+    def topological_order(self) -> list:
+        """
+        Lanes ordered so upstream lanes come first. Lanes on cycle of routes
+        are appended at the end, they see upstream lanes as passing all cars.
+        """
+        before = {lane: {prefix[-1] for prefix, _ in prefixes if prefix}
+                  for lane, prefixes in self.upstream.items()}
+        order = []
+        ready = [lane for lane, lanes in before.items() if not lanes]
+        done = set()
+        while ready:
+            lane = ready.pop()
+            order.append(lane)
+            done.add(lane)
+            for other, lanes in before.items():
+                if other not in done and other not in ready and lanes <= done:
+                    ready.append(other)
+        return order + [lane for lane in before if lane not in done]
+
+    def green_times(self, plan) -> Dict[Tuple[int, Direction], Tuple[int, int]]:
+        """
+        Green light turns of every lane, the same as Crossroad.generate_phase_table.
+        """
+        greens = {}
+        for c, (lights_times, lights_order) in enumerate(plan):
+            start = 0
+            finish_time = 0
+            for direction in lights_order:
+                finish_time += lights_times[direction]
+                end = min(self.turn_time, floor(finish_time) + 1)
+                greens[(c, direction)] = (start, max(start, end))
+                start = max(start, end)
+                finish_time += Crossroad.yellow_time
+                start = max(start, min(self.turn_time, floor(finish_time) + 1))
+        return greens
+
+    def estimate(self, plan) -> float:
+        """
+        Args:
+            plan (List): solution in genome format
+
+        Returns:
+            float: estimated score
+        """
+        greens = self.green_times(plan)
+        turn_time = self.turn_time
+        horizon = turn_time * self.cycles
+        passed = {}
+        score = 0.0
+        for lane in self.lane_order:
+            rate = 0.0
+            for prefix, count in self.upstream[lane]:
+                for upstream_lane in prefix:
+                    count *= passed.get(upstream_lane, 1)
+                rate += count
+            rate /= turn_time
+            if rate <= 0:
+                passed[lane] = 0.0
+                continue
+            green_start, green_end = greens[lane]
+            lane_total, departed = lane_score(rate, green_start, green_end, turn_time,
+                                              self.cycles, self.service_rate[lane])
+            score += lane_total
+            passed[lane] = departed / (rate * horizon)
+        return score
+
+    def fitness(self, genome) -> float:
+        """
+        Fitness on estimated score, same scale as TrafficLightsOptGentetic.fitness.
+        """
+        return 1000000 / max(self.estimate(genome), 1)
+
+
+def rank_correlation(first: List[float], second: List[float]) -> float:
+    """
+    Spearman rank correlation (without ties correction).
+    """
+    def ranks(values):
+        order = sorted(range(len(values)), key=values.__getitem__)
+        result = [0] * len(values)
+        for rank, i in enumerate(order):
+            result[i] = rank
+        return result
+    first_ranks, second_ranks = ranks(first), ranks(second)
+    n = len(first)
+    squares = sum((a - b) ** 2 for a, b in zip(first_ranks, second_ranks))
+    return 1 - 6 * squares / (n * (n * n - 1))
+
+
+def validate(plans: list, seeds=range(5), cycles: int = 5) -> dict:
+    """
+    Compares estimator with simulation on plans.
+
+    Args:
+        plans (list): plans in genome format
+        seeds: seeds of arrivals
+        cycles (int): repetitions of lights cycle
+
+    Returns:
+        dict: mean rank correlation of plans over seeds and median ratio
+            of estimate to simulated score
+    """
+    correlations = []
+    ratios = []
+    for seed in seeds:
+        simulation = Simulation(cycles=cycles, seed=seed)
+        estimator = FluidEstimator(simulation)
+        simulated = [simulation.run(plan) for plan in plans]
+        estimated = [estimator.estimate(plan) for plan in plans]
+        correlations.append(rank_correlation(simulated, estimated))
+        ratios += [e / s for e, s in zip(estimated, simulated) if s]
+    ratios.sort()
+    return {"rank_correlation": sum(correlations) / len(correlations),
+            "median_ratio": ratios[len(ratios) // 2]}
+
+
+if __name__ == "__main__":
+    import timeit
+
+    rng = random.Random(0)
+    plans = []
+    for _ in range(100):
+        plan = []
+        for _ in range(4):
+            times = [rng.uniform(1, 60) for _ in Direction]
+            order = list(Direction)
+            rng.shuffle(order)
+            plan.append([{direction: time / sum(times) * 100
+                          for direction, time in zip(Direction, times)}, order])
+        plans.append(plan)
+    print(validate(plans))
+    estimator = FluidEstimator(Simulation(seed=0))
+    print(f"{min(timeit.repeat(lambda: estimator.estimate(plans[0]), number=100)) * 1e4:.1f}"
+          " us per estimate")
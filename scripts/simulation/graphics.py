@@ -3,12 +3,15 @@ from pygame.locals import *
 from scripts.simulation.simulation import *
 # from scripts.optimalization.simulated_annealing import *
 from scripts.optimalization.genetic_algorithm import *
+from scripts.simulation.recording import Recording
 import os
-import numpy as np
+
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 
 
 class SimulationGraphic:
-    def __init__(self, lights_cycle) -> None:
+    def __init__(self, lights_cycle, max_visible_cars=16) -> None:
         self.lights_cycle = lights_cycle
         self.step_counter = 0
         self.turn_time = 120
@@ -33,81 +36,218 @@ class SimulationGraphic:
             Direction.NORTH: (0, -12),
             Direction.SOUTH: (0, 12)
         }
+        self.car_radius = 6
+        self.light_radius = 10
+        # Cars further in queue would cover next crossroad
+        self.max_visible_cars = max_visible_cars
+        # Coordinates of lights and queue slots computed once, slot 0 is light
+        self.lane_xy = {(c_id, direction): [self.lane_to_xy(c_id, direction, i)
+                                            for i in range(max_visible_cars + 2)]
+                        for c_id in self.crossroad_to_xy
+                        for direction in Direction}
+        self.lane_rects = {key: self.slots_rect(xy[2:], self.car_radius)
+                           for key, xy in self.lane_xy.items()}
+        self.light_rects = {key: self.slots_rect(xy[:1], self.light_radius)
+                            for key, xy in self.lane_xy.items()}
+        self.phase_tables = [crossroad.generate_phase_table(self.turn_time)
+                             for crossroad in
+                             self.simulation.crossroad_network.crossroad_network]
+        self.car_sprite = self.circle_sprite("lightblue", self.car_radius)
+        self.light_sprites = {color: self.circle_sprite(color, self.light_radius)
+                              for color in ("yellow", "green", "red")}
+        # What is currently drawn on screen, used to find dirty rectangles
+        self.drawn_queues = {}
+        self.drawn_lights = {}
+
+    def circle_sprite(self, color, radius):
+        sprite = pygame.Surface((2*radius, 2*radius), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, color, (radius, radius), radius)
+        return sprite
+
+    def slots_rect(self, slots, radius):
+        rect = pygame.Rect(slots[0][0] - radius, slots[0][1] - radius,
+                           2*radius, 2*radius)
+        return rect.unionall([pygame.Rect(x - radius, y - radius, 2*radius, 2*radius)
+                              for x, y in slots])
+
+    def step_simulation(self, ticks: int = 1) -> None:
+        """
+        Runs simulation steps without waiting, used for fast-forward.
+
+        Args:
+            ticks (int): number of turns to simulate
+        """
+        for _ in range(ticks):
+            self.simulation.step(self.step_counter)
+            self.step_counter = (self.step_counter +
+                                 1) % self.turn_time
 
     def timer(self, timer_duration):
         current_time = pygame.time.get_ticks()
         elapsed_time = current_time - self.start_time
         if elapsed_time >= timer_duration:
             self.start_time = pygame.time.get_ticks()
-            self.simulation.step(self.step_counter)
-            self.step_counter = (self.step_counter +
-                                 1) % self.turn_time
+            self.step_simulation()
 
     def lane_to_xy(self, crossroad_id: int, lane_direction: Direction, i: int):
-        crossroad_xy = self.crossroad_to_xy[crossroad_id]
-        base_xy = self.lane_to_xy_map[lane_direction]
-        d_xy = self.lane_dxy_map[lane_direction]
-        d_xy = (d_xy[0]*i, d_xy[1]*i)
-        xy_cords = tuple(np.add(np.add(crossroad_xy, base_xy), d_xy))
-        return xy_cords
+        crossroad_x, crossroad_y = self.crossroad_to_xy[crossroad_id]
+        base_x, base_y = self.lane_to_xy_map[lane_direction]
+        d_x, d_y = self.lane_dxy_map[lane_direction]
+        return (crossroad_x + base_x + d_x*i, crossroad_y + base_y + d_y*i)
+
+    def queue_length(self, c_id: int, direction: Direction) -> int:
+        crossroad = self.simulation.crossroad_network.crossroad_network[c_id]
+        return len(crossroad.in_lanes[direction].queue)
+
+    def green_light(self, c_id: int) -> Direction:
+        return self.phase_tables[c_id][self.step_counter]
+
+    def light_color(self, c_id: int, direction: Direction) -> str:
+        green_light_now = self.green_light(c_id)
+        if green_light_now == None:
+            return "yellow"
+        elif green_light_now == direction:
+            return "green"
+        return "red"
+
+    def draw_lane(self, surface, c_id: int, direction: Direction, cars: int) -> None:
+        slots = self.lane_xy[(c_id, direction)]
+        radius = self.car_radius
+        surface.blits([(self.car_sprite, (x - radius, y - radius))
+                       for x, y in slots[2:cars + 2]], doreturn=False)
+
+    def draw_light(self, surface, c_id: int, direction: Direction, color: str) -> None:
+        x, y = self.lane_xy[(c_id, direction)][0]
+        radius = self.light_radius
+        surface.blit(self.light_sprites[color], (x - radius, y - radius))
 
     def render_cars(self, surface) -> None:
-        for c_id, crossroad in enumerate(self.simulation.crossroad_network.crossroad_network):
-            for direction, in_lane in crossroad.in_lanes.items():
-                for i, car in enumerate(in_lane.queue):
-                    # print(c_id, direction)
-                    pygame.draw.circle(surface, "lightblue",
-                                       self.lane_to_xy(c_id, direction, i+2), 6)
+        for c_id, direction in self.lane_xy:
+            cars = min(self.queue_length(c_id, direction), self.max_visible_cars)
+            self.draw_lane(surface, c_id, direction, cars)
+            self.drawn_queues[(c_id, direction)] = cars
 
     def render_lights(self, surface) -> None:
-        for c_id, crossroad in enumerate(
-                self.simulation.crossroad_network.crossroad_network):
-            for cycle in crossroad.lights_cycle:
-                if cycle[1] >= self.step_counter:
-                    green_light_now = cycle[0]
-                    break
+        for c_id in self.crossroad_to_xy:
             for direction in list(Direction):
-                if green_light_now == None:
-                    color = "yellow"
-                elif green_light_now == direction:
-                    color = "green"
-                else:
-                    color = "red"
-                pygame.draw.circle(surface, color,
-                                   self.lane_to_xy(c_id, direction, 0), 10)
+                color = self.light_color(c_id, direction)
+                self.draw_light(surface, c_id, direction, color)
+                self.drawn_lights[(c_id, direction)] = color
+
+    def render_dirty(self, surface, background) -> List:
+        """
+        Redraws only lanes and lights which changed since last frame.
+
+        Args:
+            surface: display surface
+            background: static background, used to erase old cars
+
+        Returns:
+            List[pygame.Rect]: rectangles to update on display
+        """
+        dirty_rects = []
+        for key in self.lane_xy:
+            c_id, direction = key
+            cars = min(self.queue_length(c_id, direction), self.max_visible_cars)
+            if self.drawn_queues.get(key) != cars:
+                rect = self.lane_rects[key]
+                surface.blit(background, rect, rect)
+                self.draw_lane(surface, c_id, direction, cars)
+                self.drawn_queues[key] = cars
+                dirty_rects.append(rect)
+            color = self.light_color(c_id, direction)
+            if self.drawn_lights.get(key) != color:
+                self.draw_light(surface, c_id, direction, color)
+                self.drawn_lights[key] = color
+                dirty_rects.append(self.light_rects[key])
+        return dirty_rects
+
+
+class ReplayGraphic(SimulationGraphic):
+    def __init__(self, recording: Recording, max_visible_cars=16) -> None:
+        """
+        Shows recorded simulation instead of running it again.
+
+        Args:
+            recording (Recording): recording loaded with load_recording
+        """
+        plan = recording.plan
+        if plan is None:
+            # recorded with adaptive controllers, lights come from recording anyway
+            plan = [[{direction: 25 for direction in Direction}, list(Direction)]
+                    for _ in range(4)]
+        super().__init__(plan, max_visible_cars)
+        self.recording = recording
+        self.tick = 0
+
+    def step_simulation(self, ticks: int = 1) -> None:
+        self.tick = (self.tick + ticks) % len(self.recording)
+
+    def queue_length(self, c_id: int, direction: Direction) -> int:
+        return self.recording.queue_length(self.tick, c_id, direction)
+
+    def green_light(self, c_id: int) -> Direction:
+        return self.recording.green_light(self.tick, c_id)
 
 
 class App:
-    def __init__(self) -> None:
+    def __init__(self, ticks_per_frame=0) -> None:
+        """
+        Args:
+            ticks_per_frame (int): simulation turns per frame (fast-forward),
+                0 runs one turn every 10 ms of real time
+        """
         self._running = True
         self._display_surf = None
         self.size = self.weight, self.height = 800, 800
         self.FPS = 60
         self.FramePerSec = pygame.time.Clock()
         self.simulation_graphics: SimulationGraphic
+        self.ticks_per_frame = ticks_per_frame
+        self.full_redraw = True
 
     def on_init(self):
         pygame.init()
-        self._display_surf = pygame.display.set_mode(
-            self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
+        # without DOUBLEBUF display.update(rects) updates only dirty rectangles
+        self._display_surf = pygame.display.set_mode(self.size)
 
+        # static layer is loaded and converted to display format once
         self.background_image = pygame.image.load(
-            "images\\4waycrossroad.jpg")
+            os.path.join(project_root, "images", "4waycrossroad.jpg")).convert()
         self._running = True
+        self.full_redraw = True
         return self._display_surf is not None
 
     def on_event(self, event):
         if event.type == pygame.QUIT:
             self._running = False  # Zatrzymuje pętlę Pygame
+        elif event.type == pygame.KEYDOWN:
+            # UP/DOWN zmienia przewijanie, 0 wraca do czasu rzeczywistego
+            if event.key == pygame.K_UP:
+                self.ticks_per_frame = max(1, self.ticks_per_frame * 2)
+            elif event.key == pygame.K_DOWN:
+                self.ticks_per_frame //= 2
+            elif event.key == pygame.K_0:
+                self.ticks_per_frame = 0
 
     def on_loop(self):
-        self.simulation_graphics.timer(10)
+        if self.ticks_per_frame:
+            self.simulation_graphics.step_simulation(self.ticks_per_frame)
+        else:
+            self.simulation_graphics.timer(10)
 
     def on_render(self):
-        self._display_surf.blit(self.background_image, (0, 0))
-        self.simulation_graphics.render_cars(self._display_surf)
-        self.simulation_graphics.render_lights(self._display_surf)
-        pygame.display.flip()
+        if self.full_redraw:
+            self._display_surf.blit(self.background_image, (0, 0))
+            self.simulation_graphics.render_cars(self._display_surf)
+            self.simulation_graphics.render_lights(self._display_surf)
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            dirty_rects = self.simulation_graphics.render_dirty(
+                self._display_surf, self.background_image)
+            if dirty_rects:
+                pygame.display.update(dirty_rects)
 
     def on_cleanup(self):
         pygame.quit()  # Zamyka tylko zasoby Pygame
@@ -126,11 +266,17 @@ class App:
 
 
 if __name__ == "__main__":
+    import sys
+    from scripts.simulation.recording import load_recording
 
-    traffic_opt = TrafficLightsOptGentetic()
-    opt = traffic_opt.genetic_algorthm.run_evolution(50, 0.1)
-    cycle = opt[0]
-    print(opt)
     theApp = App()
-    theApp.simulation_graphics = SimulationGraphic(cycle)
+    if len(sys.argv) > 1:
+        # replay recording saved by SimulationRecorder
+        theApp.simulation_graphics = ReplayGraphic(load_recording(sys.argv[1]))
+    else:
+        traffic_opt = TrafficLightsOptGentetic(Control())
+        opt = traffic_opt.genetic_algorthm.run_evolution(50, 0.1)
+        cycle = opt[0]
+        print(opt)
+        theApp.simulation_graphics = SimulationGraphic(cycle)
     theApp.on_execute()
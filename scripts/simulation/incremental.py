@@ -0,0 +1,155 @@
+import numpy as np
+from scripts.simulation.simulation import *
+from scripts.simulation.kernel import phase_array
+
+
+class IncrementalEvaluator:
+    def __init__(self, simulation: Simulation, interval: int = 5,
+                 capacity: int = 200) -> None:
+        """
+        Scores plans on crossroad objects reusing trajectories of plans scored
+        before. Lights cycle repeats, so child differs from its parent from
+        the first turn of first cycle where their phase tables differ. Before
+        it both runs are the same, child is simulated from the last parent
+        checkpoint before that turn. Parent is the stored plan with the latest
+        divergence, so it doesn't have to be known (e.g. mutated genomes).
+        Scores (and simulation.rejected_cars) are the same as from
+        Simulation.run. Stored trajectories are dropped when car_adder of
+        simulation is replaced (e.g. by set_demand of rolling horizon).
+
+        Args:
+            simulation (Simulation): simulation to run, always on crossroad
+                objects (compiled kernel runs whole plan faster)
+            interval (int): turns between checkpoints, multiple of 5, they
+                are kept for the first cycle only
+            capacity (int): number of plans whose checkpoints are kept
+        """
+        if interval % 5:
+            raise ValueError("Checkpoint interval must be multiple of 5")
+        self.simulation = simulation
+        self.interval = interval
+        self.capacity = capacity
+        crossroads = len(simulation.crossroad_network.crossroad_network)
+        self.phases = np.zeros((capacity, crossroads, simulation.turn_time), dtype=np.int8)
+        # (checkpoints as (state, score, rejected cars) every interval turns,
+        # score, rejected cars) of stored plans, all from arrivals car_adder
+        self.trajectories: List[tuple] = []
+        self.car_adder = simulation.car_adder
+        self.next_slot = 0
+        self.evaluations = 0
+        self.ticks_simulated = 0
+
+    def parent(self, phases: np.ndarray) -> Tuple[int, int]:
+        """
+        Returns:
+            Tuple[int, int]: slot of stored plan with the latest first
+                difference of phases and that turn (turn_time when phase
+                tables are the same), (None, 0) when nothing is stored
+        """
+        stored = len(self.trajectories)
+        if not stored:
+            return None, 0
+        different = (self.phases[:stored] != phases).any(axis=1)
+        first = np.where(different.any(axis=1), different.argmax(axis=1),
+                         self.simulation.turn_time)
+        slot = int(first.argmax())
+        return slot, int(first[slot])
+
+    def evaluate(self, plan) -> int:
+        """
+        Args:
+            plan (List): solution in genome format
+
+        Returns:
+            int: score, the same as Simulation.run(plan)
+        """
+        simulation = self.simulation
+        if simulation.car_adder is not self.car_adder:
+            self.clear()
+        turn_time = simulation.turn_time
+        total = simulation.cycles * turn_time
+        phases = phase_array(plan, turn_time)
+        slot, divergence = self.parent(phases)
+        self.evaluations += 1
+        if divergence == turn_time:
+            # the same lights, the same run
+            _, score, simulation.rejected_cars = self.trajectories[slot]
+            return score
+        simulation.init_corssroad_params(plan)
+        simulation.rejected_cars = 0
+        checkpoints = []
+        start, score = 0, 0
+        if slot is not None and divergence >= self.interval:
+            checkpoints = self.trajectories[slot][0][:divergence // self.interval + 1]
+            state, score, rejected = checkpoints[-1]
+            start = state.tick
+            simulation.restore(state)
+            simulation.rejected_cars = rejected
+        # index -1 is the last item
+        directions = list(Direction) + [None]
+        lanes = [(crossroad, [directions[i] for i in row]) for crossroad, row
+                 in zip(simulation.crossroad_network.crossroad_network, phases.tolist())]
+        car_adder = simulation.car_adder
+        offset = simulation.cycles % 5
+        for tick in range(start, total):
+            t = tick % turn_time
+            if not t % 5:
+                if tick < turn_time and not t % self.interval and \
+                        (tick > start or not checkpoints):
+                    checkpoints.append((simulation.snapshot(tick), score,
+                                        simulation.rejected_cars))
+                score += simulation.add_car(*car_adder[t + offset])
+            for crossroad, table in lanes:
+                score += crossroad.advance(table[t])
+        self.ticks_simulated += total - start
+        self.store(phases, (checkpoints, score, simulation.rejected_cars))
+        return score
+
+    def store(self, phases: np.ndarray, trajectory: tuple) -> None:
+        slot = self.next_slot
+        self.phases[slot] = phases
+        if slot < len(self.trajectories):
+            self.trajectories[slot] = trajectory
+        else:
+            self.trajectories.append(trajectory)
+        self.next_slot = (slot + 1) % self.capacity
+
+    def clear(self) -> None:
+        """
+        Drops stored trajectories, called when arrivals of simulation change.
+        """
+        self.trajectories = []
+        self.next_slot = 0
+        self.car_adder = self.simulation.car_adder
+
+    def average_ticks(self) -> float:
+        """
+        Returns:
+            float: turns simulated per evaluated plan
+        """
+        return self.ticks_simulated / max(self.evaluations, 1)
+
+    def fitness(self, genome) -> float:
+        return 1000000 / self.evaluate(genome)
+
+    def __call__(self, genomes) -> List[float]:
+        """
+        Evaluate callable for TrafficLightsOptGentetic.
+        """
+        return [self.fitness(genome) for genome in genomes]
+
+
+if __name__ == "__main__":
+    import time
+    from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+
+    random.seed(0)
+    incremental = IncrementalEvaluator(Simulation(seed=0, backend="python"))
+    optimizer = TrafficLightsOptGentetic(Control(), seed=0, evaluate=incremental,
+                                         crossover_type="blx", selection_type="ranking")
+    start = time.perf_counter()
+    optimizer.genetic_algorthm.run_evolution_gui(20, 0.1, lambda generation, fitness: None)
+    elapsed = time.perf_counter() - start
+    full = optimizer.simulation.cycles * optimizer.simulation.turn_time
+    print(f"{incremental.evaluations} plans, {incremental.average_ticks():.0f} of {full} "
+          f"turns simulated per plan, {elapsed:.1f} s")
@@ -0,0 +1,261 @@
+"""
+Simulation of lights plan on flat arrays. Compiled with numba when it is
+installed, Simulation uses it automatically for runs without observers.
+Without numba simulation runs on Crossroad and Lane objects as before.
+"""
+from math import floor
+import numpy as np
+from scripts.simulation.simulation import *
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = "numba" if numba is not None else "python"
+DIRECTION_INDEX = {direction: i for i, direction in enumerate(Direction)}
+
+
+def simulate_flat(phases, out_target, processing_time, arrival_lane, arrival_path,
+                  start, ticks, turn_time, offset, capacity, rejection_penalty,
+                  initial_lane, initial_slot, initial_step, initial_waiting,
+                  initial_counter):
+    """
+    The same loop as Simulation.run with Crossroad.step and Lane.process_cars,
+    on arrays. In lane of crossroad c from direction d has index c*4 + d.
+
+    Args:
+        phases (np.ndarray): green light index per crossroad and turn, -1=yellow
+        out_target (np.ndarray): in lane reached by leaving lane index in its
+            direction, -1 when car leaves network
+        processing_time (np.ndarray): processing time of every in lane
+        arrival_lane (np.ndarray): in lane of every car_adder entry
+        arrival_path (np.ndarray): direction indices of path of every
+            car_adder entry, -1 after last one
+        start (int): first turn, lights cycle and arrivals go on from
+            start % turn_time
+        ticks (int): turns to simulate
+        turn_time (int): length of lights cycle
+        offset (int): car_adder index offset, cycles % 5
+        capacity (np.ndarray): maximal queue of every in lane
+        rejection_penalty (int): score of car rejected by full entry lane
+        initial_lane, initial_slot, initial_step, initial_waiting (np.ndarray):
+            cars queued at start in queue order, see SimulationState
+        initial_counter (np.ndarray): processing counter of every lane at start
+
+    Returns:
+        int: score
+    """
+    lanes = out_target.shape[0]
+    crossroads = lanes // 4
+    # any turn_time turns in a row have one cycle of arrivals
+    cars = (ticks // turn_time + 1) * ((turn_time + 4) // 5) + initial_lane.shape[0]
+    # every lane gets at most every car once, so queues never wrap
+    queue = np.empty((lanes, cars), np.int64)
+    head = np.zeros(lanes, np.int64)
+    tail = np.zeros(lanes, np.int64)
+    counter = initial_counter.copy()
+    waiting = np.zeros(cars, np.int64)
+    car_slot = np.zeros(cars, np.int64)
+    car_step = np.zeros(cars, np.int64)
+    added = 0
+    for car in range(initial_lane.shape[0]):
+        lane = initial_lane[car]
+        queue[lane, tail[lane]] = car
+        tail[lane] += 1
+        car_slot[car] = initial_slot[car]
+        car_step[car] = initial_step[car]
+        waiting[car] = initial_waiting[car]
+        added += 1
+    score = 0
+    for tick in range(start, start + ticks):
+        t = tick % turn_time
+        if t % 5 == 0:
+            lane = arrival_lane[t + offset]
+            if tail[lane] - head[lane] >= capacity[lane]:
+                score += rejection_penalty
+            else:
+                car_slot[added] = t + offset
+                queue[lane, tail[lane]] = added
+                tail[lane] += 1
+                added += 1
+        for c in range(crossroads):
+            green = phases[c, t]
+            if green < 0:
+                for lane in range(c * 4, c * 4 + 4):
+                    counter[lane] = 0
+            else:
+                lane = c * 4 + green
+                if head[lane] < tail[lane]:
+                    if counter[lane] >= processing_time[lane]:
+                        car = queue[lane, head[lane]]
+                        direction = arrival_path[car_slot[car], car_step[car]]
+                        target = -1
+                        if direction >= 0:
+                            target = out_target[c * 4 + direction]
+                        if target < 0 or tail[target] - head[target] < capacity[target]:
+                            # otherwise next lane is full and car waits
+                            counter[lane] = 0
+                            head[lane] += 1
+                            waiting[car] = 0
+                            if direction >= 0:
+                                car_step[car] += 1
+                            if target >= 0:
+                                queue[target, tail[target]] = car
+                                tail[target] += 1
+                    else:
+                        counter[lane] += 1
+            for lane in range(c * 4, c * 4 + 4):
+                for i in range(head[lane], tail[lane]):
+                    car = queue[lane, i]
+                    score += waiting[car]
+                    waiting[car] += 1
+    return score
+
+
+if numba is not None:
+    # compiled loop releases GIL, so plans can be run on threads in parallel
+    simulate_compiled = numba.njit(cache=True, nogil=True)(simulate_flat)
+else:
+    simulate_compiled = None
+
+
+def flat_state(state: SimulationState) -> tuple:
+    """
+    Arrays of state in order of initial arguments of simulate_flat.
+    """
+    cars = np.array(state.cars, dtype=np.int64).reshape(-1, 5)
+    return (np.ascontiguousarray(cars[:, 0]), np.ascontiguousarray(cars[:, 1]),
+            np.ascontiguousarray(cars[:, 2]), np.ascontiguousarray(cars[:, 3]),
+            np.array(state.counters, dtype=np.int64))
+
+
+def phase_array(solution, turn_time: int) -> np.ndarray:
+    """
+    Phase tables of all crossroads as array, the same as
+    Crossroad.generate_phase_table, without per turn search.
+
+    Args:
+        solution (List): lights times and lights order for every crossroad
+        turn_time (int): length of lights cycle
+
+    Returns:
+        np.ndarray: green light index per crossroad and turn, -1=yellow
+    """
+    phases = np.full((len(solution), turn_time), -1, dtype=np.int64)
+    for c, (lights_times, lights_order) in enumerate(solution):
+        start = 0
+        finish_time = 0
+        for direction in lights_order:
+            # turns up to finish time (inclusive) not taken by earlier entries
+            finish_time += lights_times[direction]
+            end = min(turn_time, floor(finish_time) + 1)
+            if end > start:
+                phases[c, start:end] = DIRECTION_INDEX[direction]
+                start = end
+            finish_time += Crossroad.yellow_time
+            start = max(start, min(turn_time, floor(finish_time) + 1))
+    return phases
+
+
+class FlatKernel:
+    def __init__(self, simulation: Simulation, compiled: bool = True) -> None:
+        """
+        Array form of simulation network and arrivals.
+
+        Args:
+            simulation (Simulation): simulation to run
+            compiled (bool): use numba compiled loop, pure Python otherwise
+                (slow, used to test the loop itself)
+        """
+        if compiled and simulate_compiled is None:
+            raise ImportError("numba is not installed")
+        self.simulation = simulation
+        self.simulate = simulate_compiled if compiled else simulate_flat
+        network = simulation.crossroad_network
+        crossroads = network.crossroad_network
+        lane_index = {id(lane): c * 4 + DIRECTION_INDEX[direction]
+                      for c, crossroad in enumerate(crossroads)
+                      for direction, lane in crossroad.in_lanes.items()}
+        self.out_target = np.array([lane_index.get(id(crossroad.out_lanes[direction]), -1)
+                                    for crossroad in crossroads for direction in Direction],
+                                   dtype=np.int64)
+        self.processing_time = np.array([crossroad.in_lanes[direction].processing_time
+                                         for crossroad in crossroads
+                                         for direction in Direction], dtype=np.int64)
+        self.lanes = [lane for crossroad in crossroads
+                      for lane in map(crossroad.in_lanes.get, Direction)]
+        self.lane_capacity = None
+        self.build_capacity()
+        self.car_adder = None
+        lanes = len(self.out_target)
+        no_cars = np.zeros(0, dtype=np.int64)
+        self.empty_state = (no_cars, no_cars, no_cars, no_cars,
+                            np.zeros(lanes, dtype=np.int64))
+
+    def build_capacity(self) -> None:
+        """
+        Copies capacities of in lanes, when any of them was changed since
+        last copy (e.g. by CrossroadNetwork.set_lane_capacity).
+        """
+        lane_capacity = [lane.capacity for lane in self.lanes]
+        if lane_capacity == self.lane_capacity:
+            return
+        # unbounded lanes never hold more than all cars of run
+        unbounded = np.iinfo(np.int64).max
+        self.capacity = np.array([unbounded if capacity is None else capacity
+                                  for capacity in lane_capacity], dtype=np.int64)
+        self.lane_capacity = lane_capacity
+
+    def build_arrivals(self) -> None:
+        network = self.simulation.crossroad_network
+        car_adder = self.simulation.car_adder
+        paths = [Car(origin, destination,
+                     network.route(origin[0], destination[0])).path
+                 for origin, destination in car_adder]
+        self.arrival_lane = np.array([origin[0] * 4 + DIRECTION_INDEX[origin[1]]
+                                      for origin, _ in car_adder], dtype=np.int64)
+        self.arrival_path = np.full((len(paths), max(map(len, paths)) + 1), -1,
+                                    dtype=np.int64)
+        for i, path in enumerate(paths):
+            self.arrival_path[i, :len(path)] = [DIRECTION_INDEX[d] for d in path]
+        self.car_adder = car_adder
+
+    def run_phases(self, phases: np.ndarray, state: SimulationState = None,
+                   ticks: int = None) -> int:
+        """
+        Runs simulation with phase_array of plan.
+
+        Args:
+            phases (np.ndarray): phase_array of plan
+            state (SimulationState, optional): state to start from, at its
+                turn of cycle, empty network when not given
+            ticks (int, optional): turns to simulate, cycles by default
+
+        Returns:
+            int: score
+        """
+        simulation = self.simulation
+        if self.car_adder is not simulation.car_adder:
+            # arrivals were changed, e.g. by rolling horizon
+            self.build_arrivals()
+        self.build_capacity()
+        start = 0
+        if state is None:
+            initial = self.empty_state
+        else:
+            if state.flat is None:
+                state.flat = flat_state(state)
+            initial = state.flat
+            start = state.tick
+        if ticks is None:
+            ticks = simulation.cycles * simulation.turn_time
+        return int(self.simulate(phases, self.out_target, self.processing_time,
+                                 self.arrival_lane, self.arrival_path,
+                                 start, ticks, simulation.turn_time,
+                                 simulation.cycles % 5, self.capacity,
+                                 simulation.rejection_penalty, *initial))
+
+    def run(self, solution, state: SimulationState = None, ticks: int = None) -> int:
+        return self.run_phases(phase_array(solution, self.simulation.turn_time),
+                               state, ticks)
@@ -0,0 +1,81 @@
+import json
+from scripts.simulation.simulation import *
+
+
+def plan_to_json(solution) -> list:
+    """
+    Converts solution (lights times and lights order for every crossroad)
+    to JSON serializable form.
+
+    Args:
+        solution (List): solution in genome format
+
+    Returns:
+        list: one dictionary per crossroad
+    """
+    return [{"lights_times": {direction.name: time
+                              for direction, time in lights_times.items()},
+             "lights_order": [direction.name for direction in lights_order]}
+            for lights_times, lights_order in solution]
+
+
+def plan_from_json(data: list) -> list:
+    """
+    Converts output of plan_to_json back to solution.
+
+    Args:
+        data (list): one dictionary per crossroad
+
+    Returns:
+        List: solution in genome format
+    """
+    return [[{Direction[name]: time
+              for name, time in crossroad["lights_times"].items()},
+             [Direction[name] for name in crossroad["lights_order"]]]
+            for crossroad in data]
+
+
+def arrivals_to_json(car_adder: list) -> list:
+    """
+    Converts arrivals list to JSON serializable form.
+
+    Args:
+        car_adder (list): (origin, destination) pairs
+
+    Returns:
+        list: [[crossroad, direction name], [crossroad, direction name]] pairs
+    """
+    return [[[origin[0], origin[1].name], [destination[0], destination[1].name]]
+            for origin, destination in car_adder]
+
+
+def arrivals_from_json(data: list) -> list:
+    """
+    Converts output of arrivals_to_json back to arrivals list.
+
+    Args:
+        data (list): pairs of [crossroad, direction name]
+
+    Returns:
+        list: (origin, destination) pairs
+    """
+    return [((origin[0], Direction[origin[1]]),
+             (destination[0], Direction[destination[1]]))
+            for origin, destination in data]
+
+
+def load_plan(path: str) -> list:
+    """
+    Loads solution from JSON file. Accepts plan list or CLI result file.
+
+    Args:
+        path (str): path to JSON file
+
+    Returns:
+        List: solution in genome format
+    """
+    with open(path) as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        data = data["best_plan"]
+    return plan_from_json(data)
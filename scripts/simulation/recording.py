@@ -0,0 +1,176 @@
+import json
+import os
+import numpy as np
+from scripts.simulation.simulation import *
+from scripts.simulation.plan_io import plan_to_json, plan_from_json
+
+# Phase stored as index in Direction, yellow light as -1
+PHASE_INDEX = {direction: i for i, direction in enumerate(Direction)}
+PHASE_INDEX[None] = -1
+PHASE_DIRECTIONS = list(Direction)
+
+COLUMNS = ("queue_lengths", "phases", "discharges", "scores")
+
+
+class SimulationRecorder:
+    def __init__(self) -> None:
+        """
+        Records state of simulation after every step as columnar arrays:
+        queue length and discharged cars per in lane, green light per crossroad
+        and score of the step. Pass it to Simulation.run in observers.
+        """
+        self.queue_lengths: np.ndarray = None
+        self.phases: np.ndarray = None
+        self.discharges: np.ndarray = None
+        self.scores: np.ndarray = None
+        self.meta: dict = {}
+
+    def start(self, simulation: Simulation) -> None:
+        crossroads = simulation.crossroad_network.crossroad_network
+        self.crossroads = crossroads
+        self.lanes = [lane for crossroad in crossroads
+                      for lane in crossroad.in_lanes.values()]
+        # Reading every queue after every step would cost as much as the step,
+        # so only changes are logged by simulation and arrays are rebuilt in finish
+        self.events = []
+        self.marks = []
+        self.score_rows = []
+        self.initial_queues = [len(lane.queue) for lane in self.lanes]
+        self.initial_phases = [PHASE_INDEX[crossroad.green_light_now]
+                               for crossroad in crossroads]
+        simulation.set_event_log(self.events)
+        self.meta = {
+            "turn_time": simulation.turn_time,
+            "cycles": simulation.cycles,
+            "lanes": [[c_id, direction.name]
+                      for c_id, crossroad in enumerate(crossroads)
+                      for direction in crossroad.in_lanes],
+            # runs with adaptive controllers have no plan
+            "plan": None if any(crossroad.controller is not None
+                                for crossroad in crossroads) else
+            plan_to_json([[crossroad.lights_times, crossroad.lights_order]
+                          for crossroad in crossroads]),
+        }
+
+    def observe(self, simulation: Simulation, tick: int, score: int) -> None:
+        self.marks.append(len(self.events))
+        self.score_rows.append(score)
+
+    def finish(self, simulation: Simulation) -> None:
+        simulation.set_event_log(None)
+        ticks = len(self.marks)
+        lanes = len(self.lanes)
+        # lanes, crossroads and lights are mapped to their column numbers,
+        # out lanes leaving network and missing lanes to -1
+        index = dict(PHASE_INDEX)
+        index.update((lane, i) for i, lane in enumerate(self.lanes))
+        index.update((crossroad, i) for i, crossroad in enumerate(self.crossroads))
+        kinds = np.array([event[0] for event in self.events], dtype=np.int8)
+        objects = np.array([index.get(item, -1) for event in self.events
+                            for item in event[1:]], dtype=np.int64).reshape(-1, 2)
+        sources, targets = objects[:, 0], objects[:, 1]
+        # event belongs to first tick after which log was longer than its index
+        event_ticks = np.searchsorted(np.array(self.marks), np.arange(len(kinds)),
+                                      side="right")
+
+        def count(mask, columns):
+            cells = event_ticks[mask] * lanes + columns[mask]
+            return np.bincount(cells, minlength=ticks * lanes).reshape(ticks, lanes)
+
+        left = kinds == Event.DISCHARGE
+        arrived = (kinds != Event.PHASE) & (targets >= 0)
+        discharges = count(left, sources)
+        change = count(arrived, targets) - discharges
+        self.queue_lengths = (np.cumsum(change, axis=0) +
+                              self.initial_queues).astype(np.uint16)
+        self.discharges = discharges.astype(np.uint8)
+
+        self.phases = np.empty((ticks, len(self.crossroads)), dtype=np.int8)
+        changed = kinds == Event.PHASE
+        for c_id in range(len(self.crossroads)):
+            mask = changed & (sources == c_id)
+            # green light at every tick is the last change before it
+            change_phases = np.concatenate(
+                ([self.initial_phases[c_id]], targets[mask]))
+            last = np.searchsorted(event_ticks[mask], np.arange(ticks), side="right")
+            self.phases[:, c_id] = change_phases[last]
+        self.scores = np.array(self.score_rows, dtype=np.int64)
+        self.events = self.marks = self.score_rows = None
+
+    def save(self, path: str, compressed: bool = False) -> None:
+        """
+        Saves recording. Directory with one .npy file per column can be
+        memory mapped on replay, compressed .npz is smaller but is loaded whole.
+
+        Args:
+            path (str): directory or .npz file
+            compressed (bool): save as compressed .npz
+        """
+        columns = {name: getattr(self, name) for name in COLUMNS}
+        if compressed:
+            np.savez_compressed(path, meta=np.array(json.dumps(self.meta)),
+                                **columns)
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(path, name + ".npy"), column)
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(self.meta, file)
+
+
+class Recording:
+    def __init__(self, columns: dict, meta: dict) -> None:
+        """
+        Recorded simulation, created with load_recording.
+
+        Args:
+            columns (dict): arrays saved by SimulationRecorder
+            meta (dict): turn time, cycles, lanes order and plan
+        """
+        self.queue_lengths: np.ndarray = columns["queue_lengths"]
+        self.phases: np.ndarray = columns["phases"]
+        self.discharges: np.ndarray = columns["discharges"]
+        self.scores: np.ndarray = columns["scores"]
+        self.turn_time = meta["turn_time"]
+        self.cycles = meta["cycles"]
+        self.plan = plan_from_json(meta["plan"]) if meta["plan"] is not None else None
+        self.lane_index = {(c_id, Direction[name]): i
+                           for i, (c_id, name) in enumerate(meta["lanes"])}
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def queue_length(self, tick: int, crossroad_id: int, direction: Direction) -> int:
+        return int(self.queue_lengths[tick, self.lane_index[(crossroad_id, direction)]])
+
+    def green_light(self, tick: int, crossroad_id: int) -> Direction:
+        phase = self.phases[tick, crossroad_id]
+        return None if phase < 0 else PHASE_DIRECTIONS[phase]
+
+    def score(self) -> int:
+        return int(self.scores.sum())
+
+
+def load_recording(path: str, mmap: bool = True) -> Recording:
+    """
+    Loads recording saved by SimulationRecorder.save.
+
+    Args:
+        path (str): directory or .npz file
+        mmap (bool): memory map columns instead of reading them (directory only)
+
+    Returns:
+        Recording
+    """
+    if os.path.isdir(path):
+        mmap_mode = "r" if mmap else None
+        columns = {name: np.load(os.path.join(path, name + ".npy"),
+                                 mmap_mode=mmap_mode)
+                   for name in COLUMNS}
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+    else:
+        with np.load(path) as data:
+            columns = {name: data[name] for name in COLUMNS}
+            meta = json.loads(str(data["meta"]))
+    return Recording(columns, meta)
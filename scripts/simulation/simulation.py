@@ -1,5 +1,6 @@
 from typing import List, Dict, Tuple
-from enum import Enum
+from enum import Enum, IntEnum
+from time import perf_counter_ns
 import random
 
 
@@ -9,6 +10,10 @@ class Direction(Enum):
     NORTH = "N"
     EAST = "E"
 
+    # members are singletons, identity hash is much cheaper than
+    # Enum.__hash__ and directions are dictionary keys in every step
+    __hash__ = object.__hash__
+
     def __str__(self):
         return self.name
 
@@ -28,6 +33,16 @@ class Turn(Enum):
 type Location = Tuple[int, Direction]
 
 
+class Event(IntEnum):
+    """
+    Kinds of entries written to event log of simulation:
+    (ARRIVAL, None, lane), (DISCHARGE, lane, out_lane or None), (PHASE, crossroad, green light)
+    """
+    ARRIVAL = 0
+    DISCHARGE = 1
+    PHASE = 2
+
+
 class Car:
     # hardcoding pathfindig
     dest_to_path_map = {(0, 1): [Direction.EAST],
@@ -44,18 +59,23 @@ class Car:
                         (3, 2): [Direction.WEST]
                         }
 
-    def __init__(self, origin: Location, destination: Location) -> None:
+    def __init__(self, origin: Location, destination: Location,
+                 path: List[Direction] = None) -> None:
         """
         Creates car and its path
 
         Args:
             origin (Location): car spawn location
             destination (Location): car destination
+            path (List[Direction], optional): directions at consecutive
+                crossroads, found with get_path when not given
         """
         self.origin: Location = origin
         self.destination: Location = destination
-        self.path: List[Lane] = self.get_path()
+        self.path: List[Lane] = path if path is not None else self.get_path()
         self.waiting_time = 0
+        # turns waited in lanes already left
+        self.travel_time = 0
         return
 
     def get_path(self) -> List[Direction]:
@@ -76,25 +96,65 @@ class Car:
 
 
 class Lane:
-    def __init__(self, possible_turns, processing_time) -> None:
+    def __init__(self, possible_turns, processing_time, capacity=None) -> None:
         self.possible_turns: List[Turn] = possible_turns
         self.queue: List[Car] = []
         self.processing_time = processing_time
+        # maximal number of cars in queue, None=unbounded
+        self.capacity: int = capacity
         self.processing_counter = 0
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """
+        Resets counters updated during simulation, they are cheap enough
+        to be always on and are read by TelemetryCollector.
+        """
+        # cars that left this lane
+        self.processed_cars = 0
+        # turns waited in this lane by cars that left it
+        self.total_delay = 0
+        # part of score of cars that left it, car waiting w turns adds
+        # 0 + 1 + ... + (w - 1)
+        self.waiting_score = 0
+        self.max_queue = 0
+        # turns with green light and cars waiting
+        self.busy_green_time = 0
+        self.green_time = 0
+        # turns car was ready to leave, but next lane was full
+        self.blocked_time = 0
+
+    def is_full(self) -> bool:
+        return self.capacity is not None and len(self.queue) >= self.capacity
 
-    def process_cars(self) -> Car:
+    def process_cars(self, out_lanes: Dict[Direction, 'Lane'] = None) -> Car:
         """
         Process cars in lane if light is green. 
 
+        Args:
+            out_lanes (Dict[Direction, Lane], optional): lanes cars go to,
+                car doesn't leave while its next lane is full
+
         Returns:
             Car: car that left the crossroad
         """
+        self.green_time += 1
         if not self.queue:
             return None
+        self.busy_green_time += 1
         if self.processing_counter >= self.processing_time:
+            car = self.queue[0]
+            if car.path and out_lanes is not None and out_lanes[car.path[0]].is_full():
+                # spillback, car leaves as soon as there is space
+                self.blocked_time += 1
+                return None
             self.processing_counter = 0
-            car = self.queue.pop(0)
+            self.queue.pop(0)
+            self.total_delay += car.waiting_time
+            self.waiting_score += car.waiting_time * (car.waiting_time - 1) // 2
+            car.travel_time += car.waiting_time
             car.waiting_time = 0
+            self.processed_cars += 1
             return car
 
         else:
@@ -109,6 +169,56 @@ class Lane:
             car (Car): car to add
         """
         self.queue.append(car)
+        if len(self.queue) > self.max_queue:
+            self.max_queue = len(self.queue)
+
+
+class CarPool:
+    def __init__(self) -> None:
+        """
+        Cars that finished their trip, reused for new arrivals so long
+        running workers don't allocate car for every arrival.
+        """
+        self.free: List[Car] = []
+        self.created = 0
+
+    def acquire(self, origin: Location, destination: Location,
+                path: List[Direction] = None) -> Car:
+        if self.free:
+            car = self.free.pop()
+            car.__init__(origin, destination, path)
+            return car
+        self.created += 1
+        return Car(origin, destination, path)
+
+    def release(self, car: Car) -> None:
+        self.free.append(car)
+
+
+class Sink(Lane):
+    def __init__(self, pool: CarPool = None) -> None:
+        """
+        End of trips: out lane leaving network or crossroad where car
+        reached its destination. Cars are counted and released to pool,
+        queue stays empty.
+
+        Args:
+            pool (CarPool, optional): pool cars are returned to
+        """
+        super().__init__([], processing_time=1)
+        self.pool = pool
+
+    def reset_stats(self) -> None:
+        super().reset_stats()
+        self.trips = 0
+        # turns spent in network by cars that ended trip here
+        self.travel_time = 0
+
+    def add_car(self, car: Car) -> None:
+        self.trips += 1
+        self.travel_time += car.travel_time
+        if self.pool is not None:
+            self.pool.release(car)
 
 
 class Crossroad:
@@ -116,14 +226,30 @@ class Crossroad:
     type LaneLocations = Dict[Direction, Lane]
     type LightsTimes = Dict[Direction, float]
     type LightsOrder = List[Direction]
+    # turns of yellow light after every green light
+    yellow_time = 5
 
     def __init__(self) -> None:
         # Lights cycle tells witch lane has green light, None=yellow
         self.lights_order: Crossroad.LightsOrder = None
         self.lights_times: Crossroad.LightsTimes = None
         self.lights_cycle: List[Direction] = None
+        self.green_light_now: Direction = None
+        # when set to list, lights changes and processed cars are appended to it
+        self.event_log: list = None
+        # adaptive control, when controller is set it replaces lights cycle
+        self.controller = None
+        self.controller_view = None
+        self.current_phase: Direction = None
+        self.next_phase: Direction = None
+        self.phase_time = 0
+        self.yellow_left = 0
+        # when set to list, controller decision times in ns are appended to it
+        self.decision_times: list = None
         self.in_lanes: Crossroad.LaneLocations = {}
         self.out_lanes: Crossroad.LaneLocations = {}
+        # cars which path ends at this crossroad
+        self.sink = Sink()
         self.add_in_lanes()
         self.add_out_lanes()
 
@@ -133,10 +259,30 @@ class Crossroad:
         for direction in self.lights_order:
             finish_time += self.lights_times[direction]
             cycle.append([direction, finish_time])
-            finish_time += 5
+            finish_time += self.yellow_time
             cycle.append([None, finish_time])
         return cycle
 
+    def generate_phase_table(self, turn_time: int) -> List[Direction]:
+        """
+        Precomputes which lane has green light in every turn of lights cycle.
+
+        Args:
+            turn_time (int): number of turns in lights cycle
+
+        Returns:
+            List[Direction]: green light for every turn, None=yellow
+        """
+        table = []
+        for turn in range(turn_time):
+            for cycle in self.lights_cycle:
+                if cycle[1] >= turn:
+                    table.append(cycle[0])
+                    break
+            else:
+                table.append(None)
+        return table
+
     def step(self, turn: int) -> int:
         """
         Runs one simulation step
@@ -147,23 +293,51 @@ class Crossroad:
         Returns:
             int: score for this step
         """
-        score = 0
-        for cycle in self.lights_cycle:
-            if cycle[1] >= turn:
-                green_light_now = cycle[0]
-                break
+        if self.controller is not None:
+            green_light_now = self.controlled_light()
         else:
-            green_light_now = None
+            for cycle in self.lights_cycle:
+                if cycle[1] >= turn:
+                    green_light_now = cycle[0]
+                    break
+            else:
+                green_light_now = None
+        return self.advance(green_light_now)
+
+    def advance(self, green_light_now: Direction) -> int:
+        """
+        Runs one simulation step with given green light, used by step
+        and by ensemble evaluation with precomputed phase tables.
+
+        Args:
+            green_light_now (Direction): lane with green light, None=yellow
+
+        Returns:
+            int: score for this step
+        """
+        score = 0
+        if green_light_now is not self.green_light_now:
+            self.green_light_now = green_light_now
+            if self.event_log is not None:
+                self.event_log.append((Event.PHASE, self, green_light_now))
         # if yellow light reset all counters
 
         if green_light_now == None:
             self.reset_lights_counters()
         else:
             # process cars in lane with green lights
-            processed_car = self.in_lanes[green_light_now].process_cars()
-            if processed_car is not None and processed_car.path != []:
-                self.out_lanes[processed_car.path[0]].add_car(processed_car)
-                processed_car.move()
+            processed_car = self.in_lanes[green_light_now].process_cars(self.out_lanes)
+            if processed_car is not None and self.event_log is not None:
+                self.event_log.append(
+                    (Event.DISCHARGE, self.in_lanes[green_light_now],
+                     self.out_lanes[processed_car.path[0]] if processed_car.path else None))
+            if processed_car is not None:
+                if processed_car.path:
+                    out_lane = self.out_lanes[processed_car.path[0]]
+                    processed_car.move()
+                    out_lane.add_car(processed_car)
+                else:
+                    self.sink.add_car(processed_car)
 
         for in_lane in self.in_lanes.values():
             for car in in_lane.queue:
@@ -172,6 +346,56 @@ class Crossroad:
 
         return score
 
+    def controlled_light(self) -> Direction:
+        """
+        Asks controller for next green light. Controller is asked every turn
+        after minimal green time, change of green light goes through yellow light.
+
+        Returns:
+            Direction: green light for this turn, None=yellow
+        """
+        if self.yellow_left:
+            self.yellow_left -= 1
+            if not self.yellow_left:
+                self.current_phase = self.next_phase
+                self.phase_time = 0
+            return None
+        if self.current_phase is None or self.phase_time >= self.controller.min_green:
+            if self.decision_times is None:
+                decision = self.controller.decide(self.controller_view)
+            else:
+                start = perf_counter_ns()
+                decision = self.controller.decide(self.controller_view)
+                self.decision_times.append(perf_counter_ns() - start)
+            if decision is not None and decision is not self.current_phase:
+                if self.current_phase is None:
+                    # nothing to clear at the beginning
+                    self.current_phase = decision
+                else:
+                    self.next_phase = decision
+                    self.yellow_left = self.yellow_time - 1
+                    return None
+        self.phase_time += 1
+        return self.current_phase
+
+    def set_controller(self, controller, view) -> None:
+        """
+        Sets adaptive controller instead of lights cycle, None restores lights cycle.
+
+        Args:
+            controller: object with min_green attribute, reset(view) and
+                decide(view) methods returning next green light
+            view: read only view of this crossroad passed to controller
+        """
+        self.controller = controller
+        self.controller_view = view
+        self.current_phase = None
+        self.next_phase = None
+        self.phase_time = 0
+        self.yellow_left = 0
+        if controller is not None:
+            controller.reset(view)
+
     def reset_lights_counters(self) -> None:
         """
         Resets processing counters for all lanes
@@ -204,22 +428,30 @@ class Crossroad:
     def add_out_lanes(self) -> None:
         """
         Initialize crossroad with lanes going out, can change deepending on crossroad.
+        Lanes not connected to other crossroad by network leave it.
         """
-        self.out_lanes[Direction.SOUTH] = Lane([],
-                                               processing_time=1)
-        self.out_lanes[Direction.WEST] = Lane([],
-                                              processing_time=1)
-        self.out_lanes[Direction.NORTH] = Lane([],
-                                               processing_time=1)
-        self.out_lanes[Direction.EAST] = Lane([],
-                                              processing_time=1)
+        self.out_lanes[Direction.SOUTH] = Sink()
+        self.out_lanes[Direction.WEST] = Sink()
+        self.out_lanes[Direction.NORTH] = Sink()
+        self.out_lanes[Direction.EAST] = Sink()
+
+    def sinks(self) -> List[Sink]:
+        return [self.sink] + [lane for lane in self.out_lanes.values()
+                              if isinstance(lane, Sink)]
 
     def reset_queues(self) -> None:
         """
         Sets all queues to 0. Used when running new simulation on the same crossroad.
         """
+        pool = self.sink.pool
         for in_lane in self.in_lanes.values():
-            in_lane.queue = []
+            if pool is not None:
+                pool.free += in_lane.queue
+            in_lane.queue.clear()
+            in_lane.processing_counter = 0
+            in_lane.reset_stats()
+        for sink in self.sinks():
+            sink.reset_stats()
 
 
 class CrossroadNetwork:
@@ -265,31 +497,387 @@ class CrossroadNetwork:
         """
         self.crossroad_network[car.origin[0]].add_car(car)
 
+    def set_car_pool(self, pool: CarPool) -> None:
+        """
+        Sets pool cars ending their trip are returned to.
+        """
+        for crossroad in self.crossroad_network:
+            for sink in crossroad.sinks():
+                sink.pool = pool
+
+    def trip_summary(self) -> dict:
+        """
+        Returns:
+            dict: finished trips, their total and mean travel time (turns)
+                and trips that left network through its edge
+        """
+        trips = travel_time = left_network = 0
+        for crossroad in self.crossroad_network:
+            for sink in crossroad.sinks():
+                trips += sink.trips
+                travel_time += sink.travel_time
+                if sink is not crossroad.sink:
+                    left_network += sink.trips
+        return {"trips": trips, "travel_time": travel_time,
+                "mean_travel_time": travel_time / trips if trips else 0.0,
+                "left_network": left_network}
+
+    def set_lane_capacity(self, capacity: int) -> None:
+        """
+        Limits queues of all in lanes, None removes limit. Lanes leaving
+        network stay unbounded.
+        """
+        for crossroad in self.crossroad_network:
+            for lane in crossroad.in_lanes.values():
+                lane.capacity = capacity
+
+    def entry_points(self) -> List[Location]:
+        """
+        Returns:
+            List[Location]: in lanes where cars come from outside world
+        """
+        return [(0, Direction.WEST), (0, Direction.NORTH),
+                (1, Direction.EAST), (1, Direction.NORTH),
+                (2, Direction.WEST), (2, Direction.SOUTH),
+                (3, Direction.EAST), (3, Direction.SOUTH),]
+
+    def route(self, origin: int, destination: int) -> List[Direction]:
+        """
+        Path between crossroads, None means Car.dest_to_path_map is used.
+        """
+        return None
+
+
+class GridNetwork(CrossroadNetwork):
+    def __init__(self, rows: int, columns: int) -> None:
+        """
+        Creates network of rows x columns crossroads connected with their
+        neighbours. Crossroads are numbered row by row.
+
+        Args:
+            rows (int): number of rows
+            columns (int): number of columns
+        """
+        self.rows = rows
+        self.columns = columns
+        self.crossroad_network: List[Crossroad] = [
+            Crossroad() for _ in range(rows * columns)]
+        self.connect_crossroads()
+
+    def connect_crossroads(self):
+        for i, crossroad in enumerate(self.crossroad_network):
+            row, column = divmod(i, self.columns)
+            if column + 1 < self.columns:
+                east = self.crossroad_network[i + 1]
+                crossroad.out_lanes[Direction.EAST] = east.in_lanes[Direction.WEST]
+                east.out_lanes[Direction.WEST] = crossroad.in_lanes[Direction.EAST]
+            if row + 1 < self.rows:
+                south = self.crossroad_network[i + self.columns]
+                crossroad.out_lanes[Direction.SOUTH] = south.in_lanes[Direction.NORTH]
+                south.out_lanes[Direction.NORTH] = crossroad.in_lanes[Direction.SOUTH]
+
+    def entry_points(self) -> List[Location]:
+        points = []
+        for i in range(len(self.crossroad_network)):
+            row, column = divmod(i, self.columns)
+            if column == 0:
+                points.append((i, Direction.WEST))
+            if column == self.columns - 1:
+                points.append((i, Direction.EAST))
+            if row == 0:
+                points.append((i, Direction.NORTH))
+            if row == self.rows - 1:
+                points.append((i, Direction.SOUTH))
+        return points
+
+    def route(self, origin: int, destination: int) -> List[Direction]:
+        """
+        Shortest path, first along row, then along column.
+        """
+        row, column = divmod(origin, self.columns)
+        dest_row, dest_column = divmod(destination, self.columns)
+        horizontal = Direction.EAST if dest_column > column else Direction.WEST
+        vertical = Direction.SOUTH if dest_row > row else Direction.NORTH
+        return ([horizontal] * abs(dest_column - column) +
+                [vertical] * abs(dest_row - row))
+
+
+class SimulationState:
+    __slots__ = ("tick", "cars", "counters", "green", "flat")
+
+    def __init__(self, tick: int, cars: tuple, counters: tuple, green: tuple) -> None:
+        """
+        Snapshot of simulation made by Simulation.snapshot. It is immutable,
+        so any number of plans can be forked from it without copying.
+        Lane index is crossroad * 4 + index of direction in Direction.
+
+        Args:
+            tick (int): turns simulated before snapshot
+            cars (tuple): (lane, car_adder index of the same trip, directions
+                of path already done, waiting time, travel time) of queued
+                cars in queue order
+            counters (tuple): processing counter of every lane
+            green (tuple): green light of every crossroad
+        """
+        self.tick = tick
+        self.cars = cars
+        self.counters = counters
+        self.green = green
+        # arrays for kernel, made on first use
+        self.flat = None
+
 
 class Simulation:
-    def __init__(self, turn_time=120, cycles=5) -> None:
-        self.crossroad_network = CrossroadNetwork()
+    def __init__(self, turn_time=120, cycles=5, car_adder=None, seed=None,
+                 crossroad_network: CrossroadNetwork = None, backend="auto",
+                 lane_capacity=None, rejection_penalty=None) -> None:
+        """
+        Creates simulation of crossroad network.
+
+        Args:
+            turn_time (int): length of one lights cycle in turns
+            cycles (int): how many times lights cycle is repeated
+            car_adder (list, optional): arrivals as (origin, destination) pairs,
+                generated randomly when not given
+            seed (int, optional): seed used to generate arrivals
+            crossroad_network (CrossroadNetwork, optional): network to simulate,
+                2x2 CrossroadNetwork when not given
+            backend (str): "numba" runs plans without observers on compiled
+                flat arrays (see kernel.py), "python" on crossroad objects,
+                "auto" selects numba when it is installed
+            lane_capacity (int, optional): maximal queue of every in lane,
+                cars wait in upstream lane while next one is full and cars
+                coming to full entry lane are rejected
+            rejection_penalty (int, optional): added to score for every
+                rejected car, by default score of car waiting whole lights cycle
+        """
+        self.crossroad_network = crossroad_network if crossroad_network is not None \
+            else CrossroadNetwork()
+        if lane_capacity is not None:
+            self.crossroad_network.set_lane_capacity(lane_capacity)
+        self.car_pool = CarPool()
+        self.crossroad_network.set_car_pool(self.car_pool)
+        self.rejection_penalty = rejection_penalty if rejection_penalty is not None \
+            else turn_time * (turn_time - 1) // 2
+        # cars rejected in last run, not updated by kernel runs
+        self.rejected_cars = 0
+        self._trip_slots = None
         self.turn_time = turn_time
         self.cycles = cycles
-        self.car_adder = self.generate_add_car_lst()
-
-    def run(self, solution) -> int:
+        self.seed = seed
+        self.event_log: list = None
+        # observers used by run when none are passed, e.g. telemetry
+        self.observers = ()
+        self.car_adder = car_adder if car_adder is not None \
+            else self.generate_add_car_lst()
+        # imported here, kernel module needs classes defined above
+        from scripts.simulation import kernel
+        if backend == "auto":
+            backend = kernel.BACKEND
+        self.backend = backend
+        # lane statistics and queues are not updated by kernel runs
+        self.kernel = kernel.FlatKernel(self) if backend == "numba" else None
+
+    def run(self, solution, observers=None) -> int:
         """
         Runs simulation and returns score.
 
+        Args:
+            solution (List): lights times and lights order for every crossroad
+            observers (tuple, optional): objects with start(simulation),
+                observe(simulation, tick, score) called after every step
+                and finish(simulation) methods, self.observers when not given
+
         Returns:
             int: score
         """
-        for crossroad in self.crossroad_network.crossroad_network:
+        if observers is None:
+            observers = self.observers
+        self.init_corssroad_params(solution)
+        if self.kernel is not None and not observers and self.event_log is None:
+            return self.kernel.run(solution)
+        return self.simulate(observers)
+
+    def warm_up(self, solution, cycles: int = 1) -> SimulationState:
+        """
+        Simulates cycles of solution from empty network.
+
+        Returns:
+            SimulationState: state after warm up, see run_from
+        """
+        self.init_corssroad_params(solution)
+        for _ in range(cycles):
+            for t in range(self.turn_time):
+                self.step(t)
+        return self.snapshot(cycles * self.turn_time)
+
+    def run_from(self, state: SimulationState, solution, observers=None,
+                 ticks: int = None) -> int:
+        """
+        Runs simulation like run, but starting from state instead of empty
+        network. Lights cycle of solution and arrivals go on from turn
+        state.tick of cycle (its beginning for states of warm_up).
+
+        Args:
+            state (SimulationState): state made by snapshot or warm_up with
+                the same arrivals
+            solution (List): lights times and lights order for every crossroad
+            observers (tuple, optional): same as in run
+            ticks (int, optional): turns to simulate, cycles by default
+
+        Returns:
+            int: score of turns after state
+        """
+        if observers is None:
+            observers = self.observers
+        if self.kernel is not None and not observers and self.event_log is None:
+            return self.kernel.run(solution, state, ticks)
+        self.init_corssroad_params(solution)
+        self.restore(state)
+        return self.simulate(observers, state.tick, ticks)
+
+    def snapshot(self, tick: int = 0) -> SimulationState:
+        """
+        Compact copy of queues, processing counters and lights of network.
+        Demand cursor is tick, arrivals go on from the same car_adder.
+
+        Args:
+            tick (int): turns simulated so far
+
+        Returns:
+            SimulationState: snapshot
+        """
+        network = self.crossroad_network
+        trips = self.trip_slots()
+        cars = []
+        counters = []
+        for c, crossroad in enumerate(network.crossroad_network):
+            for d, direction in enumerate(Direction):
+                lane = crossroad.in_lanes[direction]
+                counters.append(lane.processing_counter)
+                for car in lane.queue:
+                    slot, path_length = trips[(car.origin, car.destination)]
+                    cars.append((c * 4 + d, slot, path_length - len(car.path),
+                                 car.waiting_time, car.travel_time))
+        return SimulationState(tick, tuple(cars), tuple(counters),
+                               tuple(crossroad.green_light_now
+                                     for crossroad in network.crossroad_network))
+
+    def trip_slots(self) -> Dict[tuple, Tuple[int, int]]:
+        """
+        Returns:
+            Dict[tuple, Tuple[int, int]]: first car_adder index and path length
+                of every (origin, destination) pair, cached until car_adder changes
+        """
+        if self._trip_slots is None or self._trip_slots[0] is not self.car_adder:
+            network = self.crossroad_network
+            slots = {}
+            for slot, (origin, destination) in enumerate(self.car_adder):
+                if (origin, destination) not in slots:
+                    slots[(origin, destination)] = (slot, len(Car(
+                        origin, destination, network.route(origin[0], destination[0])).path))
+            self._trip_slots = (self.car_adder, slots)
+        return self._trip_slots[1]
+
+    def restore(self, state: SimulationState) -> None:
+        """
+        Sets queues, processing counters and lights of network from state.
+        """
+        network = self.crossroad_network
+        crossroads = network.crossroad_network
+        directions = list(Direction)
+        lanes = [crossroad.in_lanes[direction]
+                 for crossroad in crossroads for direction in directions]
+        for crossroad, green in zip(crossroads, state.green):
             crossroad.reset_queues()
-        for i, crossroad in enumerate(self.crossroad_network.crossroad_network):
-            crossroad.lights_times = solution[i][0]
-            crossroad.lights_order = solution[i][1]
-            crossroad.lights_cycle = crossroad.generate_cycle()
+            crossroad.green_light_now = green
+        for lane, counter in zip(lanes, state.counters):
+            lane.processing_counter = counter
+        for lane_index, slot, step, waiting_time, travel_time in state.cars:
+            origin, destination = self.car_adder[slot]
+            car = self.car_pool.acquire(origin, destination,
+                                        network.route(origin[0], destination[0]))
+            del car.path[:step]
+            car.waiting_time = waiting_time
+            car.travel_time = travel_time
+            lanes[lane_index].add_car(car)
+
+    def run_phases(self, phases) -> int:
+        """
+        Runs simulation with precomputed phase tables instead of solution,
+        e.g. plans published in shared memory. Score is the same as from run.
+
+        Args:
+            phases: green light index in Direction per crossroad and turn,
+                -1=yellow, see kernel.phase_array
+
+        Returns:
+            int: score
+        """
+        if self.kernel is not None:
+            return self.kernel.run_phases(phases)
+        # index -1 is the last item
+        directions = list(Direction) + [None]
+        lanes = []
+        for crossroad, row in zip(self.crossroad_network.crossroad_network, phases):
+            if crossroad.controller is not None:
+                crossroad.set_controller(None, None)
+            crossroad.reset_queues()
+            lanes.append((crossroad, [directions[i] for i in row]))
+        self.rejected_cars = 0
         score = 0
         for _ in range(self.cycles):
             for t in range(self.turn_time):
-                score += self.step(t)
+                if not t % 5:
+                    score += self.add_car(*self.car_adder[t + self.cycles % 5])
+                for crossroad, table in lanes:
+                    score += crossroad.advance(table[t])
+        return score
+
+    def simulate(self, observers=(), start: int = 0, ticks: int = None) -> int:
+        """
+        Runs all cycles with lights already set on crossroads (by run)
+        or with adaptive controllers (see control.run_controlled).
+
+        Args:
+            observers (tuple): same as in run
+            start (int): first turn, lights cycle and arrivals go on from
+                start % turn_time
+            ticks (int, optional): turns to simulate, cycles by default
+
+        Returns:
+            int: score
+        """
+        self.rejected_cars = 0
+        if ticks is None:
+            ticks = self.cycles * self.turn_time
+        if observers:
+            return self.run_observed(observers, start, ticks)
+        score = 0
+        for tick in range(start, start + ticks):
+            score += self.step(tick % self.turn_time)
+        return score
+
+    def run_observed(self, observers, start: int = 0, ticks: int = None) -> int:
+        """
+        Same loop as in run, but calls observers after every step, with
+        tick counted from start.
+
+        Returns:
+            int: score
+        """
+        if ticks is None:
+            ticks = self.cycles * self.turn_time
+        for observer in observers:
+            observer.start(self)
+        score = 0
+        for tick in range(ticks):
+            step_score = self.step((start + tick) % self.turn_time)
+            score += step_score
+            for observer in observers:
+                observer.observe(self, tick, step_score)
+        for observer in observers:
+            observer.finish(self)
         return score
 
     def step(self, t: int) -> None:
@@ -301,8 +889,8 @@ class Simulation:
         """
         score = 0
         if not t % 5:
-            self.add_car(self.car_adder[t + self.cycles % 5][0],
-                         self.car_adder[t + self.cycles % 5][1])
+            score += self.add_car(self.car_adder[t + self.cycles % 5][0],
+                                  self.car_adder[t + self.cycles % 5][1])
         for crossroad in self.crossroad_network.crossroad_network:
             score += crossroad.step(t)
         return score
@@ -311,37 +899,52 @@ class Simulation:
         for crossroad in self.crossroad_network.crossroad_network:
             crossroad.reset_queues()
         for i, crossroad in enumerate(self.crossroad_network.crossroad_network):
+            if crossroad.controller is not None:
+                crossroad.set_controller(None, None)
             crossroad.lights_times = solution[i][0]
             crossroad.lights_order = solution[i][1]
             crossroad.lights_cycle = crossroad.generate_cycle()
 
-    def add_car(self, car_origin, car_destination):
+    def add_car(self, car_origin, car_destination) -> int:
         """
         Generates cars from outside world.
+
+        Returns:
+            int: rejection penalty when entry lane is full, 0 otherwise
+        """
+        lane = self.crossroad_network.crossroad_network[car_origin[0]].\
+            in_lanes[car_origin[1]]
+        if lane.is_full():
+            self.rejected_cars += 1
+            return self.rejection_penalty
+        car = self.car_pool.acquire(
+            car_origin, car_destination,
+            self.crossroad_network.route(car_origin[0], car_destination[0]))
+        lane.add_car(car)
+        if self.event_log is not None:
+            self.event_log.append((Event.ARRIVAL, None, lane))
+        return 0
+
+    def set_event_log(self, event_log: list) -> None:
+        """
+        Starts (or stops with None) logging of arrivals, processed cars
+        and lights changes, used by SimulationRecorder.
+
+        Args:
+            event_log (list): list to append events to
         """
-        car = Car(car_origin, car_destination)
-        self.crossroad_network.crossroad_network[car.origin[0]].\
-            in_lanes[car.origin[1]].add_car(car)
+        self.event_log = event_log
+        for crossroad in self.crossroad_network.crossroad_network:
+            crossroad.event_log = event_log
 
     def generate_add_car_lst(self):
-        possible_origins = [(0, Direction.WEST), (0, Direction.NORTH),
-                            (1, Direction.EAST), (1, Direction.NORTH),
-                            (2, Direction.WEST), (2, Direction.SOUTH),
-                            (3, Direction.EAST), (3, Direction.SOUTH),]
+        rng = random if self.seed is None else random.Random(self.seed)
+        possible_origins = self.crossroad_network.entry_points()
+        weights = [1] * len(possible_origins)
         cars = []
         for _ in range(self.turn_time):
-            car_origin = random.choices(possible_origins,
-                                        weights=[1, 1,
-                                                 1, 1,
-                                                 1, 1,
-                                                 1, 1],
-                                        k=1)[0]
-            car_destination = random.choices(possible_origins,
-                                             weights=[1, 1,
-                                                      1, 1,
-                                                      1, 1,
-                                                      1, 1],
-                                             k=1)[0]
+            car_origin = rng.choices(possible_origins, weights=weights, k=1)[0]
+            car_destination = rng.choices(possible_origins, weights=weights, k=1)[0]
             cars.append((car_origin, car_destination))
         return cars
 
@@ -0,0 +1,158 @@
+import numpy as np
+from scripts.simulation.simulation import *
+
+
+class TelemetryCollector:
+    def __init__(self, capacity: int = 1024, interval: int = 7) -> None:
+        """
+        Collects per lane statistics of simulation runs. Totals (throughput,
+        delay, maximum queue, green time) come from counters kept by lanes,
+        so they are exact and almost free. Queue lengths are sampled every
+        interval steps into preallocated ring buffers for percentiles,
+        older samples are overwritten when buffers are full.
+        Pass it to Simulation.run in observers or set Simulation.observers.
+
+        Args:
+            capacity (int): number of samples kept in ring buffers
+            interval (int): steps between samples, number coprime with cycle
+                length avoids sampling the same point of lights cycle
+        """
+        self.capacity = capacity
+        self.interval = interval
+        self.lanes: List[Lane] = []
+        self.queue_lengths: np.ndarray = None
+        self.samples = 0
+        self.steps = 0
+
+    def start(self, simulation: Simulation) -> None:
+        crossroads = simulation.crossroad_network.crossroad_network
+        lanes = [lane for crossroad in crossroads
+                 for lane in crossroad.in_lanes.values()]
+        if self.queue_lengths is None or self.queue_lengths.shape[1] != len(lanes):
+            # buffers are allocated once and reused by following runs
+            self.queue_lengths = np.zeros((self.capacity, len(lanes)), dtype=np.uint16)
+            self.ticks = np.zeros(self.capacity, dtype=np.int64)
+        self.lane_keys = [(c_id, direction)
+                          for c_id, crossroad in enumerate(crossroads)
+                          for direction in crossroad.in_lanes]
+        self.crossroads = crossroads
+        self.lanes = lanes
+        self.queues = [lane.queue for lane in lanes]
+        self.samples = 0
+        # steps observed, runs from state or of day have other length than cycles
+        self.steps = 0
+        # samples are staged in list and copied to ring buffer in blocks,
+        # single numpy row assignment costs more than the whole sample
+        self.staged = []
+        self.staged_ticks = []
+
+    def observe(self, simulation: Simulation, tick: int, score: int) -> None:
+        self.steps += 1
+        if tick % self.interval:
+            return
+        self.staged.append(tuple(map(len, self.queues)))
+        self.staged_ticks.append(tick)
+        if len(self.staged) >= 64:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Copies staged samples to ring buffers.
+        """
+        if not self.staged:
+            return
+        rows = (self.samples + np.arange(len(self.staged))) % self.capacity
+        self.queue_lengths[rows] = self.staged
+        self.ticks[rows] = self.staged_ticks
+        self.samples += len(self.staged)
+        self.staged = []
+        self.staged_ticks = []
+
+    def finish(self, simulation: Simulation) -> None:
+        self.flush()
+        self.throughput = np.array([lane.processed_cars for lane in self.lanes])
+        # cars still waiting at the end add their current waiting time
+        self.total_delay = np.array([lane.total_delay +
+                                     sum(car.waiting_time for car in lane.queue)
+                                     for lane in self.lanes])
+        self.max_queue = np.array([lane.max_queue for lane in self.lanes])
+        self.busy_green_time = np.array([lane.busy_green_time for lane in self.lanes])
+        self.green_time = np.array([lane.green_time for lane in self.lanes])
+        self.blocked_time = np.array([lane.blocked_time for lane in self.lanes])
+
+    def window(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: indices of samples in ring buffers from oldest to newest
+        """
+        if self.samples <= self.capacity:
+            return np.arange(self.samples)
+        start = self.samples % self.capacity
+        return np.concatenate((np.arange(start, self.capacity), np.arange(start)))
+
+    def queue_percentiles(self, percentiles=(50, 95)) -> np.ndarray:
+        """
+        Queue length percentiles per lane over samples kept in ring buffer.
+
+        Args:
+            percentiles (tuple): percentiles to compute
+
+        Returns:
+            np.ndarray: array of shape (len(percentiles), lanes)
+        """
+        window = self.window()
+        if not len(window):
+            return np.zeros((len(percentiles), len(self.lanes)))
+        return np.percentile(self.queue_lengths[window], percentiles, axis=0)
+
+    def lane_summary(self) -> List[dict]:
+        """
+        Summary of every in lane in network for last run.
+
+        Returns:
+            List[dict]: crossroad, direction, queue percentiles and maximum,
+                throughput, total delay (turns waited), delay per processed car,
+                share of time with green light, share of green time
+                with cars waiting (utilisation) and turns blocked by full
+                next lane
+        """
+        p50, p95 = self.queue_percentiles((50, 95))
+        summary = []
+        for i, (c_id, direction) in enumerate(self.lane_keys):
+            green = int(self.green_time[i])
+            summary.append({
+                "crossroad": c_id,
+                "direction": direction.name,
+                "queue_p50": float(p50[i]),
+                "queue_p95": float(p95[i]),
+                "queue_max": int(self.max_queue[i]),
+                "throughput": int(self.throughput[i]),
+                "delay": int(self.total_delay[i]),
+                "delay_per_car": float(self.total_delay[i] / max(self.throughput[i], 1)),
+                "green_share": green / max(self.steps, 1),
+                "utilisation": float(self.busy_green_time[i] / green) if green else 0.0,
+                "blocked": int(self.blocked_time[i]),
+            })
+        return summary
+
+    def crossroad_summary(self) -> List[dict]:
+        """
+        Lane summary aggregated per crossroad.
+
+        Returns:
+            List[dict]: crossroad, maximum queue, throughput, delay and
+                worst lane (highest delay)
+        """
+        lanes = self.lane_summary()
+        summary = []
+        for c_id in range(len(self.crossroads)):
+            crossroad_lanes = [lane for lane in lanes if lane["crossroad"] == c_id]
+            worst = max(crossroad_lanes, key=lambda lane: lane["delay"])
+            summary.append({
+                "crossroad": c_id,
+                "queue_max": max(lane["queue_max"] for lane in crossroad_lanes),
+                "throughput": sum(lane["throughput"] for lane in crossroad_lanes),
+                "delay": sum(lane["delay"] for lane in crossroad_lanes),
+                "worst_lane": worst["direction"],
+            })
+        return summary
@@ -1,5 +1,27 @@
 import unittest
+import tempfile
+import time
+from statistics import fmean
 from scripts.simulation.simulation import *
+from scripts.simulation.recording import SimulationRecorder, load_recording, PHASE_INDEX
+from scripts.simulation.telemetry import TelemetryCollector
+from scripts.simulation.control import *
+from scripts.simulation.day import DemandProfile, DaySimulation, DayKernel
+from scripts.simulation.ensemble import ScenarioEnsemble
+from scripts.simulation import kernel
+from scripts.simulation.fluid import validate
+from scripts.optimalization.shared_data import SharedArrays, SharedMemoryEvaluator, attach_arrays
+
+SOLUTION = [
+    [{Direction.SOUTH: 10, Direction.WEST: 40, Direction.NORTH: 20, Direction.EAST: 30},
+     [Direction.NORTH, Direction.WEST, Direction.SOUTH, Direction.EAST]],
+    [{Direction.SOUTH: 25, Direction.WEST: 25, Direction.NORTH: 25, Direction.EAST: 25},
+     [Direction.SOUTH, Direction.WEST, Direction.NORTH, Direction.EAST]],
+    [{Direction.SOUTH: 30, Direction.WEST: 10, Direction.NORTH: 30, Direction.EAST: 30},
+     [Direction.NORTH, Direction.EAST, Direction.WEST, Direction.SOUTH]],
+    [{Direction.SOUTH: 20, Direction.WEST: 35, Direction.NORTH: 10, Direction.EAST: 35},
+     [Direction.SOUTH, Direction.NORTH, Direction.EAST, Direction.WEST]],
+]
 
 
 class TestCarProcessing(unittest.TestCase):
@@ -10,6 +32,837 @@ class TestCarProcessing(unittest.TestCase):
         self.assertEqual(
             cn.crossroad_network[2].in_lanes[Direction.NORTH].queue, [1, 3])
 
+    def test_sinks_count_trips_and_reuse_cars(self):
+        simulation = Simulation(cycles=5, seed=1, backend="python")
+        network = simulation.crossroad_network
+        score = simulation.run(SOLUTION)
+        created = simulation.car_pool.created
+        self.assertEqual(simulation.run(SOLUTION), score)
+        # cars of second run come from pool
+        self.assertEqual(simulation.car_pool.created, created)
+        trips = network.trip_summary()
+        queued = sum(len(lane.queue) for crossroad in network.crossroad_network
+                     for lane in crossroad.in_lanes.values())
+        self.assertEqual(trips["trips"] + queued, simulation.cycles * 24)
+        self.assertGreater(trips["left_network"], 0)
+        self.assertTrue(all(not sink.queue for crossroad in network.crossroad_network
+                            for sink in crossroad.sinks()))
+
+
+class StateReader:
+    """ Reads queues and lights directly after every step. """
+
+    def start(self, simulation):
+        self.queues = []
+        self.phases = []
+
+    def observe(self, simulation, tick, score):
+        crossroads = simulation.crossroad_network.crossroad_network
+        self.queues.append([len(lane.queue) for crossroad in crossroads
+                            for lane in crossroad.in_lanes.values()])
+        self.phases.append([PHASE_INDEX[crossroad.green_light_now]
+                            for crossroad in crossroads])
+
+    def finish(self, simulation):
+        pass
+
+
+class TestRecording(unittest.TestCase):
+    def test_recording_matches_simulation(self):
+        simulation = Simulation(cycles=3, seed=1)
+        score = simulation.run(SOLUTION)
+        recorder = SimulationRecorder()
+        reader = StateReader()
+        self.assertEqual(simulation.run(SOLUTION, (recorder, reader)), score)
+        self.assertEqual(recorder.queue_lengths.tolist(), reader.queues)
+        self.assertEqual(recorder.phases.tolist(), reader.phases)
+        self.assertEqual(int(recorder.scores.sum()), score)
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder.save(directory + "/recording")
+            recorder.save(directory + "/recording.npz", compressed=True)
+            for path in ("/recording", "/recording.npz"):
+                recording = load_recording(directory + path)
+                self.assertEqual(recording.score(), score)
+                self.assertEqual(recording.queue_lengths.tolist(), reader.queues)
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_lane_counters_match_recording(self):
+        simulation = Simulation(cycles=3, seed=1)
+        recorder = SimulationRecorder()
+        telemetry = TelemetryCollector(capacity=16, interval=7)
+        simulation.observers = (telemetry,)
+        simulation.run(SOLUTION, (recorder, telemetry))
+        self.assertEqual(telemetry.throughput.tolist(),
+                         recorder.discharges.sum(axis=0).tolist())
+        self.assertTrue((telemetry.max_queue >= recorder.queue_lengths.max(axis=0)).all())
+        # ring buffer keeps only last samples
+        self.assertEqual(len(telemetry.window()), 16)
+        self.assertEqual(telemetry.ticks[telemetry.window()[-1]], 357)
+        summary = telemetry.lane_summary()
+        self.assertEqual(len(summary), 16)
+        for crossroad in range(4):
+            green = sum(lane["green_share"] for lane in summary
+                        if lane["crossroad"] == crossroad)
+            self.assertAlmostEqual(green, 100 / 120, places=1)
+        # observers set on simulation are used when none are passed
+        simulation.run(SOLUTION)
+        self.assertEqual(telemetry.throughput.tolist(),
+                         recorder.discharges.sum(axis=0).tolist())
+
+    def test_partial_run_green_share(self):
+        simulation = Simulation(cycles=3, seed=1, backend="python")
+        state = simulation.warm_up(SOLUTION)
+        telemetry = TelemetryCollector()
+        simulation.run_from(state, SOLUTION, (telemetry,), ticks=60)
+        self.assertEqual(telemetry.steps, 60)
+        phases = kernel.phase_array(SOLUTION, simulation.turn_time)[:, :60]
+        for crossroad in range(4):
+            green = sum(lane["green_share"] for lane in telemetry.lane_summary()
+                        if lane["crossroad"] == crossroad)
+            self.assertAlmostEqual(green, (phases[crossroad] >= 0).mean())
+
+
+class TestAdaptiveControl(unittest.TestCase):
+    def test_controllers_run_through_simulation(self):
+        simulation = Simulation(cycles=3, seed=1)
+        plan_score = simulation.run(SOLUTION)
+        for controller_type in (ActuatedController, MaxPressureController):
+            reader = StateReader()
+            recorder = SimulationRecorder()
+            score = run_controlled(simulation, [controller_type() for _ in range(4)],
+                                   (reader, recorder), measure_latency=True)
+            self.assertEqual(int(recorder.scores.sum()), score)
+            self.assertIsNone(recorder.meta["plan"])
+            self.assertLess(latency_summary(simulation)["p50_us"], 1000)
+            # green light always changes through yellow
+            for before, after in zip(reader.phases, reader.phases[1:]):
+                for phase_before, phase_after in zip(before, after):
+                    if phase_before >= 0 and phase_after >= 0:
+                        self.assertEqual(phase_before, phase_after)
+        # plan run after controlled run doesn't use controllers
+        self.assertEqual(simulation.run(SOLUTION), plan_score)
+
+    def test_controllers_on_larger_grid(self):
+        with self.assertRaises(TypeError):
+            SignalController()
+        simulation = Simulation(cycles=2, seed=3, crossroad_network=GridNetwork(4, 5))
+        crossroads = simulation.crossroad_network.crossroad_network
+        plan_score = simulation.run([[{direction: 25 for direction in Direction},
+                                      list(Direction)]] * len(crossroads))
+        for controller_type in (ActuatedController, MaxPressureController):
+            reader = StateReader()
+            score = run_controlled(simulation, [controller_type() for _ in crossroads],
+                                   (reader,), measure_latency=True)
+            self.assertLess(score, plan_score)
+            self.assertTrue(all(crossroad.decision_times for crossroad in crossroads))
+            self.assertLess(latency_summary(simulation)["worst_crossroad_mean_us"], 1000)
+            for before, after in zip(reader.phases, reader.phases[1:]):
+                for phase_before, phase_after in zip(before, after):
+                    if phase_before >= 0 and phase_after >= 0:
+                        self.assertEqual(phase_before, phase_after)
+
+    def test_grid_network(self):
+        network = GridNetwork(3, 4)
+        self.assertEqual(len(network.entry_points()), 14)
+        self.assertEqual(network.route(0, 11), [Direction.EAST] * 3 + [Direction.SOUTH] * 2)
+        network.crossroad_network[5].out_lanes[Direction.EAST].add_car(1)
+        self.assertEqual(network.crossroad_network[6].in_lanes[Direction.WEST].queue, [1])
+
+
+class TestDaySimulation(unittest.TestCase):
+    def test_chunks_and_plan_schedule(self):
+        profile = DemandProfile([(0, 0.1), (1000, 0.6), (2000, 0.2)], length=3000, seed=3)
+        schedule = [(0, SOLUTION), (1500, SOLUTION[::-1])]
+        scores = [DaySimulation(profile, chunk_size=chunk_size).run(schedule)
+                  for chunk_size in (100, 700, 3000)]
+        self.assertEqual(len(set(scores)), 1)
+        simulation = DaySimulation(profile, chunk_size=100, backend="python")
+        self.assertEqual(simulation.run(schedule), scores[0])
+        self.assertNotEqual(simulation.run([(0, SOLUTION)]), scores[0])
+        trips = simulation.crossroad_network.trip_summary()
+        self.assertEqual(trips["left_network"], simulation.left_network)
+        self.assertGreater(trips["trips"], trips["left_network"])
+
+    def test_kernel_matches_objects(self):
+        profile = DemandProfile([(0, 0.1), (1000, 0.6), (2000, 0.2)], length=3000, seed=3)
+        schedule = [(0, SOLUTION), (1500, SOLUTION[::-1])]
+        expected = DaySimulation(profile, backend="python")
+        score = expected.run(schedule)
+        for compiled in {False, kernel.BACKEND == "numba"}:
+            simulation = DaySimulation(profile, chunk_size=700, backend="python")
+            simulation.kernel = DayKernel(simulation, compiled=compiled)
+            self.assertEqual(simulation.run(schedule), score)
+            self.assertEqual(simulation.left_network, expected.left_network)
+            # arrivals kept from first run
+            self.assertEqual(simulation.run(schedule), score)
+        self.assertEqual(simulation.evaluate([SOLUTION]),
+                         [1000000 / expected.run([(0, SOLUTION)])])
+        # profile not fitting in cache is streamed again
+        simulation.kernel.cache_bytes = 1000
+        simulation.kernel.arrivals_key = None
+        self.assertEqual(simulation.run(schedule), score)
+        self.assertIsNone(simulation.kernel.arrivals)
+        # observers run on crossroad objects
+        observer = StateReader()
+        self.assertEqual(simulation.run(schedule, [observer]), score)
+        self.assertEqual(len(observer.queues), profile.length)
+
+    def test_telemetry(self):
+        profile = DemandProfile([(0, 0.3)], length=600, seed=1)
+        simulation = DaySimulation(profile, backend="python")
+        telemetry = TelemetryCollector(interval=7)
+        score = simulation.run([(0, SOLUTION)], (telemetry,))
+        self.assertEqual(telemetry.steps, profile.length)
+        self.assertEqual(telemetry.ticks[telemetry.window()[-1]], 595)
+        self.assertEqual(int(telemetry.throughput.sum()),
+                         sum(lane.processed_cars for crossroad
+                             in simulation.crossroad_network.crossroad_network
+                             for lane in crossroad.in_lanes.values()))
+        phases = kernel.phase_array(SOLUTION, simulation.turn_time)
+        for crossroad in range(4):
+            green = sum(lane["green_share"] for lane in telemetry.lane_summary()
+                        if lane["crossroad"] == crossroad)
+            self.assertAlmostEqual(green, (phases[crossroad] >= 0).mean())
+        self.assertEqual(DaySimulation(profile).run([(0, SOLUTION)]), score)
+
+
+class TestEnsemble(unittest.TestCase):
+    def test_rejected_plan_on_incumbent_scale(self):
+        # the easiest scenarios first, plan worse there looks good on them alone
+        ensemble = ScenarioEnsemble((1, 5, 0, 2, 3, 4), cycles=2,
+                                    min_scenarios=2, batch_size=1)
+        rng = random.Random(0)
+        plan = [random_plan(rng, 4) for _ in range(61)][-1]
+        ensemble.set_incumbent(SOLUTION)
+        incumbent = fmean(ensemble.incumbent_scores)
+        result = ensemble.evaluate(plan)
+        self.assertEqual(result["decision"], "worse")
+        self.assertEqual(result["scenarios"], 2)
+        self.assertLess(fmean(result["scores"]), incumbent)
+        differences = [score - ensemble.incumbent_scores[i]
+                       for i, score in enumerate(result["scores"])]
+        self.assertAlmostEqual(result["mean"], incumbent + fmean(differences))
+        # ranked below incumbent scored on all scenarios
+        self.assertLess(ensemble.fitness(plan), ensemble.fitness(SOLUTION))
+
+    def test_batch_matches_simulation_runs(self):
+        expected = [Simulation(120, 2, seed=seed, backend="python").run(SOLUTION)
+                    for seed in range(6)]
+        for backend in ("python", kernel.BACKEND):
+            ensemble = ScenarioEnsemble(range(6), cycles=2, backend=backend)
+            self.assertEqual(ensemble.run_batch(SOLUTION, range(6)), expected)
+
+    def test_sequential_stopping(self):
+        ensemble = ScenarioEnsemble(range(6), cycles=2, min_scenarios=2, batch_size=1)
+        self.assertEqual(ensemble.evaluate(SOLUTION)["decision"], "first")
+        self.assertIs(ensemble.incumbent, SOLUTION)
+        # the same plan is never worse, so it is simulated on all scenarios
+        result = ensemble.evaluate(SOLUTION)
+        self.assertEqual(result["decision"], "tie")
+        self.assertEqual(result["scenarios"], 6)
+
+    def test_t_quantile(self):
+        from scripts.simulation.ensemble import t_quantile
+        # values of Student t tables
+        for confidence, df, expected in ((0.95, 1, 12.706), (0.95, 2, 4.303),
+                                         (0.95, 3, 3.182), (0.95, 10, 2.228),
+                                         (0.99, 30, 2.750), (0.90, 120, 1.658)):
+            self.assertAlmostEqual(t_quantile(confidence, df), expected, places=3)
+
+
+def random_plan(rng, crossroads):
+    plan = []
+    for _ in range(crossroads):
+        times = [rng.uniform(1, 60) for _ in Direction]
+        order = list(Direction)
+        rng.shuffle(order)
+        plan.append([{direction: time / sum(times) * 100
+                      for direction, time in zip(Direction, times)}, order])
+    return plan
+
+
+class TestKernel(unittest.TestCase):
+    def check_backend(self, compiled):
+        rng = random.Random(5)
+        for network, cycles, capacity in ((CrossroadNetwork, 5, None), (CrossroadNetwork, 5, 3),
+                                          (lambda: GridNetwork(3, 4), 3, None)):
+            for seed in range(3):
+                simulation = Simulation(cycles=cycles, seed=seed, crossroad_network=network(),
+                                        backend="python", lane_capacity=capacity)
+                flat = kernel.FlatKernel(simulation, compiled=compiled)
+                for _ in range(3):
+                    plan = random_plan(rng, len(simulation.crossroad_network.crossroad_network))
+                    self.assertEqual(flat.run(plan), simulation.run(plan))
+
+    def test_phase_array(self):
+        rng = random.Random(1)
+        crossroad = Crossroad()
+        for _ in range(20):
+            plan = random_plan(rng, 1)
+            crossroad.lights_times, crossroad.lights_order = plan[0]
+            crossroad.lights_cycle = crossroad.generate_cycle()
+            table = [kernel.DIRECTION_INDEX.get(direction, -1)
+                     for direction in crossroad.generate_phase_table(120)]
+            self.assertEqual(kernel.phase_array(plan, 120)[0].tolist(), table)
+
+    def test_capacity_changed_after_construction(self):
+        rng = random.Random(2)
+        simulation = Simulation(cycles=3, seed=1, backend="python")
+        flat = kernel.FlatKernel(simulation, compiled=False)
+        plan = random_plan(rng, 4)
+        for capacity in (3, 6, None):
+            simulation.crossroad_network.set_lane_capacity(capacity)
+            self.assertEqual(flat.run(plan), simulation.run(plan))
+        simulation.crossroad_network.crossroad_network[2].in_lanes[Direction.NORTH].capacity = 1
+        self.assertEqual(flat.run(plan), simulation.run(plan))
+
+    def test_flat_loop_matches_objects(self):
+        self.check_backend(compiled=False)
+
+    @unittest.skipIf(kernel.numba is None, "numba is not installed")
+    def test_compiled_matches_objects(self):
+        self.check_backend(compiled=True)
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_fork_matches_continued_run(self):
+        rng = random.Random(3)
+        for backend in ("python", kernel.BACKEND):
+            simulation = Simulation(cycles=3, seed=2, backend=backend, lane_capacity=4)
+            warm, plan = random_plan(rng, 4), random_plan(rng, 4)
+            state = simulation.warm_up(warm, 2)
+            self.assertTrue(state.cars)
+            # the same turns in one go: warm up, then plan from start of its cycle
+            simulation.init_corssroad_params(warm)
+            for _ in range(2):
+                for t in range(simulation.turn_time):
+                    simulation.step(t)
+            for crossroad, (lights_times, lights_order) in zip(
+                    simulation.crossroad_network.crossroad_network, plan):
+                crossroad.lights_times, crossroad.lights_order = lights_times, lights_order
+                crossroad.lights_cycle = crossroad.generate_cycle()
+            continued = sum(simulation.step(t) for _ in range(3)
+                            for t in range(simulation.turn_time))
+            self.assertEqual(simulation.run_from(state, plan), continued)
+            self.assertEqual(kernel.FlatKernel(simulation, compiled=False).run(plan, state),
+                             continued)
+
+    def test_resume_mid_cycle_matches_full_run(self):
+        rng = random.Random(5)
+        plan = random_plan(rng, 4)
+        for backend in ("python", kernel.BACKEND):
+            simulation = Simulation(cycles=3, seed=2, backend=backend, lane_capacity=4)
+            full = simulation.run(plan)
+            total = simulation.cycles * simulation.turn_time
+            for split in (173, 240, 301):
+                simulation.init_corssroad_params(plan)
+                first = sum(simulation.step(tick % simulation.turn_time)
+                            for tick in range(split))
+                state = simulation.snapshot(split)
+                self.assertEqual(first + simulation.run_from(state, plan, ticks=total - split),
+                                 full)
+                self.assertEqual(first + kernel.FlatKernel(simulation, compiled=False)
+                                 .run(plan, state, total - split), full)
+
+
+class TestIncremental(unittest.TestCase):
+    def test_children_match_full_runs(self):
+        from copy import deepcopy
+        from scripts.simulation.incremental import IncrementalEvaluator
+        rng = random.Random(6)
+        simulation = Simulation(cycles=3, seed=4, backend="python", lane_capacity=5)
+        incremental = IncrementalEvaluator(
+            Simulation(cycles=3, seed=4, backend="python", lane_capacity=5), capacity=8)
+        plans = [random_plan(rng, 4) for _ in range(4)]
+        for _ in range(30):
+            child = deepcopy(rng.choice(plans))
+            # change of the last light of one crossroad keeps long prefix
+            lights_times, lights_order = child[rng.randrange(4)]
+            lights_times[lights_order[-1]] += rng.uniform(-3, 3)
+            plans.append(child)
+            self.assertEqual(incremental.evaluate(child), simulation.run(child))
+        self.assertLess(incremental.average_ticks(), simulation.cycles * simulation.turn_time)
+
+    def test_demand_change_and_rejected_cars(self):
+        from copy import deepcopy
+        from scripts.simulation.incremental import IncrementalEvaluator
+        rng = random.Random(7)
+        simulation = Simulation(cycles=2, seed=4, backend="python", lane_capacity=2)
+        incremental = IncrementalEvaluator(
+            Simulation(cycles=2, seed=4, backend="python", lane_capacity=2), capacity=8)
+        plan = random_plan(rng, 4)
+        child = deepcopy(plan)
+        lights_times, lights_order = child[0]
+        lights_times[lights_order[-1]] += 2
+        for car_adder in (simulation.car_adder, Simulation(seed=9).car_adder):
+            simulation.car_adder = car_adder
+            incremental.simulation.car_adder = car_adder
+            for genome in (plan, child, plan):
+                self.assertEqual(incremental.evaluate(genome), simulation.run(genome))
+                self.assertEqual(incremental.simulation.rejected_cars, simulation.rejected_cars)
+            self.assertGreater(simulation.rejected_cars, 0)
+            self.assertEqual(len(incremental.trajectories), 2)
+
+
+class TestLaneCapacity(unittest.TestCase):
+    def test_spillback_and_rejected_demand(self):
+        # north and south lanes get minimal green time
+        plan = [[{Direction.SOUTH: 5, Direction.WEST: 45, Direction.NORTH: 5, Direction.EAST: 45},
+                 list(Direction)] for _ in range(4)]
+        unbounded = Simulation(cycles=20, seed=2, backend="python")
+        unbounded.run(plan)
+        for penalty in (0, 1000):
+            simulation = Simulation(cycles=20, seed=2, backend="python",
+                                    lane_capacity=4, rejection_penalty=penalty)
+            score = simulation.run(plan)
+            if penalty:
+                self.assertEqual(score - first_score, 1000 * simulation.rejected_cars)
+            first_score = score
+        lanes = [lane for crossroad in simulation.crossroad_network.crossroad_network
+                 for lane in crossroad.in_lanes.values()]
+        self.assertLessEqual(max(lane.max_queue for lane in lanes), 4)
+        self.assertGreater(simulation.rejected_cars, 0)
+        self.assertGreater(sum(lane.blocked_time for lane in lanes), 0)
+        self.assertGreater(max(lane.max_queue for crossroad in unbounded.crossroad_network
+                               .crossroad_network for lane in crossroad.in_lanes.values()), 4)
+
+
+class TestFluidEstimator(unittest.TestCase):
+    def test_ranks_plans_like_simulation(self):
+        rng = random.Random(2)
+        plans = [random_plan(rng, 4) for _ in range(30)]
+        result = validate(plans, seeds=range(3))
+        self.assertGreater(result["rank_correlation"], 0.85)
+        self.assertLess(abs(result["median_ratio"] - 1), 0.25)
+
+
+class TestSharedData(unittest.TestCase):
+    def test_shared_arrays_lifecycle(self):
+        import numpy as np
+        shared = SharedArrays({"a": np.arange(10), "b": np.ones((3, 4), dtype=np.int8)})
+        memory, arrays = attach_arrays(shared.descriptor)
+        self.assertEqual(arrays["a"].tolist(), list(range(10)))
+        self.assertFalse(arrays["b"].flags.writeable)
+        del arrays
+        memory.close()
+        shared.close()
+        with self.assertRaises(FileNotFoundError):
+            attach_arrays(shared.descriptor)
+
+    def test_evaluator_matches_fitness(self):
+        from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+        rng = random.Random(4)
+        genomes = [random_plan(rng, 4) for _ in range(9)]
+        optimizer = TrafficLightsOptGentetic(Control(), seed=3, cycles=2)
+        with SharedMemoryEvaluator(2, seed=3, cycles=2) as evaluator:
+            self.assertEqual(evaluator(genomes), [optimizer.fitness(g) for g in genomes])
+            # bigger population replaces shared block
+            self.assertEqual(evaluator(genomes * 2), [optimizer.fitness(g) for g in genomes * 2])
+        # workers use capacity and penalty of parent
+        simulation = Simulation(cycles=2, seed=3, lane_capacity=2, rejection_penalty=500,
+                                backend="python")
+        with SharedMemoryEvaluator(2, seed=3, cycles=2, lane_capacity=2,
+                                   rejection_penalty=500) as evaluator:
+            self.assertEqual(evaluator(genomes),
+                             [1000000 / simulation.run(g) for g in genomes])
+
+
+class TestSelection(unittest.TestCase):
+    def test_batch_selection(self):
+        from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+        optimizer = TrafficLightsOptGentetic(Control())
+        population = [(i, 1.0 if i == 0 else 0.0) for i in range(50)]
+        for selection in (optimizer.selection_weights, optimizer.selection_ranking,
+                          optimizer.selection_tournament):
+            pairs = selection(population, 40)
+            self.assertEqual(len(pairs), 40)
+            self.assertTrue(all(0 <= parent < 50 for pair in pairs for parent in pair))
+        # zero fitness is never drawn
+        self.assertEqual({parent for pair in optimizer.selection_weights(population, 40)
+                          for parent in pair}, {0})
+        # tournament of whole population with few draws prefers the best
+        winners = [parent for pair in optimizer.selection_tournament(population, 200, 10)
+                   for parent in pair]
+        self.assertLess(sum(winners) / len(winners), 5)
+
+    def test_tournament_run_is_repeatable(self):
+        from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+        histories = []
+        for _ in range(2):
+            random.seed(8)
+            optimizer = TrafficLightsOptGentetic(Control(), population_size=20, cycles=2,
+                                                 seed=8, selection_type="turniej")
+            _, history = optimizer.genetic_algorthm.run_evolution_gui(
+                4, 0.1, lambda generation, fitness: None)
+            histories.append(history)
+        self.assertEqual(histories[0], histories[1])
+        self.assertEqual(len(histories[0]), 4)
+
+
+class TestTermination(unittest.TestCase):
+    def test_criteria(self):
+        from scripts.optimalization.genetic_algorithm import Termination
+        termination = Termination(stagnation_generations=2, min_improvement=0.1)
+        self.assertEqual([termination.check(fitness, 0) for fitness in (1, 2, 2.1, 2.15)],
+                         [None, None, None, "stagnation"])
+        self.assertEqual(Termination(max_evaluations=100).check(1, 100), "evaluations")
+        self.assertEqual(Termination(max_seconds=0).check(1, 0), "time")
+
+    def test_run_reports_reason(self):
+        from scripts.optimalization.genetic_algorithm import (
+            TrafficLightsOptGentetic, Control, Termination)
+        random.seed(9)
+        optimizer = TrafficLightsOptGentetic(Control(), population_size=10, cycles=2, seed=9,
+                                             termination=Termination(max_evaluations=25))
+        genetic_algorithm = optimizer.genetic_algorthm
+        _, history = genetic_algorithm.run_evolution_gui(50, 0.1, lambda generation, fitness: None)
+        self.assertEqual(genetic_algorithm.stop_reason, "evaluations")
+        self.assertLess(len(history), 50)
+        evaluations, best = zip(*genetic_algorithm.evaluation_history)
+        self.assertEqual(len(evaluations), len(history))
+        self.assertGreaterEqual(evaluations[-1], 25)
+        self.assertLess(evaluations[-2], 25)
+        self.assertEqual(list(best), sorted(best))
+        genetic_algorithm.termination = None
+        genetic_algorithm.run_evolution_gui(2, 0.1, lambda generation, fitness: None)
+        self.assertEqual(genetic_algorithm.stop_reason, "generations")
+
+
+class TestCli(unittest.TestCase):
+    CONFIGS = {
+        # without elitism and hot enough to accept worse plans, so the
+        # best plan is not necessarily the last one
+        "genetic": {"population_size": 6, "generations": 3, "elitism_perc": 0},
+        "annealing": {"temperature": 100000, "alfa": 0.5, "min_temperature": 1000},
+        "cmaes": {"population_size": 4, "generations": 2, "seed": 0},
+        "nsga2": {"population_size": 6, "generations": 2, "seed": 0},
+    }
+
+    def setUp(self):
+        import signal
+        # optimizers install their own SIGINT and SIGTERM handlers
+        self.handlers = {number: signal.getsignal(number)
+                         for number in (signal.SIGINT, signal.SIGTERM)}
+
+    def tearDown(self):
+        import signal
+        for number, handler in self.handlers.items():
+            signal.signal(number, handler)
+
+    def run_main(self, config, *args):
+        import io
+        import json
+        from contextlib import redirect_stdout
+        from scripts.cli import main
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + "/config.json"
+            with open(path, "w") as file:
+                file.write(config if isinstance(config, str) else json.dumps(config))
+            output = io.StringIO()
+            with redirect_stdout(output):
+                self.assertEqual(main([path, *args]), 0)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_optimizers(self):
+        from scripts.simulation.plan_io import plan_from_json
+        for optimizer_type, options in self.CONFIGS.items():
+            config = {"network": {"cycles": 1}, "demand": {"seed": 2},
+                      "optimizer": dict(options, type=optimizer_type)}
+            *events, result = self.run_main(config, "--progress")
+            self.assertTrue(events)
+            self.assertTrue(all(event["event"] in ("generation", "step") for event in events))
+            for key in ("optimizer", "best_plan", "metric", "evaluations",
+                        "elapsed", "workers"):
+                self.assertIn(key, result)
+            self.assertEqual(result["optimizer"], optimizer_type)
+            score = Simulation(cycles=1, seed=2).run(plan_from_json(result["best_plan"]))
+            if result["metric"] == "fitness":
+                self.assertAlmostEqual(result["best_fitness"], 1000000 / score)
+                self.assertEqual(result["best_fitness"], max(result["history"]))
+            else:
+                self.assertEqual(result["best_score"], score)
+                self.assertTrue(all(event["best_score"] >= score for event in events))
+
+    def test_nsga2_workers(self):
+        config = {"network": {"cycles": 1}, "demand": {"seed": 2},
+                  "optimizer": dict(self.CONFIGS["nsga2"], type="nsga2")}
+        sequential, parallel = (self.run_main(config, "--workers", workers)[-1]
+                                for workers in ("1", "2"))
+        self.assertEqual(parallel["pareto_front"], sequential["pareto_front"])
+        self.assertEqual(parallel["workers"], 2)
+
+    def test_bad_config(self):
+        import io
+        from contextlib import redirect_stderr
+        for config, message in (("{not json", "cannot read config"),
+                                ('["genetic"]', "must be objects"),
+                                ('{"optimizer": {"type": "swarm"}}', "unknown optimizer"),
+                                ('{"optimizer": {"termination": {"max_time": 5}}}',
+                                 "unknown termination key"),
+                                ('{"optimizer": {"termination": {"max_evaluations": "100"}}}',
+                                 "must be an integer"),
+                                ('{"optimizer": {"termination": [10]}}', "must be an object")):
+            with redirect_stderr(io.StringIO()) as errors, self.assertRaises(SystemExit) as exit:
+                self.run_main(config)
+            self.assertEqual(exit.exception.code, 2)
+            self.assertIn(message, errors.getvalue())
+
+
+class TestRollingHorizon(unittest.TestCase):
+    def test_fitness_cache(self):
+        from copy import deepcopy
+        from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+        optimizer = TrafficLightsOptGentetic(Control(), population_size=4, cycles=1, seed=6)
+        genetic_algorithm = optimizer.genetic_algorthm
+        genetic_algorithm.cache_size = 5
+        first_demand = optimizer.simulation.car_adder
+        genome = random_plan(random.Random(6), 4)
+        sorted_solutions = genetic_algorithm.sort_solutions([genome, deepcopy(genome)])
+        self.assertEqual(sorted_solutions[0][1], sorted_solutions[1][1])
+        self.assertEqual(sorted_solutions[0][1], optimizer.fitness(genome))
+        self.assertEqual((genetic_algorithm.evaluations, genetic_algorithm.cache_hits), (1, 1))
+        rng = random.Random(7)
+        genetic_algorithm.sort_solutions([random_plan(rng, 4) for _ in range(6)])
+        self.assertEqual(len(genetic_algorithm.cache), 5)
+        self.assertNotIn(optimizer.genome_key(genome), genetic_algorithm.cache)
+        optimizer.set_demand(Simulation(cycles=1, seed=8).car_adder)
+        self.assertEqual(len(genetic_algorithm.cache), 0)
+        self.assertEqual(genetic_algorithm.sort_solutions([genome])[0][1],
+                         optimizer.fitness(genome))
+        self.assertEqual(genetic_algorithm.evaluations, 8)
+        # caches of demands that come back are used again
+        fitness = optimizer.fitness(genome)
+        optimizer.set_demand(first_demand)
+        self.assertEqual(len(genetic_algorithm.cache), 5)
+        optimizer.set_demand(Simulation(cycles=1, seed=8).car_adder)
+        self.assertEqual(genetic_algorithm.sort_solutions([genome])[0][1], fitness)
+        self.assertEqual(genetic_algorithm.evaluations, 8)
+
+    def test_warm_start_reuses_population(self):
+        from scripts.optimalization.rolling_horizon import (
+            RollingHorizonOptimizer, drifting_windows, compare_with_cold_start)
+        demand = drifting_windows(2, drift=0.25, seed=6)
+        self.assertLessEqual(sum(a != b for a, b in zip(*demand)), 30)
+        self.assertNotEqual(demand[0], demand[1])
+        random.seed(6)
+        for warm_start in (True, False):
+            optimizer = RollingHorizonOptimizer(generations=2, warm_start=warm_start,
+                                                immigrants=0.5, population_size=6, cycles=1)
+            genetic_algorithm = optimizer.genetic_algorithm
+            optimizer.optimize_window(demand[0])
+            previous = genetic_algorithm.final_population
+            populations = []
+            sort_solutions = genetic_algorithm.sort_solutions
+            genetic_algorithm.sort_solutions = \
+                lambda population: populations.append(list(population)) or \
+                sort_solutions(population)
+            result = optimizer.optimize_window(demand[1])
+            self.assertEqual(populations[0][:3] == previous[:3], warm_start)
+            self.assertEqual(len(result["history"]), 2)
+        report = compare_with_cold_start(demand, generations=2, population_size=6, cycles=1)
+        self.assertEqual([row["window"] for row in report], [0, 1])
+        self.assertTrue(all(row["cold_time_to_solution"] is not None for row in report))
+
+
+class TestThreadPool(unittest.TestCase):
+    def test_threads_match_sequential(self):
+        from scripts.optimalization.parallel import ThreadPoolEvaluator, gil_enabled
+        rng = random.Random(10)
+        genomes = [random_plan(rng, 4) for _ in range(30)]
+        simulation = Simulation(cycles=2, seed=10)
+        expected = [1000000 / simulation.run(genome) for genome in genomes]
+        with ThreadPoolEvaluator(3, cycles=2, seed=10) as evaluator:
+            self.assertEqual(evaluator.threaded,
+                             not gil_enabled() or simulation.kernel is not None)
+            self.assertEqual(evaluator(genomes), expected)
+            other = Simulation(cycles=2, seed=11)
+            evaluator.set_demand(other.car_adder)
+            self.assertEqual(evaluator(genomes[:5]),
+                             [1000000 / other.run(genome) for genome in genomes[:5]])
+
+
+class TestAllocationBudget(unittest.TestCase):
+    def test_simulation_run(self):
+        from scripts.memory_profile import profile_run, BUDGETS
+        simulation = Simulation(seed=12, backend="python")
+        record = profile_run(simulation, random_plan(random.Random(12), 4), runs=2)
+        self.assertLessEqual(record["peak"], BUDGETS["run_peak"])
+        self.assertLessEqual(record["retained"], BUDGETS["run_retained"])
+        self.assertLessEqual(record["cars_created"], BUDGETS["run_cars_created"])
+
+    def test_generation(self):
+        from scripts.memory_profile import profile_generations, BUDGETS
+        from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+        random.seed(12)
+        optimizer = TrafficLightsOptGentetic(Control(), population_size=10, cycles=1, seed=12)
+        optimizer.simulation = Simulation(cycles=1, seed=12, backend="python")
+        records = profile_generations(optimizer, 3)
+        self.assertEqual(len(records), 3)
+        self.assertIn("optimalization.genetic_algorithm", records[0]["subsystems"])
+        self.assertLessEqual(records[2]["peak"] / 10, BUDGETS["evaluation_peak"])
+        self.assertLessEqual(records[2]["retained"] / 10, BUDGETS["evaluation_retained"])
+
+
+class TestPhaseOrderSearch(unittest.TestCase):
+    def test_lane_scores_sum_to_score(self):
+        from scripts.optimalization.phase_order import lane_scores
+        simulation = Simulation(cycles=2, seed=8, backend="python")
+        for seed in range(3):
+            score = simulation.run(random_plan(random.Random(seed), 4))
+            self.assertEqual(lane_scores(simulation).sum(), score)
+
+    def test_matches_brute_force(self):
+        from itertools import product
+        from scripts.optimalization.phase_order import PhaseOrderSearch, ORDERS
+        simulation = Simulation(cycles=2, seed=8)
+        plan = random_plan(random.Random(8), 4)
+        search = PhaseOrderSearch(simulation)
+        best_plan, score = search.optimize(plan, crossroads=[0, 1])
+        brute = min(simulation.run([[plan[0][0], ORDERS[first]], [plan[1][0], ORDERS[second]],
+                                    plan[2], plan[3]])
+                    for first, second in product(range(len(ORDERS)), repeat=2))
+        self.assertEqual(score, brute)
+        self.assertEqual(simulation.run(best_plan), brute)
+        self.assertEqual(best_plan[2:], plan[2:])
+        self.assertLess(search.runs, len(ORDERS) ** 2)
+        runs = search.runs
+        self.assertEqual(search.optimize(plan, crossroads=[0, 1])[1], brute)
+        self.assertEqual(search.runs, runs)
+        with self.assertRaises(ValueError):
+            PhaseOrderSearch(Simulation(cycles=2, seed=8, lane_capacity=5))
+
+
+class TestCMAES(unittest.TestCase):
+    def test_improves_equal_plan(self):
+        from scripts.optimalization.cma_es import CMAES
+        simulation = Simulation(cycles=2, seed=5)
+        cma = CMAES(simulation, seed=0)
+        equal_fitness = 1000000 / simulation.run(cma.plan(cma.mean))
+        plan, history = cma.run(6)
+        self.assertEqual(len(history), 6)
+        self.assertEqual(history, sorted(history))
+        self.assertGreater(history[-1], equal_fitness)
+        self.assertAlmostEqual(1000000 / simulation.run(plan), history[-1])
+        for lights_times, _ in plan:
+            self.assertAlmostEqual(sum(lights_times.values()), 100)
+            self.assertGreaterEqual(min(lights_times.values()), 5 - 1e-9)
+
+
+class TestNSGA2(unittest.TestCase):
+    def test_sort_and_crowding(self):
+        import numpy as np
+        from scripts.optimalization.nsga2 import non_dominated_sort, crowding_distance
+        objectives = np.array([[1, 5], [2, 3], [3, 1], [2, 4], [4, 4], [3, 3]], dtype=float)
+        fronts = non_dominated_sort(objectives)
+        self.assertEqual(fronts.tolist(), [0, 0, 0, 1, 2, 1])
+        distance = crowding_distance(objectives, fronts)
+        self.assertEqual(distance[1], 2.0)
+        self.assertTrue(np.isinf(distance[[0, 2, 3, 4, 5]]).all())
+
+    def test_front_from_one_pass(self):
+        from scripts.optimalization.genetic_algorithm import Control
+        from scripts.optimalization.nsga2 import TrafficLightsNSGA2, OBJECTIVES
+        optimizer = TrafficLightsNSGA2(Control(), population_size=12, cycles=2, seed=1)
+        front = optimizer.run(3)
+        self.assertEqual(optimizer.nsga2.evaluations, 12 * 4)
+        simulation = Simulation(cycles=2, seed=1, backend="python")
+        for point in front:
+            self.assertEqual(set(point["objectives"]), set(OBJECTIVES))
+            self.assertEqual(point["objectives"]["waiting_time"], simulation.run(point["plan"]))
+            self.assertEqual(point["objectives"]["throughput"],
+                             simulation.crossroad_network.trip_summary()["trips"])
+        waiting = [point["objectives"]["waiting_time"] for point in front]
+        self.assertEqual(waiting, sorted(waiting))
+
+    def test_construction_keeps_random_stream(self):
+        from scripts.optimalization.genetic_algorithm import Control
+        from scripts.optimalization.nsga2 import TrafficLightsNSGA2
+        fronts = []
+        for _ in range(2):
+            random.seed(5)
+            state = random.getstate()
+            optimizer = TrafficLightsNSGA2(Control(), population_size=6, cycles=1, seed=2)
+            self.assertEqual(random.getstate(), state)
+            fronts.append([point["objectives"] for point in optimizer.run(2)])
+        self.assertEqual(fronts[0], fronts[1])
+
+
+class TestEvaluationArchive(unittest.TestCase):
+    def test_runs_share_archive(self):
+        import os
+        from scripts.optimalization.archive import EvaluationArchive, ArchivedEvaluator
+        rng = random.Random(6)
+        genomes = [random_plan(rng, 4) for _ in range(10)]
+        simulation = Simulation(cycles=2, seed=6)
+        expected = [1000000 / simulation.run(genome) for genome in genomes]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "evaluations.db")
+            with EvaluationArchive(path, batch_size=4) as archive:
+                first = ArchivedEvaluator(archive, Simulation(cycles=2, seed=6))
+                self.assertEqual(first(genomes + genomes[:3]), expected + expected[:3])
+                self.assertEqual((first.evaluations, first.hits), (10, 3))
+            # other run, other connection
+            with EvaluationArchive(path) as archive:
+                self.assertEqual(len(archive), 10)
+                second = ArchivedEvaluator(archive, Simulation(cycles=2, seed=6))
+                self.assertEqual(second(genomes), expected)
+                self.assertEqual(second.evaluations, 0)
+                second.set_demand(Simulation(cycles=2, seed=7).car_adder)
+                second(genomes[:2])
+                self.assertEqual(second.evaluations, 2)
+
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        from scripts.optimalization.genetic_algorithm import TrafficLightsOptGentetic, Control
+        rng = random.Random(4)
+        self.genomes = [random_plan(rng, 4) for _ in range(9)]
+        optimizer = TrafficLightsOptGentetic(Control(), seed=3, cycles=2)
+        self.expected = [optimizer.fitness(genome) for genome in self.genomes]
+
+    def test_local_workers_and_stealing(self):
+        from scripts.optimalization.distributed import BrokerEvaluator
+        with BrokerEvaluator(local_workers=2, seed=3, cycles=2) as evaluator:
+            self.assertEqual(evaluator(self.genomes), self.expected)
+            # chunks held by slow worker are stolen by idle one
+            broker = evaluator.broker
+            slow = broker.register("slow")
+            batch = broker.submit(self.genomes, 3)
+            taken = broker.take(slow, 3, 0)
+            self.assertEqual(broker.collect(batch, 30), self.expected)
+            self.assertGreaterEqual(broker.stats()["stolen"], len(taken))
+
+    def test_lost_worker_is_resubmitted(self):
+        from scripts.optimalization.distributed import Broker
+        now = [0.0]
+        broker = Broker(lease_timeout=30, clock=lambda: now[0])
+        lost = broker.register("lost")
+        busy = broker.register("busy")
+        batch = broker.submit(self.genomes, 3)
+        self.assertEqual(len(broker.take(lost, 2, 0)), 2)
+        busy_tasks = broker.take(busy, 1, 0)
+        now[0] = 20
+        self.assertTrue(broker.renew(busy))
+        now[0] = 40
+        stats = broker.stats()
+        self.assertEqual((stats["lost_workers"], stats["resubmitted"]), (1, 2))
+        self.assertFalse(broker.renew(lost))
+        simulation = Simulation(cycles=2, seed=3)
+        for task_id, _, genomes in busy_tasks + broker.take(busy, 2, 0):
+            broker.complete(busy, task_id,
+                            [1000000 / simulation.run(genome) for genome in genomes])
+        self.assertEqual(broker.collect(batch, 0), self.expected)
+        self.assertEqual(broker.stats()["duplicates"], 0)
+
+    def test_key_is_random(self):
+        from scripts.optimalization.distributed import BrokerEvaluator
+        with BrokerEvaluator(seed=3, cycles=2) as first, \
+                BrokerEvaluator(seed=3, cycles=2) as second:
+            self.assertEqual(len(first.authkey), 16)
+            self.assertNotEqual(first.authkey, second.authkey)
+
 
 if __name__ == "__main__":
     unittest.main()